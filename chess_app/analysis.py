@@ -0,0 +1,236 @@
+# analysis.py
+import logging
+import math
+import multiprocessing
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+import chess
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import engine
+from .models import GameAnalysis, Move
+from .utils import decode_move
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'ANALYSIS', {})
+NODE_BUDGET = _config.get('NODES', 3000)
+MAX_DEPTH = _config.get('MAX_DEPTH', 6)
+BATCH_SIZE = _config.get('BATCH_SIZE', 20)
+CHUNK_SIZE = 16  # Positions per process pool task
+
+# Drop in the mover's winning chances, in percentage points, that makes a move an
+# inaccuracy, a mistake or a blunder
+THRESHOLDS = (('b', 30), ('m', 20), ('i', 10))
+
+
+def pack_evaluations(scores):
+    return array('h', scores).tobytes()
+
+
+def unpack_evaluations(data):
+    scores = array('h')
+    scores.frombytes(bytes(data))
+    return scores.tolist()
+
+
+def win_chance(cp):
+    """Winning chances in percent for a centipawn score, as lichess models them."""
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * cp)) - 1)
+
+
+def annotate(scores):
+    """
+    Classifies each move of a game from the white-relative scores after every
+    ply. Returns (annotations, white accuracy, black accuracy).
+    """
+    annotations = []
+    accuracies = ([], [])  # white's moves, black's moves
+    for ply in range(1, len(scores)):
+        white_moved = ply % 2 == 1
+        before, after = win_chance(scores[ply - 1]), win_chance(scores[ply])
+        drop = max(before - after if white_moved else after - before, 0)
+        annotations.append(next((code for code, threshold in THRESHOLDS if drop >= threshold), '.'))
+        accuracies[0 if white_moved else 1].append(min(max(103.1668 * math.exp(-0.04354 * drop) - 3.1669, 0), 100))
+    white, black = (sum(values) / len(values) if values else None for values in accuracies)
+    return ''.join(annotations), white, black
+
+
+def position_key(board):
+    # The move counters do not change the evaluation, so positions reached at different moves are shared
+    return board.fen(en_passant='legal').rsplit(' ', 2)[0]
+
+
+def game_positions(game_ids):
+    """
+    Replays the move logs of the given games with one query. Returns
+    {game_id: [position key after each ply, from the start]}.
+    """
+    positions = {game_id: [] for game_id in game_ids}
+    boards = {}
+    moves = Move.objects.filter(game_id__in=game_ids).order_by('game_id', 'ply').values_list('game_id', 'move')
+    for game_id, encoded in moves.iterator(chunk_size=2000):
+        board = boards.get(game_id)
+        if board is None:
+            board = boards[game_id] = chess.Board()
+            positions[game_id].append(position_key(board))
+        board.push(decode_move(encoded))
+        positions[game_id].append(position_key(board))
+    return positions
+
+
+def analyze_games(analyses, pool, chunk_size=CHUNK_SIZE):
+    """
+    Evaluates every position of the games of the given GameAnalysis rows on
+    the process pool and stores the results. Positions shared by several
+    games (or repeated within one) are evaluated once. Returns the number of
+    positions and of distinct positions evaluated.
+    """
+    positions = game_positions([analysis.game_id for analysis in analyses])
+    unique = list(dict.fromkeys(key for keys in positions.values() for key in keys))
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+    scores = {}
+    results = pool.map(engine.evaluate_positions, chunks, repeat(NODE_BUDGET), repeat(MAX_DEPTH))
+    for chunk, chunk_scores in zip(chunks, results):
+        scores.update(zip(chunk, chunk_scores))
+
+    now = timezone.now()
+    for analysis in analyses:
+        keys = positions[analysis.game_id]
+        if len(keys) != analysis.game.move_count + 1:
+            # Played before the move log existed
+            analysis.status = 'failed'
+        else:
+            evaluations = [scores[key] for key in keys]
+            analysis.evaluations = pack_evaluations(evaluations)
+            analysis.annotations, analysis.white_accuracy, analysis.black_accuracy = annotate(evaluations)
+            analysis.status = 'done'
+        analysis.completed_at = now
+    GameAnalysis.objects.bulk_update(
+        analyses, ['status', 'evaluations', 'annotations', 'white_accuracy', 'black_accuracy', 'completed_at']
+    )
+    return sum(len(keys) for keys in positions.values()), len(unique)
+
+
+ANNOTATION_NAMES = {'i': 'Inaccuracy', 'm': 'Mistake', 'b': 'Blunder'}
+
+
+def analysis_report(game):
+    """
+    The finished analysis of a game for the result page: the players'
+    accuracy and each move with its evaluation, or None if not done yet.
+    """
+    analysis = GameAnalysis.objects.filter(game=game, status='done').first()
+    if analysis is None:
+        return None
+    evaluations = unpack_evaluations(analysis.evaluations)
+    board = chess.Board()
+    moves = []
+    for ply, encoded in enumerate(game.moves.order_by('ply').values_list('move', flat=True), start=1):
+        move = decode_move(encoded)
+        san = board.san(move)
+        board.push(move)
+        moves.append({
+            'number': (ply + 1) // 2,
+            'white': ply % 2 == 1,
+            'san': san,
+            'evaluation': evaluations[ply] / 100,
+            'annotation': ANNOTATION_NAMES.get(analysis.annotations[ply - 1]),
+        })
+    return {
+        'white_accuracy': analysis.white_accuracy,
+        'black_accuracy': analysis.black_accuracy,
+        'moves': moves,
+    }
+
+
+def claim_pending(limit):
+    """Marks up to `limit` of the oldest pending analyses as running and returns them."""
+    claimed = []
+    pending = GameAnalysis.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)[:limit]
+    for analysis_id in pending:
+        # Several processes may drain the queue; each row goes to whoever flips it first
+        if GameAnalysis.objects.filter(id=analysis_id, status='pending').update(status='running'):
+            claimed.append(analysis_id)
+    return list(GameAnalysis.objects.filter(id__in=claimed).select_related('game'))
+
+
+def get_analysis_pool(workers=None):
+    return ProcessPoolExecutor(
+        max_workers=workers or _config.get('WORKERS', 2),
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+class AnalysisWorker:
+    """
+    Background thread that drains the pending analyses in batches on its own
+    process pool, separate from the engine pool serving games against the
+    computer. Started on the first queued analysis; sleeps while the queue
+    is empty.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="analysis-worker", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        pool = get_analysis_pool()
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            pool = self.drain(pool)
+
+    def drain(self, pool):
+        """
+        Analyses batches until the queue is empty or a batch fails. A failed
+        batch is put back to pending, to be retried on the next wake-up,
+        rather than left running. Returns the pool to go on with: a new one
+        if a worker process died.
+        """
+        while True:
+            close_old_connections()
+            batch = []
+            try:
+                batch = claim_pending(self.batch_size)
+                if not batch:
+                    return pool
+                analyze_games(batch, pool)
+            except Exception as e:
+                logger.exception("Exception in the analysis worker: %s", e)
+                if batch:
+                    try:
+                        GameAnalysis.objects.filter(id__in=[analysis.id for analysis in batch], status='running').update(status='pending')
+                    except Exception:
+                        logger.exception("Could not put the failed batch back; analyze_games --requeue will")
+                if isinstance(e, BrokenProcessPool):
+                    pool.shutdown(wait=False)
+                    pool = get_analysis_pool()
+                return pool
+            finally:
+                close_old_connections()
+
+
+analysis_worker = AnalysisWorker()
+
+
+def queue_analysis(game_id):
+    """Queues a finished game for analysis, run by this process when ANALYSIS['IN_PROCESS'] is set."""
+    GameAnalysis.objects.get_or_create(game_id=game_id)
+    if _config.get('IN_PROCESS', True):
+        analysis_worker.wake()
@@ -0,0 +1,170 @@
+# board_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+import chess
+from chess.polyglot import zobrist_hash
+from django.conf import settings
+
+from .zobrist import ZobristTracker
+
+
+class LegalMoveCache:
+    """
+    LRU of legal moves keyed by Zobrist position key. Openings and other common
+    positions recur across many games, so most lookups skip move generation.
+    """
+
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (tuple of UCI strings, frozenset of the same)
+        self._lock = threading.Lock()
+
+    def get(self, board, key):
+        """Returns (moves, move_set) for the position, `key` being its Zobrist key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        moves = tuple(move.uci() for move in board.legal_moves)
+        entry = (moves, frozenset(moves))
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+legal_move_cache = LegalMoveCache(getattr(settings, 'LEGAL_MOVE_CACHE_SIZE', 50000))
+
+
+def legal_moves_for(board):
+    """Legal moves of any board in UCI format, through the shared cache."""
+    return legal_move_cache.get(board, zobrist_hash(board))[0]
+
+
+class LiveGame:
+    """A game's live board together with its repetition tracker."""
+
+    __slots__ = ('board', 'tracker')
+
+    def __init__(self, board, tracker=None):
+        self.board = board
+        self.tracker = tracker or ZobristTracker(board)
+
+    @classmethod
+    def load(cls, game):
+        """Builds the live state from the database, replaying the move log for repetitions."""
+        board = chess.Board(game.board.fen)
+        return cls(board, ZobristTracker.rebuild(game, board))
+
+    def play(self, uci):
+        """
+        Plays a move in UCI format and returns the new FEN.
+        Raises ValueError if the move is invalid; the position is left untouched.
+        """
+        if uci not in self.legal_move_set():
+            raise ValueError("Invalid move.")
+        self.tracker.push(self.board, chess.Move.from_uci(uci))
+        return self.board.fen()
+
+    def legal_moves(self):
+        """Legal moves for the side to move, in UCI format."""
+        return legal_move_cache.get(self.board, self.tracker.key)[0]
+
+    def legal_move_set(self):
+        return legal_move_cache.get(self.board, self.tracker.key)[1]
+
+    def termination(self):
+        """
+        Returns the reason the game is over ('checkmate', 'stalemate',
+        'insufficient_material', 'fifty_moves' or 'threefold_repetition'),
+        or None while it goes on. Every check is constant time.
+        """
+        board = self.board
+        if board.is_checkmate():
+            return 'checkmate'
+        if board.is_stalemate():
+            return 'stalemate'
+        if board.is_insufficient_material():
+            return 'insufficient_material'
+        if board.halfmove_clock >= 100:
+            return 'fifty_moves'
+        if self.tracker.is_threefold_repetition():
+            return 'threefold_repetition'
+        return None
+
+
+class LiveBoardCache:
+    """
+    Process-wide LRU of LiveGame objects keyed by game id.
+
+    A game is checked out while a move is being applied and checked back in
+    once the new position has been saved, so two threads never mutate the same
+    board. Every entry remembers the FEN it represents; if the database FEN no
+    longer matches (another worker moved, or the entry was evicted) checkout
+    misses and the caller rebuilds the game from the database.
+    """
+
+    def __init__(self, max_size=1024, idle_timeout=600):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()  # game_id -> (fen, live_game, last_used)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def checkout(self, game_id, fen):
+        """
+        Returns the cached LiveGame for the given game if it is positioned at
+        `fen`, otherwise None. The entry is removed from the cache until it is
+        checked back in.
+        """
+        with self._lock:
+            entry = self._entries.pop(game_id, None)
+            if entry is not None and entry[0] == fen:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def checkin(self, game_id, live_game, fen=None):
+        """
+        Stores the game as the most recently used entry and drops entries that
+        are idle for too long or over the size limit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._entries[game_id] = (fen or live_game.board.fen(), live_game, now)
+            self._entries.move_to_end(game_id)
+            self._prune(now)
+
+    def discard(self, game_id):
+        """Evicts the game, e.g. once it is finished."""
+        with self._lock:
+            self._entries.pop(game_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _prune(self, now):
+        # Entries are kept in least-recently-used order, so idle ones are at the front
+        deadline = now - self.idle_timeout
+        while self._entries:
+            last_used = next(iter(self._entries.values()))[2]
+            if last_used >= deadline and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+
+
+# Shared by every GameConsumer in this process
+live_boards = LiveBoardCache(
+    max_size=getattr(settings, 'LIVE_BOARD_CACHE_SIZE', 1024),
+    idle_timeout=getattr(settings, 'LIVE_BOARD_IDLE_TIMEOUT', 600),
+)
@@ -0,0 +1,255 @@
+# clocks.py
+import asyncio
+import heapq
+import logging
+import time
+
+import chess
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .board_cache import live_boards
+from .db_executor import LANE_GAMES, run_db_task
+from .models import Game
+from .post_game import game_finished
+from .spectators import broadcast_game_update
+
+logger = logging.getLogger(__name__)
+
+# Time controls a challenge may use, as (base seconds, increment seconds); (0, 0) plays without clocks
+TIME_CONTROLS = getattr(settings, 'TIME_CONTROLS', [(0, 0), (60, 0), (180, 2), (300, 3), (600, 0), (900, 10)])
+
+
+def parse_time_control(base_time, increment):
+    """Returns (base_time, increment) as ints; raises ValueError unless it is one of TIME_CONTROLS."""
+    time_control = (int(base_time), int(increment))
+    if time_control not in TIME_CONTROLS:
+        raise ValueError("Unsupported time control.")
+    return time_control
+
+
+def start_clocks(base_time, increment):
+    """Clock fields for a new game; white's clock starts running at once."""
+    return {
+        'base_time': base_time,
+        'increment': increment,
+        'white_time_ms': base_time * 1000,
+        'black_time_ms': base_time * 1000,
+        'turn_started_at': timezone.now() if base_time else None,
+    }
+
+
+def white_to_move(game):
+    return game.current_turn_id == game.player1_id
+
+
+def time_left_ms(game, now):
+    """Milliseconds left for the side to move at `now`; negative once its flag has fallen."""
+    stored = game.white_time_ms if white_to_move(game) else game.black_time_ms
+    return stored - int((now - game.turn_started_at).total_seconds() * 1000)
+
+
+def clock_state(game, now=None):
+    """Both clocks as of `now` for a game update, or None for a game without clocks."""
+    if not game.base_time:
+        return None
+    now = now or timezone.now()
+    white, black = game.white_time_ms, game.black_time_ms
+    running = None
+    if game.status == 'ongoing' and game.turn_started_at:
+        running = 'white' if white_to_move(game) else 'black'
+        if running == 'white':
+            white = max(time_left_ms(game, now), 0)
+        else:
+            black = max(time_left_ms(game, now), 0)
+    return {'white': white, 'black': black, 'running': running, 'as_of': now.timestamp()}
+
+
+def clock_now(message):
+    """
+    A copy of a buffered game update whose running clock is brought up to the
+    current time, for clients that receive it after the fact.
+    """
+    clock = message.get('clock')
+    if not clock or not clock['running']:
+        return message
+    now = time.time()
+    clock = dict(clock, as_of=now)
+    clock[clock['running']] = max(clock[clock['running']] - int((now - message['clock']['as_of']) * 1000), 0)
+    return dict(message, clock=clock)
+
+
+def charge_move(game, now):
+    """
+    Field changes that stop the mover's clock at `now`, adding the increment,
+    and start the opponent's. Returns None if the mover has run out of time.
+    """
+    left = time_left_ms(game, now)
+    if left <= 0:
+        return None
+    field = 'white_time_ms' if white_to_move(game) else 'black_time_ms'
+    return {field: left + game.increment * 1000, 'turn_started_at': now}
+
+
+def stop_clock(game, now):
+    """Field changes that stop the running clock at `now`, e.g. on resignation."""
+    if not game.base_time or not game.turn_started_at:
+        return {}
+    field = 'white_time_ms' if white_to_move(game) else 'black_time_ms'
+    return {field: max(time_left_ms(game, now), 0)}
+
+
+def flag_game(game):
+    """
+    Ends the game as lost on time by the side to move (drawn if the opponent
+    has no mating material). `game` needs board, player1 and player2 loaded.
+    Returns the game update, or None if the game changed since it was read.
+    """
+    board = chess.Board(game.board.fen)
+    winner = game.player2 if white_to_move(game) else game.player1
+    if board.has_insufficient_material(not board.turn):
+        winner = None
+    field = 'white_time_ms' if white_to_move(game) else 'black_time_ms'
+    if not game.commit(status='finished', winner=winner, termination='timeout', **{field: 0}):
+        return None
+    live_boards.discard(game.id)
+    game_finished(game)
+    return {
+        'seq': game.version,
+        'status': 'finished',
+        'winner': winner.username if winner else None,
+        'termination': 'timeout',
+        'current_turn': None,
+        'legal_moves': [],
+        'fen': game.board.fen,
+        'clock': clock_state(game),
+    }
+
+
+def check_timeout(game_id, version):
+    """
+    Flags the game if it is still at `version` and the side to move is out of
+    time. Returns (game update or None, seconds left or None).
+    """
+    game = Game.objects.select_related('board', 'player1', 'player2').get(id=game_id)
+    if game.status != 'ongoing' or game.version != version or not game.turn_started_at:
+        return None, None
+    left = time_left_ms(game, timezone.now())
+    if left > 0:
+        return None, left / 1000
+    return flag_game(game), None
+
+
+def pending_deadline(game_id):
+    """(version, seconds left) for a running clock, or None; used to resume timers after a restart."""
+    game = Game.objects.filter(id=game_id, status='ongoing', base_time__gt=0, turn_started_at__isnull=False).first()
+    if game is None:
+        return None
+    return game.version, time_left_ms(game, timezone.now()) / 1000
+
+
+class ClockScheduler:
+    """
+    Flags games whose side to move runs out of time.
+
+    One task per process serves every running clock from a heap of deadlines,
+    so setting a timer costs O(log n) and waiting costs nothing. Each game
+    keeps only its latest deadline; entries replaced by a later move are
+    skipped when they come due, and the heap is rebuilt once they outnumber
+    the live ones. Due games are checked against the database (the clocks
+    there are authoritative, so several processes may time the same game).
+    """
+
+    def __init__(self):
+        self._heap = []      # (deadline, game_id, version), may hold replaced entries
+        self._pending = {}   # game_id -> (deadline, version)
+        self._task = None
+        self._wakeup = None
+
+    def schedule(self, game_id, version, seconds):
+        """Times the side to move of the game at `version`, which has `seconds` left."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max(seconds, 0)
+        self._pending[game_id] = (deadline, version)
+        wake = not self._heap or deadline < self._heap[0][0]
+        heapq.heappush(self._heap, (deadline, game_id, version))
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._heap = [(deadline, game_id, version) for game_id, (deadline, version) in self._pending.items()]
+            heapq.heapify(self._heap)
+
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        elif wake:
+            # The task sleeps until a later deadline
+            self._wakeup.set()
+
+    def cancel(self, game_id):
+        # The heap entry is skipped when it comes due
+        self._pending.pop(game_id, None)
+
+    def is_scheduled(self, game_id):
+        return game_id in self._pending
+
+    def track(self, game_id, message):
+        """Follows a game update: times the side to move, or stops timing a finished game."""
+        clock = message.get('clock')
+        if message.get('status') == 'ongoing' and clock and clock['running']:
+            self.schedule(game_id, message['seq'], clock[clock['running']] / 1000)
+        else:
+            self.cancel(game_id)
+
+    async def restore(self, game_id):
+        """Resumes timing a game whose timer was lost, e.g. when the worker restarted."""
+        if self.is_scheduled(game_id):
+            return
+        deadline = await run_db_task(LANE_GAMES, pending_deadline, game_id)
+        if deadline is not None and not self.is_scheduled(game_id):
+            self.schedule(game_id, *deadline)
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            self._wakeup.clear()
+            delay = self._heap[0][0] - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = {}
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, game_id, version = heapq.heappop(self._heap)
+                if self._pending.get(game_id) == (deadline, version):
+                    del self._pending[game_id]
+                    due[game_id] = version
+            if due:
+                await self._check(due)
+        self._heap.clear()
+
+    async def _check(self, due):
+        results = await asyncio.gather(
+            *(run_db_task(LANE_GAMES, check_timeout, game_id, version) for game_id, version in due.items()),
+            return_exceptions=True,
+        )
+        for (game_id, version), result in zip(due.items(), results):
+            if isinstance(result, Exception):
+                logger.error(f"Error checking the clock of game {game_id}: {result}")
+                continue
+            message, seconds_left = result
+            if message is not None:
+                logger.info(f"Game {game_id} was lost on time.")
+                await broadcast_game_update(get_channel_layer(), game_id, message)
+            elif seconds_left is not None and not self.is_scheduled(game_id):
+                # Our timer ran early, e.g. the move was committed by another worker a little later
+                self.schedule(game_id, version, seconds_left)
+
+
+clock_scheduler = ClockScheduler()
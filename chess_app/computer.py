@@ -0,0 +1,104 @@
+# computer.py
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import is_password_usable
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+
+from . import engine
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'ENGINE', {})
+BOT_USERNAME = _config.get('USERNAME', 'chess_bot')
+MOVE_TIME = _config.get('MOVE_TIME', 1.0)
+MAX_DEPTH = _config.get('MAX_DEPTH', engine.MAX_PLY)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_engine_pool():
+    """
+    Returns the process pool that runs engine searches, so a search never
+    blocks the event loop or holds the GIL of the web process. Workers are
+    spawned rather than forked, since the web process runs threads.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=_config.get('WORKERS', 2),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pool
+
+
+async def choose_move(fen, time_limit=None):
+    """Searches the position on the engine pool; returns engine.search's result dict."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_engine_pool(), engine.search, fen, time_limit or MOVE_TIME, MAX_DEPTH)
+
+
+_bot_user_id = None
+
+
+def get_bot_user():
+    """
+    The user the computer plays as, created on first use without a usable
+    password. Signing up or importing games under its name is refused (see
+    is_reserved_username); an account that has a password anyway belongs to
+    a person, and is never taken over.
+    """
+    global _bot_user_id
+    bot, created = User.objects.get_or_create(username=BOT_USERNAME)
+    if created:
+        bot.set_unusable_password()
+        bot.save(update_fields=['password'])
+        logger.info(f"Created the computer player '{BOT_USERNAME}'.")
+    elif bot.has_usable_password():
+        raise ImproperlyConfigured(
+            f"The computer player's username '{BOT_USERNAME}' belongs to a user with a password; "
+            f"set ENGINE['USERNAME'] to another name."
+        )
+    _bot_user_id = bot.id
+    return bot
+
+
+def find_bot_user_id():
+    """
+    The computer player's id, or None if its account doesn't exist yet;
+    never creates it. An account under its name with a usable password
+    belongs to a person and is not the computer: that is logged, and None
+    returned, rather than raised into the caller.
+    """
+    global _bot_user_id
+    if _bot_user_id is not None:
+        return _bot_user_id
+    row = User.objects.filter(username=BOT_USERNAME).values_list('id', 'password').first()
+    if row is None:
+        return None
+    if is_password_usable(row[1]):
+        logger.error(
+            f"The computer player's username '{BOT_USERNAME}' belongs to a user with a password; "
+            f"set ENGINE['USERNAME'] to another name."
+        )
+        return None
+    _bot_user_id = row[0]
+    return _bot_user_id
+
+
+def cached_bot_user_id():
+    """The computer player's id if this process already knows it, else None."""
+    return _bot_user_id
+
+
+def is_reserved_username(username):
+    """Whether `username` is the computer player's, which nobody may sign up or be imported as."""
+    return username.lower() == BOT_USERNAME.lower()
@@ -1,16 +1,21 @@
 # consumers.py
 import asyncio
-from datetime import timedelta
-from django.utils import timezone
 import json
 import chess
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .models import Game
-from .utils import apply_move_to_board
+from .board_cache import LiveGame, legal_moves_for, live_boards
+from .db_executor import LANE_GAMES, LANE_MOVES, LANE_PRESENCE, database_task, run_db_task
+from .presence import broadcaster, get_presence, grace_timers
+from .clocks import charge_move, clock_now, clock_scheduler, clock_state, flag_game, parse_time_control, stop_clock
+from .computer import BOT_USERNAME, cached_bot_user_id, choose_move, find_bot_user_id
+from .matchmaking import Seeker, matchmaker, seek_rating
+from .post_game import game_finished
+from .replay import update_buffer
+from .spectators import SPECTATOR_UPDATE_INTERVAL, broadcast_game_update, game_players, spawn
 import logging
-from .models import OnlineUser
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +30,9 @@ class ChallengeConsumer(AsyncWebsocketConsumer):
             self.user_group_name = f"user_{self.user.id}"
             self.global_group_name = "all_users"
 
-            # Mark the user as online in the database
-            await database_sync_to_async(self.mark_user_online)()
+            # Register this connection with the presence backend
+            grace_timers.cancel(self.user.id)
+            await run_db_task(LANE_PRESENCE, get_presence().connect, self.user, self.channel_name)
 
             try:
                 # Join individual user group
@@ -46,118 +52,72 @@ class ChallengeConsumer(AsyncWebsocketConsumer):
                 await self.accept()
                 logger.info(f"WebSocket connection established for user {self.user.id}")
 
-                # Notify all users that this user is online
-                await self.channel_layer.group_send(
-                    self.global_group_name,
-                    {
-                        "type": "user_status",
-                        "user_id": self.user.id,
-                        "username": self.user.username,
-                        "status": "online",
-                    }
-                )
+                # Announce this user in the next presence diff
+                broadcaster.mark(self.user.id, self.user.username, 'online')
 
-                # Send the list of currently online users to the new user
-                online_users = await database_sync_to_async(self.get_online_users)()
-                for user in online_users:
-                    if user.id != self.user.id:
-                        await self.send(text_data=json.dumps({
-                            "type": "user_status",
-                            "user_id": user.id,
-                            "username": user.username,
-                            "status": "online",
-                        }))
+                # Send the list of currently online users to the new user in one message
+                online_users = await run_db_task(LANE_PRESENCE, get_presence().online_users)
+                await self.send(text_data=json.dumps({
+                    "type": "presence_snapshot",
+                    "users": [user for user in online_users if user['id'] != self.user.id],
+                }))
 
             except Exception as e:
                 logger.error(f"Error during WebSocket connection for user {self.user.id}: {e}")
                 await self.close()
 
     async def disconnect(self, close_code):
-        if not self.user.is_anonymous:
-            await asyncio.sleep(1)  # Wait to check if the user reconnects
-            if not await self.is_user_connected():
-                await database_sync_to_async(self.mark_user_offline)()
-                try:
-                    # Leave individual user group
-                    await self.channel_layer.group_discard(
-                        self.user_group_name,
-                        self.channel_name
-                    )
-                    logger.info(f"User {self.user.id} left group {self.user_group_name}")
-
-                    # Leave global group
-                    await self.channel_layer.group_discard(
-                        self.global_group_name,
-                        self.channel_name
-                    )
-                    logger.info(f"User {self.user.id} left group {self.global_group_name}")
-
-                    # Notify all users that this user is offline
-                    await self.channel_layer.group_send(
-                        self.global_group_name,
-                        {
-                            "type": "user_status",
-                            "user_id": self.user.id,
-                            "username": self.user.username,
-                            "status": "offline",
-                        }
-                    )
-
-                except Exception as e:
-                    logger.error(f"Error during WebSocket disconnection for user {self.user.id}: {e}")
-
-    async def is_user_connected(self):
-        # Check if the user has any active connections
-        return await database_sync_to_async(self._user_is_connected)()
-
-    def _user_is_connected(self):
-        try:
-            online_status = self.user.online_status
-            return online_status.connection_count > 0
-        except OnlineUser.DoesNotExist:
-            return False
-
-    def mark_user_online(self):
-        # Update or create the OnlineUser entry
-        online_user, created = OnlineUser.objects.update_or_create(
-            user=self.user,
-            defaults={'last_seen': timezone.now(), 'connection_count': 1}
-        )
-        if not created:
-            online_user.connection_count += 1
-            online_user.save()
-
-    def mark_user_offline(self):
-        # Delete the OnlineUser entry
-        OnlineUser.objects.filter(user=self.user).delete()
-
-    def get_online_users(self):
-        # Retrieve all users who are currently online
-        now = timezone.now()
-        timeout = now - timedelta(minutes=3)
-        online_users = OnlineUser.objects.filter(last_seen__gte=timeout).exclude(user=self.user)
-        logger.info(f"Online users: {[user.user.username for user in online_users]}")
-        return [online_user.user for online_user in online_users]
-
-    async def user_status(self, event):
-        # Send the user status update to the WebSocket
-
-        if event['user_id'] == self.user.id:
+        if self.user.is_anonymous:
             return
-        await self.send(text_data=json.dumps({
-            "type": "user_status",
-            "user_id": event['user_id'],
-            "username": event['username'],
-            "status": event['status'],
-        }))
+        try:
+            # Leave individual user group
+            await self.channel_layer.group_discard(
+                self.user_group_name,
+                self.channel_name
+            )
+            logger.info(f"User {self.user.id} left group {self.user_group_name}")
+
+            # Leave global group
+            await self.channel_layer.group_discard(
+                self.global_group_name,
+                self.channel_name
+            )
+            logger.info(f"User {self.user.id} left group {self.global_group_name}")
+
+            # A seek only lasts as long as the connection it came from
+            matchmaker.cancel(self.user.id, self.channel_name)
+
+            remaining = await run_db_task(LANE_PRESENCE, get_presence().disconnect, self.user, self.channel_name)
+            if remaining == 0:
+                # Announced offline unless another tab connects within the grace period
+                grace_timers.schedule(self.user.id, self.user.username)
+
+        except Exception as e:
+            logger.error(f"Error during WebSocket disconnection for user {self.user.id}: {e}")
+
+    async def presence_diff(self, event):
+        # Forward merged online/offline changes, leaving out this user
+        online = [user for user in event['online'] if user['id'] != self.user.id]
+        offline = [user_id for user_id in event['offline'] if user_id != self.user.id]
+        if online or offline:
+            await self.send(text_data=json.dumps({
+                "type": "presence_diff",
+                "online": online,
+                "offline": offline,
+            }))
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message_type = text_data_json.get('type')
 
         if message_type == 'heartbeat':
-            # Update the last_seen timestamp for the user
-            await database_sync_to_async(self.update_last_seen)()
+            # Refresh the user's presence
+            await run_db_task(LANE_PRESENCE, get_presence().heartbeat, self.user, self.channel_name)
+        elif message_type == 'seek':
+            await self.seek(text_data_json)
+        elif message_type == 'cancel_seek':
+            matchmaker.cancel(self.user.id)
+            await self.send(text_data=json.dumps({"type": "seek_cancelled"}))
         elif message_type == 'logout':
             # Handle user logout
             await self.close()
@@ -165,9 +125,19 @@ class ChallengeConsumer(AsyncWebsocketConsumer):
             # Handle other message types if needed
             pass
 
-    def update_last_seen(self):
-        # Update the last_seen timestamp in the database
-        OnlineUser.objects.filter(user=self.user).update(last_seen=timezone.now())
+    async def seek(self, options):
+        """Puts the user in the matchmaking queue for the requested time control."""
+        try:
+            time_control = parse_time_control(options.get('base_time', 0), options.get('increment', 0))
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({"type": "seek_error", "error": "Unsupported time control."}))
+            return
+        rating = await run_db_task(LANE_GAMES, seek_rating, self.user.id)
+        if rating is None:
+            await self.send(text_data=json.dumps({"type": "seek_error", "error": "You already have a game in progress."}))
+            return
+        await self.send(text_data=json.dumps({"type": "seek_started", "rating": round(rating)}))
+        await matchmaker.seek(Seeker(self.user.id, self.user.username, self.channel_name, rating, time_control))
 
     async def send_challenge_notification(self, event):
         data = event.get("data", {})
@@ -181,27 +151,73 @@ class ChallengeConsumer(AsyncWebsocketConsumer):
         
 class GameConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.game_id = self.scope['url_route']['kwargs']['game_id']
+        self.game_id = int(self.scope['url_route']['kwargs']['game_id'])
         self.game_group_name = f'game_{self.game_id}'
+        self.spectator_group_name = f'game_{self.game_id}_spectators'
+        self.subscribed = False
 
         # Authenticate the user
         self.user = self.scope["user"]
         if self.user.is_anonymous:
             await self.close()
             logger.warning("Anonymous user tried to connect via GameConsumer.")
+            return
+
+        players = game_players.cached(self.game_id)
+        if players is None:
+            try:
+                players = await run_db_task(LANE_GAMES, game_players.load, self.game_id)
+            except Game.DoesNotExist:
+                await self.close()
+                return
+            # First connection to this game since the worker started: its clock may need timing
+            await clock_scheduler.restore(self.game_id)
+        player1_id, player2_id, computer_id = players
+        self.is_spectator = self.user.id not in (player1_id, player2_id)
+
+        # Set when this is a game against the computer; only such games look the computer up
+        self.bot_id = None
+        if computer_id is not None:
+            bot_id = cached_bot_user_id()
+            if bot_id is None:
+                bot_id = await run_db_task(LANE_GAMES, find_bot_user_id)
+            if bot_id == computer_id:
+                self.bot_id = bot_id
+
+        # Players and spectators get separate groups, so spectator fan-out never delays the players
+        if self.is_spectator:
+            self.pending_update = None
+            self.flush_task = None
+            await self.channel_layer.group_add(self.spectator_group_name, self.channel_name)
         else:
-            await self.channel_layer.group_add(
-                self.game_group_name,
-                self.channel_name
-            )
-            await self.accept()
-            logger.info(f"User {self.user.username} connected to game {self.game_id}.")
+            await self.channel_layer.group_add(self.game_group_name, self.channel_name)
+        # Start buffering this game's updates for reconnecting clients
+        update_buffer.subscribe(self.game_id)
+        self.subscribed = True
+        await self.accept()
+
+        if self.bot_id is not None and not self.is_spectator:
+            # The computer may be due to move, e.g. it plays white or a reply was lost in a restart
+            spawn(self.bot_reply_if_due())
+
+        if self.is_spectator:
+            # Spectators get the current position on join, from memory when this process has it
+            await self.send(text_data=json.dumps(
+                clock_now(update_buffer.latest(self.game_id) or await self.get_snapshot())
+            ))
+        logger.info(f"User {self.user.username} connected to game {self.game_id}"
+                    f"{' as a spectator' if self.is_spectator else ''}.")
 
     async def disconnect(self, close_code):
+        if not self.subscribed:
+            return
+        if self.is_spectator and self.flush_task is not None:
+            self.flush_task.cancel()
         await self.channel_layer.group_discard(
-            self.game_group_name,
+            self.spectator_group_name if self.is_spectator else self.game_group_name,
             self.channel_name
         )
+        update_buffer.unsubscribe(self.game_id)
         logger.info(f"User {self.user.username} disconnected from game {self.game_id}.")
 
     async def receive(self, text_data):
@@ -210,28 +226,28 @@ class GameConsumer(AsyncWebsocketConsumer):
             move = text_data_json.get('move')
             action = text_data_json.get('action')
 
-            if action == 'resign':
+            if action == 'resume':
+                # A (re)connecting client catches up from the last update it saw
+                try:
+                    last_seq = int(text_data_json.get('last_seq', 0))
+                except (TypeError, ValueError):
+                    await self.send(text_data=json.dumps({'error': 'Invalid last_seq.'}))
+                    return
+                await self.resume(last_seq)
+            elif self.is_spectator:
+                await self.send(text_data=json.dumps({'error': 'Spectators cannot make moves.'}))
+            elif action == 'resign':
                 success, response = await self.handle_resign()
                 if success:
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        {
-                            'type': 'game_update',
-                            'message': response,
-                        }
-                    )
+                    await self.broadcast_update(response)
                 else:
                     await self.send(text_data=json.dumps(response))
             elif action == 'move' and move:
                 success, response = await self.process_move(move)
                 if success:
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        {
-                            'type': 'game_update',
-                            'message': response,
-                        }
-                    )
+                    await self.broadcast_update(response)
+                    if self.bot_id is not None and response['status'] == 'ongoing':
+                        spawn(self.bot_reply(response['fen']))
                 else:
                     # Send error message back to sender
                     await self.send(text_data=json.dumps(response))
@@ -243,85 +259,184 @@ class GameConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps({'error': 'An error occurred.'}))
             await self.close()
 
+    async def broadcast_update(self, message):
+        clock_scheduler.track(self.game_id, message)
+        await broadcast_game_update(self.channel_layer, self.game_id, message)
+
     async def game_update(self, event):
         message = event['message']
+        update_buffer.record(self.game_id, message['seq'], message)
         await self.send(text_data=json.dumps(message))
 
-    @database_sync_to_async
-    def process_move(self, move):
+    async def spectator_update(self, event):
+        message = event['message']
+        update_buffer.record(self.game_id, message['seq'], message)
+        # Keep only the newest update while a send is pending, so slow spectators get merged bursts
+        self.pending_update = message
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = spawn(self.flush_spectator_updates())
+
+    async def flush_spectator_updates(self):
+        while self.pending_update is not None:
+            message, self.pending_update = self.pending_update, None
+            await self.send(text_data=json.dumps(message))
+            await asyncio.sleep(SPECTATOR_UPDATE_INTERVAL)
+
+    async def bot_reply(self, fen):
+        """Lets the computer search the position on the engine pool and play its move."""
+        try:
+            result = await choose_move(fen)
+            success, response = await self.process_move(result['move'], player_id=self.bot_id)
+            if success:
+                await self.broadcast_update(response)
+            else:
+                logger.warning(f"Computer move {result['move']} rejected in game {self.game_id}: {response}")
+        except Exception as e:
+            logger.exception("Exception in bot_reply: %s", e)
+
+    async def bot_reply_if_due(self):
+        snapshot = await self.get_snapshot()
+        if snapshot.get('status') == 'ongoing' and snapshot['current_turn'] == BOT_USERNAME:
+            await self.bot_reply(snapshot['fen'])
+
+    async def resume(self, last_seq):
+        missed = update_buffer.since(self.game_id, last_seq)
+        if missed is None:
+            # The buffer does not reach back far enough; send the whole position instead
+            await self.send(text_data=json.dumps(await self.get_snapshot()))
+            return
+        for message in missed:
+            await self.send(text_data=json.dumps(message))
+
+    @database_task(LANE_GAMES)
+    def get_snapshot(self):
         try:
-            game = Game.objects.get(id=self.game_id)
-            chess_board = chess.Board(game.board.fen)
+            game = self.get_game()
+        except Game.DoesNotExist:
+            return {'error': "Game not found."}
+        ongoing = game.status == 'ongoing'
+        return {
+            'type': 'snapshot',
+            'seq': game.version,
+            'fen': game.board.fen,
+            'status': game.status,
+            'winner': game.winner.username if game.winner else None,
+            'termination': game.termination or None,
+            'current_turn': game.current_turn.username if ongoing else None,
+            'legal_moves': legal_moves_for(chess.Board(game.board.fen)) if ongoing else [],
+            'clock': clock_state(game),
+        }
+
+    def get_game(self):
+        # Everything a move or resignation needs, in a single query
+        return Game.objects.select_related(
+            'board', 'player1', 'player2', 'current_turn', 'winner'
+        ).get(id=self.game_id)
+
+    @database_task(LANE_MOVES)
+    def process_move(self, move, player_id=None):
+        """Plays `move` for this connection's user, or for `player_id` (the computer) if given."""
+        try:
+            game = self.get_game()
             current_player = game.current_turn
             opponent = game.player2 if current_player == game.player1 else game.player1
-            user = self.user
 
-            if user != current_player:
+            if game.status != 'ongoing':
+                return False, {'error': "The game is already over."}
+
+            if (player_id or self.user.id) != current_player.id:
                 return False, {'error': "It's not your turn."}
 
+            now = timezone.now()
+            clock_changes = {}
+            if game.base_time:
+                clock_changes = charge_move(game, now)
+                if clock_changes is None:
+                    # The mover's flag fell before the move arrived
+                    message = flag_game(game)
+                    if message is None:
+                        return False, {'error': "The game was updated by another move. Please try again."}
+                    return True, message
+
+            # Reuse the live board from the last move when it still matches the stored position
+            live_game = live_boards.checkout(game.id, game.board.fen) or LiveGame.load(game)
             try:
-                new_fen = apply_move_to_board(game.board.fen, move)
-                game.board.fen = new_fen
-                game.board.save()
-
-                game.move_count += 1
-                game.current_turn = opponent
-                game.save()
-
-                # Check for game termination conditions
-                chess_board = chess.Board(new_fen)
-                if chess_board.is_checkmate():
-                    game.status = 'finished'
-                    game.winner = user
-                    game.save()
-                    return True, {
-                        'move': move,
-                        'fen': new_fen,
-                        'status': 'finished',
-                        'winner': user.username,
-                        'current_turn': None,
-                    }
-                elif chess_board.is_stalemate():
-                    game.status = 'finished'
-                    game.winner = None  # Draw
-                    game.save()
-                    return True, {
-                        'move': move,
-                        'fen': new_fen,
-                        'status': 'finished',
-                        'winner': None,
-                        'current_turn': None,
-                    }
-                else:
-                    return True, {
-                        'move': move,
-                        'fen': new_fen,
-                        'status': 'ongoing',
-                        'current_turn': opponent.username,
-                    }
+                new_fen = live_game.play(move)
             except ValueError as ve:
+                live_boards.checkin(game.id, live_game, game.board.fen)
                 return False, {'error': str(ve)}
+
+            # Check for game termination conditions
+            termination = live_game.termination()
+            if termination == 'checkmate':
+                status, winner, next_turn = 'finished', current_player, None
+            elif termination:
+                status, winner, next_turn = 'finished', None, None  # Draw
+            else:
+                status, winner, next_turn = 'ongoing', None, opponent
+
+            committed = game.commit(
+                fen=new_fen,
+                move=live_game.board.peek(),
+                move_count=game.move_count + 1,
+                current_turn=next_turn or opponent,
+                status=status,
+                winner=winner,
+                termination=termination or '',
+                **clock_changes,
+            )
+            if not committed:
+                # Another move was committed since we read the game; our board is stale
+                live_boards.discard(game.id)
+                return False, {'error': "The game was updated by another move. Please try again."}
+
+            if status == 'finished':
+                live_boards.discard(game.id)
+                game_finished(game)
+            else:
+                live_boards.checkin(game.id, live_game, new_fen)
+
+            return True, {
+                'seq': game.version,
+                'move': move,
+                'fen': new_fen,
+                'status': status,
+                'winner': winner.username if winner else None,
+                'termination': termination,
+                'current_turn': next_turn.username if next_turn else None,
+                'legal_moves': live_game.legal_moves() if status == 'ongoing' else [],
+                'clock': clock_state(game, now),
+            }
         except Game.DoesNotExist:
             return False, {'error': "Game not found."}
         except Exception as e:
             logger.exception("Exception in process_move: %s", e)
             return False, {'error': "An error occurred while processing the move."}
 
-    @database_sync_to_async
+    @database_task(LANE_GAMES)
     def handle_resign(self):
         try:
-            game = Game.objects.get(id=self.game_id)
-            opponent = game.player2 if self.user == game.player1 else game.player1
-            game.winner = opponent
-            game.status = 'finished'
-            game.save()
+            game = self.get_game()
+            if game.status != 'ongoing':
+                return False, {'error': "The game is already over."}
+
+            opponent = game.player2 if self.user.id == game.player1_id else game.player1
+            now = timezone.now()
+            if not game.commit(winner=opponent, status='finished', termination='resign', **stop_clock(game, now)):
+                return False, {'error': "The game was updated by another move. Please try again."}
+            live_boards.discard(game.id)
+            game_finished(game)
 
             return True, {
+                'seq': game.version,
                 'action': 'resign',
                 'status': 'finished',
                 'winner': opponent.username,
+                'termination': 'resign',
                 'current_turn': None,
+                'legal_moves': [],
                 'fen': game.board.fen,  # Include the final FEN
+                'clock': clock_state(game, now),
             }
         except Game.DoesNotExist:
             return False, {'error': "Game not found."}
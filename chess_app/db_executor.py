@@ -0,0 +1,148 @@
+# db_executor.py
+import asyncio
+import functools
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Lanes, in priority order: a queued move always runs before queued presence work,
+# and bookkeeping after a game ends, which nobody waits for, runs last
+LANE_MOVES = 'moves'
+LANE_GAMES = 'games'
+LANE_PRESENCE = 'presence'
+LANE_POST_GAME = 'post_game'
+LANES = (LANE_MOVES, LANE_GAMES, LANE_PRESENCE, LANE_POST_GAME)
+
+
+class DatabaseExecutor:
+    """
+    Bounded pool of worker threads that runs the consumers' blocking database
+    work. Each worker thread keeps its own Django connection. Jobs wait in a
+    single priority queue ordered by lane, then by arrival, so a burst of
+    heartbeats cannot delay moves.
+    """
+
+    def __init__(self, workers=4, warn_depth=100):
+        self.workers = workers
+        self.warn_depth = warn_depth
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {lane: self._empty_stats() for lane in LANES}
+
+    @staticmethod
+    def _empty_stats():
+        return {'depth': 0, 'max_depth': 0, 'submitted': 0, 'completed': 0, 'failed': 0, 'wait_time': 0.0}
+
+    def _start(self):
+        # Called with the lock held
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, name=f"db-executor-{len(self._threads)}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, lane, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) on the given lane and returns a concurrent Future."""
+        future = Future()
+        with self._lock:
+            self._start()
+            stats = self._stats[lane]
+            stats['submitted'] += 1
+            stats['depth'] += 1
+            stats['max_depth'] = max(stats['max_depth'], stats['depth'])
+            depth = stats['depth']
+        if depth == self.warn_depth:
+            logger.warning(f"Database executor lane '{lane}' has {depth} queued jobs.")
+        self._queue.put((LANES.index(lane), next(self._counter), lane, time.monotonic(), future, func, args, kwargs))
+        return future
+
+    async def run(self, lane, func, *args, **kwargs):
+        """Runs func on a worker thread and awaits its result."""
+        return await asyncio.wrap_future(self.submit(lane, func, *args, **kwargs))
+
+    def stats(self):
+        """Per-lane queue depth and throughput counters, for logging or monitoring."""
+        with self._lock:
+            snapshot = {}
+            for lane, stats in self._stats.items():
+                snapshot[lane] = dict(stats)
+                done = stats['completed'] + stats['failed']
+                snapshot[lane]['avg_wait_ms'] = (stats['wait_time'] / done * 1000) if done else 0.0
+                del snapshot[lane]['wait_time']
+            return snapshot
+
+    def _work(self):
+        while True:
+            _, _, lane, enqueued_at, future, func, args, kwargs = self._queue.get()
+            waited = time.monotonic() - enqueued_at
+            with self._lock:
+                self._stats[lane]['depth'] -= 1
+            failed = False
+            if future.set_running_or_notify_cancel():
+                close_old_connections()
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    failed = True
+                    future.set_exception(e)
+                finally:
+                    close_old_connections()
+            with self._lock:
+                stats = self._stats[lane]
+                stats['failed' if failed else 'completed'] += 1
+                stats['wait_time'] += waited
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor():
+    """
+    Returns the process-wide executor configured by CHANNELS_DB_EXECUTOR,
+    or None when it is disabled (WORKERS = 0).
+    """
+    global _executor
+    if _executor is None:
+        config = getattr(settings, 'CHANNELS_DB_EXECUTOR', {})
+        workers = config.get('WORKERS', 4)
+        if not workers:
+            return None
+        with _executor_lock:
+            if _executor is None:
+                _executor = DatabaseExecutor(workers=workers, warn_depth=config.get('WARN_DEPTH', 100))
+    return _executor
+
+
+async def run_db_task(lane, func, *args, **kwargs):
+    """
+    Awaitable replacement for database_sync_to_async(func)(*args) that runs on
+    the given lane of the shared executor. Falls back to Channels' single
+    thread-sensitive executor when the pool is disabled.
+    """
+    executor = get_db_executor()
+    if executor is None:
+        return await database_sync_to_async(func)(*args, **kwargs)
+    return await executor.run(lane, func, *args, **kwargs)
+
+
+def database_task(lane):
+    """Decorator form of run_db_task, used like @database_sync_to_async."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_db_task(lane, func, *args, **kwargs)
+        return wrapper
+    return decorator
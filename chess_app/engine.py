@@ -0,0 +1,344 @@
+# engine.py
+import time
+
+import chess
+from chess.polyglot import zobrist_hash
+
+from .zobrist import push as zobrist_push
+
+# Kept free of Django imports: this module is loaded by the engine's worker processes
+
+INF = 1_000_000
+MATE = 100_000
+MATE_BOUND = MATE - 1000  # Scores beyond this are mates, stored relative to the node in the table
+MAX_PLY = 64
+MATE_CP = 10_000  # Mate scores are reported as this many centipawns by evaluate_positions
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 20000)
+
+# Piece-square tables of the "simplified evaluation function", from white's side with a8 first
+PIECE_SQUARE_TABLES = {
+    chess.PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    chess.KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    chess.BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    chess.ROOK: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    chess.QUEEN: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    chess.KING: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}
+
+# SQUARE_VALUES[color][piece_type][square]: material plus placement, indexed by python-chess square (a1 = 0)
+SQUARE_VALUES = [
+    [None] + [
+        tuple(
+            PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[piece_type][square if color == chess.BLACK else square ^ 56]
+            for square in chess.SQUARES
+        )
+        for piece_type in chess.PIECE_TYPES
+    ]
+    for color in (chess.BLACK, chess.WHITE)
+]
+
+
+def evaluate(board):
+    """Static evaluation in centipawns from the side to move's point of view."""
+    score = 0
+    for piece_type in chess.PIECE_TYPES:
+        white_values = SQUARE_VALUES[chess.WHITE][piece_type]
+        black_values = SQUARE_VALUES[chess.BLACK][piece_type]
+        for square in chess.scan_forward(board.pieces_mask(piece_type, chess.WHITE)):
+            score += white_values[square]
+        for square in chess.scan_forward(board.pieces_mask(piece_type, chess.BLACK)):
+            score -= black_values[square]
+    return score if board.turn == chess.WHITE else -score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Engine:
+    """
+    Iterative deepening negamax with alpha-beta pruning, a Zobrist-keyed
+    transposition table, quiescence search over captures and move ordering
+    by table move, MVV-LVA, killer moves and history. The table is kept
+    between searches (it is cleared when it grows past `table_size`), so a
+    worker process serving one game reuses the work of its previous move.
+    """
+
+    def __init__(self, table_size=1_000_000):
+        self.table_size = table_size
+        self.table = {}  # key -> (depth, score, flag, best move)
+        self.nodes = 0
+
+    def search(self, board, time_limit=1.0, max_depth=MAX_PLY, node_limit=None):
+        """
+        Searches `board` (left unchanged) for up to `time_limit` seconds and
+        `max_depth` plies. Returns a dict with the best move in UCI format,
+        its score in centipawns for the side to move (and that of the
+        iteration before), the depth of the last completed iteration, the
+        nodes searched and the time spent.
+        """
+        started = time.monotonic()
+        self.deadline = started + time_limit if time_limit else None
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        if len(self.table) > self.table_size:
+            self.table.clear()
+
+        board = board.copy(stack=False)
+        key = zobrist_hash(board)
+        self.path = [key]
+        legal = list(board.legal_moves)
+        best_move, best_score, completed = (legal[0] if legal else None), 0, 0
+        previous_score = 0
+        if legal:
+            for depth in range(1, max_depth + 1):
+                try:
+                    score, move = self._root(board, key, depth)
+                except SearchTimeout:
+                    break
+                previous_score = best_score if completed else score
+                best_move, best_score, completed = move, score, depth
+                if abs(score) > MATE_BOUND or len(legal) == 1:
+                    break  # A forced mate (or a forced move) will not change with more depth
+
+        elapsed = time.monotonic() - started
+        return {
+            'move': best_move.uci() if best_move else None,
+            'score': best_score,
+            'previous_score': previous_score,
+            'depth': completed,
+            'nodes': self.nodes,
+            'time': elapsed,
+            'nps': int(self.nodes / elapsed) if elapsed else 0,
+        }
+
+    def _check_limits(self):
+        if self.nodes & 1023 == 0:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                raise SearchTimeout()
+            if self.node_limit is not None and self.nodes > self.node_limit:
+                raise SearchTimeout()
+
+    def _root(self, board, key, depth):
+        alpha, best_move = -INF, None
+        for move in self._ordered(board, self._table_move(key), 0):
+            child = zobrist_push(board, move, key)
+            self.path.append(child)
+            try:
+                score = -self._negamax(board, child, depth - 1, -INF, -alpha, 1)
+            finally:
+                self.path.pop()
+                board.pop()
+            if score > alpha:
+                alpha, best_move = score, move
+        self.table[key] = (depth, alpha, EXACT, best_move)
+        return alpha, best_move
+
+    def _negamax(self, board, key, depth, alpha, beta, ply):
+        self.nodes += 1
+        self._check_limits()
+
+        # Positions since the last capture or pawn move can repeat; treat a repetition as a draw
+        if board.halfmove_clock >= 100 or key in self.path[-board.halfmove_clock - 1:-1]:
+            return 0
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(board, alpha, beta, ply)
+
+        original_alpha = alpha
+        entry = self.table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, score, flag, table_move = entry
+            if entry_depth >= depth:
+                score = score - ply if score > MATE_BOUND else score + ply if score < -MATE_BOUND else score
+                if flag == EXACT:
+                    return score
+                if flag == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        in_check = board.is_check()
+        if in_check:
+            depth += 1  # Check extension
+
+        best_score, best_move = -INF, None
+        for move in self._ordered(board, table_move, ply):
+            quiet = not board.is_capture(move) and not move.promotion
+            child = zobrist_push(board, move, key)
+            self.path.append(child)
+            try:
+                score = -self._negamax(board, child, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                self.path.pop()
+                board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1], killers[0] = killers[0], move
+                            self.history[move] = self.history.get(move, 0) + depth * depth
+                        break
+
+        if best_move is None:
+            # No legal move: checkmated (the sooner the worse) or stalemate
+            return -MATE + ply if in_check else 0
+
+        flag = UPPER if best_score <= original_alpha else LOWER if best_score >= beta else EXACT
+        stored = best_score + ply if best_score > MATE_BOUND else best_score - ply if best_score < -MATE_BOUND else best_score
+        self.table[key] = (depth, stored, flag, best_move)
+        return best_score
+
+    def _quiesce(self, board, alpha, beta, ply):
+        self.nodes += 1
+        self._check_limits()
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in self._captures(board):
+            board.push(move)
+            try:
+                score = -self._quiesce(board, -beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def _table_move(self, key):
+        entry = self.table.get(key)
+        return entry[3] if entry else None
+
+    def _capture_score(self, board, move):
+        # Most valuable victim first, then least valuable attacker
+        victim = chess.PAWN if board.is_en_passant(move) else board.piece_type_at(move.to_square)
+        return 10 * PIECE_VALUES[victim or 0] - PIECE_VALUES[board.piece_type_at(move.from_square)] // 10
+
+    def _captures(self, board):
+        return sorted(
+            board.generate_legal_captures(), key=lambda move: self._capture_score(board, move), reverse=True
+        )
+
+    def _ordered(self, board, table_move, ply):
+        killers = self.killers[ply] if ply <= MAX_PLY else (None, None)
+        history = self.history
+
+        def priority(move):
+            if move == table_move:
+                return 10_000_000
+            if board.is_capture(move):
+                return 1_000_000 + self._capture_score(board, move)
+            if move.promotion:
+                return 900_000 + PIECE_VALUES[move.promotion]
+            if move == killers[0]:
+                return 800_000
+            if move == killers[1]:
+                return 700_000
+            return history.get(move, 0)
+
+        return sorted(board.legal_moves, key=priority, reverse=True)
+
+
+# One engine per process, so its transposition table outlives a single search
+_engine = None
+
+
+def search(fen, time_limit=1.0, max_depth=MAX_PLY):
+    """Process pool entry point: searches the position given as FEN with this process's engine."""
+    global _engine
+    if _engine is None:
+        _engine = Engine()
+    return _engine.search(chess.Board(fen), time_limit=time_limit, max_depth=max_depth)
+
+
+def evaluate_positions(fens, node_limit=2000, max_depth=8):
+    """
+    Process pool entry point for game analysis: scores each position (as FEN)
+    in centipawns from white's point of view, with a fixed node budget so a
+    position costs the same however complex it is. Mates count as +-MATE_CP.
+    """
+    scores = []
+    for fen in fens:
+        board = chess.Board(fen)
+        if board.is_checkmate():
+            score = -MATE_CP
+        elif board.is_stalemate() or board.is_insufficient_material():
+            score = 0
+        else:
+            # A fresh table per position keeps the result independent of what the worker searched before
+            result = Engine(table_size=node_limit * 4).search(board, time_limit=None, max_depth=max_depth, node_limit=node_limit)
+            score = result['score']
+            if abs(score) < MATE_BOUND:
+                # Shallow scores swing with the parity of the depth; averaging two iterations evens out
+                # positions that the budget took to different depths
+                score = (score + result['previous_score']) // 2
+            score = max(-MATE_CP, min(MATE_CP, score))
+        scores.append(score if board.turn == chess.WHITE else -score)
+    return scores
@@ -0,0 +1,111 @@
+# explorer.py
+import chess
+from chess.polyglot import zobrist_hash
+from django.conf import settings
+from django.db import transaction
+
+from .models import Game, Move, OpeningStat
+from .utils import decode_move, signed_key
+from .zobrist import push as zobrist_push
+
+# Only the first plies of each game are counted; later positions rarely recur
+EXPLORER_PLIES = getattr(settings, 'OPENING_EXPLORER_PLIES', 40)
+# Keeps each IN (...) query under SQLite's variable limit
+KEY_CHUNK = 500
+START_KEY = zobrist_hash(chess.Board())
+
+
+def count_games(game_ids):
+    """
+    Adds the opening moves of the given finished games to OpeningStat, with
+    a few queries for the whole batch. Each game is counted once: games
+    already counted are skipped. A game whose move log doesn't hold every
+    ply from the first (one started before the log existed) can't be
+    replayed from the starting position, so it is marked counted but left
+    out. Returns the number of games counted.
+    """
+    with transaction.atomic():
+        games = {
+            game_id: (winner_id, white_id, move_count)
+            for game_id, winner_id, white_id, move_count in Game.objects.select_for_update()
+            .filter(id__in=game_ids, status='finished', in_explorer=False)
+            .values_list('id', 'winner_id', 'player1_id', 'move_count')
+        }
+        if not games:
+            return 0
+        Game.objects.filter(id__in=games).update(in_explorer=True)
+
+        logs = {}
+        moves = (
+            Move.objects.filter(game_id__in=games, ply__lte=EXPLORER_PLIES)
+            .order_by('game_id', 'ply').values_list('game_id', 'ply', 'move')
+        )
+        for game_id, ply, encoded in moves.iterator(chunk_size=2000):
+            logs.setdefault(game_id, []).append((ply, encoded))
+
+        # (position key, move) -> [white wins, draws, black wins]
+        deltas = {}
+        counted = 0
+        for game_id, log in logs.items():
+            winner_id, white_id, move_count = games[game_id]
+            if [ply for ply, _ in log] != list(range(1, min(move_count, EXPLORER_PLIES) + 1)):
+                continue
+            result = 1 if winner_id is None else (0 if winner_id == white_id else 2)
+            board, key = chess.Board(), START_KEY
+            for _, encoded in log:
+                deltas.setdefault((signed_key(key), encoded), [0, 0, 0])[result] += 1
+                key = zobrist_push(board, decode_move(encoded), key)
+            counted += 1
+
+        _apply(deltas)
+    return counted
+
+
+def _apply(deltas):
+    """Adds the counts to OpeningStat: new rows are inserted, existing ones incremented."""
+    pairs = list(deltas)
+    for start in range(0, len(pairs), KEY_CHUNK):
+        chunk = pairs[start:start + KEY_CHUNK]
+        # Make sure every row exists, so the rows locked below are all there is to update
+        OpeningStat.objects.bulk_create(
+            [OpeningStat(position_key=key, move=move) for key, move in chunk], ignore_conflicts=True
+        )
+        wanted = set(chunk)
+        totals = []
+        for row in OpeningStat.objects.select_for_update().filter(position_key__in={key for key, _ in chunk}):
+            if (row.position_key, row.move) in wanted:
+                delta = deltas[row.position_key, row.move]
+                row.white_wins += delta[0]
+                row.draws += delta[1]
+                row.black_wins += delta[2]
+                totals.append(row)
+        # One upsert writes all the new totals; bulk_update would build a CASE per row
+        OpeningStat.objects.bulk_create(
+            totals, update_conflicts=True, unique_fields=['position_key', 'move'],
+            update_fields=['white_wins', 'draws', 'black_wins'],
+        )
+
+
+def explore(board):
+    """
+    The moves played from this position in our games, most played first,
+    each with its results. Reads only OpeningStat, through its index.
+    """
+    rows = OpeningStat.objects.filter(position_key=signed_key(zobrist_hash(board))).values_list(
+        'move', 'white_wins', 'draws', 'black_wins'
+    )
+    moves = []
+    for encoded, white_wins, draws, black_wins in rows:
+        move = decode_move(encoded)
+        if not board.is_legal(move):
+            continue  # Hash collision with another position
+        moves.append({
+            'uci': move.uci(),
+            'san': board.san(move),
+            'white': white_wins,
+            'draws': draws,
+            'black': black_wins,
+            'games': white_wins + draws + black_wins,
+        })
+    moves.sort(key=lambda entry: entry['games'], reverse=True)
+    return moves
@@ -0,0 +1,88 @@
+# export.py
+import zlib
+from itertools import groupby
+
+from django.db.models import Q
+
+from .models import Game, Move
+from .pgn import format_game
+
+TERMINATIONS = dict(Game.TERMINATION_CHOICES)
+GAME_FIELDS = (
+    'id', 'player1_id', 'player1__username', 'player2__username', 'winner_id',
+    'termination', 'move_count', 'base_time', 'increment', 'created_at',
+)
+
+
+def finished_games(user=None, since=None, until=None):
+    """Finished games, optionally of one user and finished between two dates (inclusive)."""
+    games = Game.objects.filter(status='finished')
+    if user is not None:
+        games = games.filter(Q(player1=user) | Q(player2=user))
+    if since is not None:
+        games = games.filter(updated_at__date__gte=since)
+    if until is not None:
+        games = games.filter(updated_at__date__lte=until)
+    return games
+
+
+def _headers(game):
+    if game['winner_id'] is None:
+        result = '1/2-1/2'
+    else:
+        result = '1-0' if game['winner_id'] == game['player1_id'] else '0-1'
+    headers = [
+        ('Event', "Online game"),
+        ('Site', "?"),
+        ('Date', game['created_at'].strftime('%Y.%m.%d')),
+        ('Round', "-"),
+        ('White', game['player1__username']),
+        ('Black', game['player2__username']),
+        ('Result', result),
+        ('GameId', str(game['id'])),
+        ('TimeControl', f"{game['base_time']}+{game['increment']}" if game['base_time'] else "-"),
+    ]
+    if game['termination']:
+        headers.append(('Termination', TERMINATIONS.get(game['termination'], game['termination'])))
+    return headers, result
+
+
+def export_pgn(games, batch_size=500):
+    """
+    Yields the games of a queryset as PGN text, one game at a time. Games are
+    read in id order, `batch_size` per query, with one query for the moves of
+    each batch, so memory does not grow with the number of games.
+    """
+    games = games.order_by('id').values(*GAME_FIELDS)
+    last_id = 0
+    while True:
+        batch = list(games.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1]['id']
+        moves = (
+            Move.objects.filter(game_id__in=[game['id'] for game in batch])
+            .order_by('game_id', 'ply').values_list('game_id', 'move')
+        )
+        logged = {
+            game_id: [move for _, move in rows]
+            for game_id, rows in groupby(moves.iterator(chunk_size=2000), key=lambda row: row[0])
+        }
+        for game in batch:
+            headers, result = _headers(game)
+            game_moves = logged.get(game['id'], [])
+            if len(game_moves) != game['move_count']:
+                # Finished before the move log existed; the result is all there is
+                headers.append(('Annotator', "Moves not recorded"))
+                game_moves = []
+            yield format_game(headers, game_moves, result)
+
+
+def gzip_stream(chunks, level=6):
+    """Compresses a stream of strings into gzip bytes as it goes."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -67,6 +67,7 @@ from django.core import validators
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
+from .computer import is_reserved_username
 
 # Validator function for checking valid chess positions
 def validate_chess_position(value):
@@ -134,6 +135,13 @@ class JoinForm(forms.ModelForm):
         fields = ('first_name', 'last_name', 'username', 'email', 'password')
         help_texts = {'username': None}
 
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        # The computer player's account is created on first use; nobody may sign up as it before then
+        if is_reserved_username(username):
+            raise forms.ValidationError("This username is reserved.")
+        return username
+
 class LoginForm(forms.Form):
     username = forms.CharField()
     password = forms.CharField(widget=forms.PasswordInput())
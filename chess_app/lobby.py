@@ -0,0 +1,141 @@
+# lobby.py
+import heapq
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Q
+
+from .models import Challenge, Game, JournalEntry
+
+_config = getattr(settings, 'LOBBY', {})
+LOBBY_TTL = _config.get('TTL', 10)
+LOBBY_GAMES = _config.get('GAMES', 20)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _cache():
+    return caches[_config.get('CACHE', 'default')]
+
+
+def _version_key(user_id):
+    return f"lobby:version:{user_id}"
+
+
+def invalidate_lobby(*user_ids):
+    """
+    Drops the users' cached lobby snapshots. Each user gets a new version
+    token, never reused, so a snapshot cached under an older one is never
+    read again, even if the version itself was evicted.
+    """
+    _cache().set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, timeout=None)
+
+
+def encode_cursor(updated_at, game_id):
+    """Where a history page ended, as a URL-safe token: microseconds since the epoch and the game id."""
+    return f"{(updated_at - EPOCH) // timedelta(microseconds=1)}_{game_id}"
+
+
+def decode_cursor(cursor):
+    """The (updated_at, game id) pair of encode_cursor. Raises ValueError for anything else."""
+    micros, _, game_id = cursor.partition('_')
+    try:
+        return EPOCH + timedelta(microseconds=int(micros)), int(game_id)
+    except OverflowError:
+        raise ValueError(f"Cursor out of range: {cursor}")
+
+
+def _history_side(user, side, cursor, limit):
+    """Up to `limit` finished games `user` played as `side` ('player1' or 'player2') and kept, newest first, from before `cursor`."""
+    opponent = 'player2' if side == 'player1' else 'player1'
+    # hidden__in rather than hidden=False, which is written NOT hidden: an equality keeps the index in updated_at order
+    games = Game.objects.filter(**{side: user, 'status': 'finished', f'hidden_by_{side}__in': [False]})
+    if cursor is not None:
+        updated_at, game_id = cursor
+        # The extra upper bound is what the index range scan starts from; the OR only breaks ties
+        games = games.filter(
+            Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=game_id), updated_at__lte=updated_at
+        )
+    return list(
+        games.order_by('-updated_at', '-id')
+        .values('id', 'updated_at', 'move_count', 'winner_id', opponent_name=F(f'{opponent}__username'))[:limit]
+    )
+
+
+def completed_games_page(user, cursor=None, limit=LOBBY_GAMES):
+    """
+    One page of the user's finished games, newest first: (games, next
+    cursor), the cursor None on the last page. A game can't use one index
+    for "player1 or player2", so each side is its own range scan of a
+    (player, status, hidden, updated_at, id) index, and the two are merged
+    here. Each page costs the same three queries however long the history.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    # One more than a page from each side tells whether anything is left after this page
+    sides = [_history_side(user, side, position, limit + 1) for side in ('player1', 'player2')]
+    key = lambda game: (game['updated_at'], game['id'])
+    games = list(islice(heapq.merge(*sides, key=key, reverse=True), limit))
+    more = sum(len(side) for side in sides) > limit
+
+    journal = dict(
+        JournalEntry.objects.filter(user=user, game_id__in=[game['id'] for game in games])
+        .values_list('game_id', 'description')
+    )
+    page = [
+        {
+            'id': game['id'],
+            'opponent': game['opponent_name'],
+            'move_count': game['move_count'],
+            'result': 'draw' if game['winner_id'] is None else ('won' if game['winner_id'] == user.id else 'lost'),
+            'journal': journal.get(game['id']),
+        }
+        for game in games
+    ]
+    return page, encode_cursor(*key(games[-1])) if more else None
+
+
+def build_snapshot(user):
+    """
+    Everything the lobby shows about one user, in five queries whatever the
+    user's history: one for the ongoing game, one for pending challenges
+    both ways, and three for the first page of finished games (one scan per
+    side of the board and the journal notes, see completed_games_page).
+    """
+    ongoing_game_id = Game.objects.filter(
+        Q(player1=user) | Q(player2=user), status='ongoing'
+    ).values_list('id', flat=True).first()
+
+    challengers, challenged = [], []
+    for challenger_id, challenged_id in Challenge.objects.filter(
+        Q(challenger=user) | Q(challenged=user), status='pending'
+    ).values_list('challenger_id', 'challenged_id'):
+        if challenged_id == user.id:
+            challengers.append(challenger_id)
+        else:
+            challenged.append(challenged_id)
+
+    completed_games, history_cursor = completed_games_page(user)
+    return {
+        'ongoing_game_id': ongoing_game_id,
+        'challengers': challengers,
+        'challenged': challenged,
+        'completed_games': completed_games,
+        'history_cursor': history_cursor,
+    }
+
+
+def lobby_snapshot(user):
+    """The user's lobby snapshot, from the cache when no event has changed it in the last LOBBY_TTL seconds."""
+    cache = _cache()
+    version = cache.get(_version_key(user.id))
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(_version_key(user.id), version, timeout=None)
+    key = f"lobby:{user.id}:{version}"
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(user)
+        cache.set(key, snapshot, LOBBY_TTL)
+    return snapshot
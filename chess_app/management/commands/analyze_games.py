@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chess_app.analysis import BATCH_SIZE, analyze_games, claim_pending, get_analysis_pool
+from chess_app.models import Game, GameAnalysis
+
+
+class Command(BaseCommand):
+    help = (
+        "Drains the queue of pending game analyses on a process pool. Run it next to the "
+        "web server when ANALYSIS['IN_PROCESS'] is off, or to work through a backlog."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Engine processes (default: ANALYSIS['WORKERS']).")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Games claimed at a time.")
+        parser.add_argument('--all', action='store_true', help="First queue every finished game never analysed.")
+        parser.add_argument(
+            '--requeue', action='store_true',
+            help="First put back analyses left running by a process that stopped.",
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            requeued = GameAnalysis.objects.filter(status='running').update(status='pending')
+            self.stdout.write(f"Requeued {requeued} analyses.")
+        if options['all']:
+            missing = Game.objects.filter(status='finished', analysis__isnull=True).values_list('id', flat=True)
+            queued = GameAnalysis.objects.bulk_create(
+                [GameAnalysis(game_id=game_id) for game_id in missing.iterator()], batch_size=1000
+            )
+            self.stdout.write(f"Queued {len(queued)} games.")
+
+        games = positions = unique = 0
+        started = time.perf_counter()
+        with get_analysis_pool(options['workers']) as pool:
+            while True:
+                batch = claim_pending(options['batch_size'])
+                if not batch:
+                    break
+                batch_positions, batch_unique = analyze_games(batch, pool)
+                games += len(batch)
+                positions += batch_positions
+                unique += batch_unique
+        elapsed = time.perf_counter() - started
+
+        if not games:
+            self.stdout.write("No pending analyses.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysed {games} games ({positions} positions, {unique} searched) in {elapsed:.2f}s: "
+            f"{games / elapsed:.1f} games/s, {unique / elapsed:.0f} positions/s."
+        ))
@@ -0,0 +1,72 @@
+import random
+import timeit
+
+import chess
+from django.core.management.base import BaseCommand
+
+from chess_app import utils
+from chess_app.utils import board_to_dict, piece_to_html
+
+
+def board_to_dict_reference(fen):
+    """The previous implementation: builds a chess.Board and queries all 64 squares."""
+    board = chess.Board(fen)
+    board_dict = []
+    for rank in reversed(range(1, 9)):
+        row = {}
+        for file in range(8):
+            square_index = chess.square(file, rank - 1)
+            square_name = chess.square_name(square_index)
+            piece = board.piece_at(square_index)
+            if piece:
+                row[square_name] = piece_to_html.get(piece.symbol(), piece.symbol())
+            else:
+                row[square_name] = "&nbsp;"
+        board_dict.append(row)
+    return board_dict
+
+
+class Command(BaseCommand):
+    help = "Compares board_to_dict with the previous chess.Board based implementation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--positions', type=int, default=200, help="Distinct positions to render.")
+        parser.add_argument('--repeat', type=int, default=20, help="Renders per position.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        fens = self.random_positions(options['positions'], options['seed'])
+        for fen in fens:
+            if board_to_dict(fen) != board_to_dict_reference(fen):
+                raise AssertionError(f"Output differs from the reference for {fen}")
+
+        calls = len(fens) * options['repeat']
+        results = {}
+        for name, func in (('reference', board_to_dict_reference), ('table-driven', board_to_dict)):
+            utils._render_placement.cache_clear()
+            seconds = timeit.timeit(lambda: [func(fen) for fen in fens], number=options['repeat'])
+            results[name] = seconds
+            self.stdout.write(f"{name:>13}: {calls / seconds:12,.0f} boards/s ({seconds * 1e6 / calls:.2f} us/board)")
+
+        # Without the cache: every placement is parsed once
+        seconds = timeit.timeit(
+            lambda: [utils._render_placement.cache_clear() or board_to_dict(fen) for fen in fens], number=options['repeat']
+        )
+        self.stdout.write(f"{'uncached':>13}: {calls / seconds:12,.0f} boards/s ({seconds * 1e6 / calls:.2f} us/board)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Speedup: {results['reference'] / results['table-driven']:.1f}x with cache, "
+            f"{results['reference'] / seconds:.1f}x without"
+        ))
+
+    def random_positions(self, count, seed):
+        rng = random.Random(seed)
+        fens = []
+        while len(fens) < count:
+            board = chess.Board()
+            for _ in range(rng.randrange(0, 80)):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+            fens.append(board.fen())
+        return fens
@@ -0,0 +1,41 @@
+import chess
+from django.core.management.base import BaseCommand, CommandError
+
+from chess_app.engine import Engine
+
+# Opening, tactical middlegame (Kiwipete), quiet middlegame and endgame positions
+POSITIONS = [
+    chess.STARTING_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 8",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Searches a fixed set of positions to a fixed depth and reports the engine's "
+        "nodes per second. Fails below --min-nps, to catch search speed regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=4, help="Search depth per position.")
+        parser.add_argument('--min-nps', type=int, default=0, help="Fail if the overall nodes per second is lower.")
+
+    def handle(self, *args, **options):
+        nodes = seconds = 0
+        for fen in POSITIONS:
+            # A fresh engine per position, so the transposition table does not carry over between runs
+            result = Engine().search(chess.Board(fen), time_limit=None, max_depth=options['depth'])
+            nodes += result['nodes']
+            seconds += result['time']
+            self.stdout.write(
+                f"depth {result['depth']:>2}  {result['nodes']:>9,} nodes  {result['time']:6.2f}s  "
+                f"{result['nps']:>7,} nps  {result['move']:<6} {fen}"
+            )
+
+        nps = int(nodes / seconds) if seconds else 0
+        message = f"Total: {nodes:,} nodes in {seconds:.2f}s, {nps:,} nodes/s"
+        if nps < options['min_nps']:
+            raise CommandError(f"{message}, below the minimum of {options['min_nps']:,}.")
+        self.stdout.write(self.style.SUCCESS(message))
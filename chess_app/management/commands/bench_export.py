@@ -0,0 +1,104 @@
+import time
+import tracemalloc
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from chess_app.export import export_pgn, finished_games, gzip_stream
+from chess_app.models import SNAPSHOT_INTERVAL, ChessGame, Game, Move
+from chess_app.synthetic import random_games
+
+# Distinct games played; the rest repeat them, since only the export is measured
+DISTINCT_GAMES = 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports a large set of synthetic finished games through the streaming PGN export under "
+        "tracemalloc, and fails unless the peak memory of the whole export stays within --max-growth "
+        "of the peak for a single batch: an export that held on to what it had written would grow "
+        "with the number of batches. The games are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=5000)
+        parser.add_argument('--plies', type=int, default=80, help="Longest game; the shortest is half as long.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Games per export query.")
+        parser.add_argument('--max-growth', type=float, default=2.0, help="Allowed ratio of the full to the one-batch peak.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['games'] < 2 * options['batch_size']:
+            raise CommandError("--games must be at least two batches.")
+        suffix = uuid.uuid4().hex[:8]
+        white = User.objects.create(username=f"bench_white_{suffix}")
+        black = User.objects.create(username=f"bench_black_{suffix}")
+        try:
+            started = time.perf_counter()
+            self.create_games(white, black, options)
+            self.stdout.write(f"Created {options['games']} games in {time.perf_counter() - started:.1f}s")
+
+            games = finished_games(white)
+            one_batch = games.filter(id__in=games.order_by('id').values('id')[:options['batch_size']])
+            small = self.measure(one_batch, options['batch_size'])
+            full = self.measure(games, options['batch_size'])
+        finally:
+            Game.objects.filter(player1=white).delete()
+            ChessGame.objects.filter(user=black).delete()
+            User.objects.filter(id__in=[white.id, black.id]).delete()
+
+        for label, (count, size, peak, seconds) in (("one batch", small), ("all games", full)):
+            self.stdout.write(
+                f"{label:>9}: {count:6} games, {size / 2**10:8.1f} KiB gzip, "
+                f"peak {peak / 2**20:6.2f} MiB, {count / seconds:8,.0f} games/s"
+            )
+        growth = full[2] / small[2]
+        if growth > options['max_growth']:
+            raise CommandError(
+                f"Exporting {full[0]} games peaked at {growth:.2f}x the memory of one batch "
+                f"(at most {options['max_growth']}x allowed)."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {full[0]} games with a peak of {growth:.2f}x the memory of one batch of {options['batch_size']}."
+        ))
+
+    def create_games(self, white, black, options):
+        plies = options['plies']
+        played = random_games(f"{options['seed']}:export", DISTINCT_GAMES, plies // 2, plies, SNAPSHOT_INTERVAL)
+        with transaction.atomic():
+            for start in range(0, options['games'], options['batch_size']):
+                chunk = [played[n % DISTINCT_GAMES] for n in range(start, min(start + options['batch_size'], options['games']))]
+                boards = ChessGame.objects.bulk_create([ChessGame(user=black, fen=game['fen']) for game in chunk])
+                rows = Game.objects.bulk_create([
+                    Game(
+                        player1=white, player2=black, current_turn=white, board=board, status='finished',
+                        winner={'1-0': white, '0-1': black}.get(game['result']), termination=game['termination'],
+                        move_count=len(game['moves']), positions_indexed=False, in_explorer=False,
+                    )
+                    for game, board in zip(chunk, boards)
+                ])
+                Move.objects.bulk_create(
+                    [
+                        Move(game_id=row.id, ply=ply, move=encoded)
+                        for row, game in zip(rows, chunk)
+                        for ply, encoded in enumerate(game['moves'], start=1)
+                    ],
+                    batch_size=1000,
+                )
+
+    def measure(self, games, batch_size):
+        """Streams `games` as gzipped PGN and returns the games, bytes, peak traced memory and seconds."""
+        connection.queries_log.clear()  # Grows with every query while DEBUG is on
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = 0
+        try:
+            for chunk in gzip_stream(export_pgn(games, batch_size=batch_size)):
+                size += len(chunk)
+            seconds = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return games.count(), size, peak, seconds
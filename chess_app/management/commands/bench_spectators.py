@@ -0,0 +1,91 @@
+import asyncio
+import time
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from chess_app.models import ChessGame, Game
+from chess_app.routing import websocket_urlpatterns
+
+# An opening that stops a move short of mate: a finished game would be rated and counted in
+# the opening explorer, which deleting it afterwards does not undo
+MOVES = ['e2e4', 'e7e5', 'f1c4', 'b8c6', 'd1h5', 'g8f6']
+
+
+class Command(BaseCommand):
+    help = (
+        "Plays a game in front of many spectators over the in-memory channel layer and "
+        "reports how long the players and the spectators wait for each move."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spectators', type=int, default=200)
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        users = [User.objects.create(username=f"bench_{name}_{suffix}") for name in ('white', 'black', 'watcher')]
+        try:
+            game = Game.objects.create(
+                player1=users[0], player2=users[1], current_turn=users[0],
+                board=ChessGame.objects.create(user=users[1]),
+            )
+            # One process with no database thread pool: the figures show the fan-out itself
+            with override_settings(
+                CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                CHANNELS_DB_EXECUTOR={'WORKERS': 0},
+            ):
+                asyncio.run(self.run(game, users, options['spectators']))
+        finally:
+            # The moves go with the game
+            Game.objects.filter(player1=users[0]).delete()
+            ChessGame.objects.filter(user=users[1]).delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    async def run(self, game, users, spectator_count):
+        app = URLRouter(websocket_urlpatterns)
+
+        async def connect(user):
+            communicator = WebsocketCommunicator(app, f"/ws/game/{game.id}/")
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError("Could not connect to the game.")
+            return communicator
+
+        players = [await connect(users[0]), await connect(users[1])]
+        started = time.perf_counter()
+        spectators = [await connect(users[2]) for _ in range(spectator_count)]
+        for spectator in spectators:
+            await spectator.receive_json_from(timeout=5)  # join snapshot
+        self.stdout.write(f"{spectator_count} spectators joined in {time.perf_counter() - started:.3f}s")
+
+        player_waits, spectator_waits = [], []
+        for ply, move in enumerate(MOVES, start=1):
+            started = time.perf_counter()
+            await players[(ply - 1) % 2].send_json_to({'action': 'move', 'move': move})
+            for player in players:
+                update = await player.receive_json_from(timeout=5)
+            player_waits.append(time.perf_counter() - started)
+            if update.get('seq') != ply:
+                raise RuntimeError(f"Unexpected update for move {move}: {update}")
+
+            # Spectators may get merged updates, so wait until each one has seen this move
+            for spectator in spectators:
+                seq = 0
+                while seq < ply:
+                    seq = (await spectator.receive_json_from(timeout=5))['seq']
+            spectator_waits.append(time.perf_counter() - started)
+
+        for communicator in players + spectators:
+            await communicator.disconnect()
+
+        def summary(waits):
+            return f"avg {sum(waits) / len(waits) * 1000:.1f} ms, max {max(waits) * 1000:.1f} ms"
+
+        self.stdout.write(f"players:    {summary(player_waits)} per move")
+        self.stdout.write(f"spectators: {summary(spectator_waits)} per move until all {spectator_count} are updated")
+        self.stdout.write(self.style.SUCCESS(f"Played {len(MOVES)} moves in front of {spectator_count} spectators; the bench game and users are deleted."))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chess_app.explorer import count_games
+from chess_app.models import Game, OpeningStat
+
+
+class Command(BaseCommand):
+    help = (
+        "Counts the finished games not yet in the opening explorer (e.g. games played before "
+        "it existed), in batches. New games are counted as they finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--rebuild', action='store_true', help="Empty the explorer and count every game again.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            OpeningStat.objects.all().delete()
+            Game.objects.filter(in_explorer=True).update(in_explorer=False)
+
+        started = time.perf_counter()
+        counted = 0
+        pending = Game.objects.filter(status='finished', in_explorer=False).order_by('id').values_list('id', flat=True)
+        while True:
+            # Counted games leave the filter, so each batch starts from the front
+            batch = list(pending[:options['batch_size']])
+            if not batch:
+                break
+            counted += count_games(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {counted} games in {elapsed:.2f}s; the explorer holds {OpeningStat.objects.count()} moves."
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chess_app.models import Game
+from chess_app.positions import index_games
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds the finished games not yet in the position index (games played before it existed "
+        "and imported games) to it, in batches. Games played since are indexed move by move; "
+        "games in progress that aren't are left until they are over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Games per transaction.")
+        parser.add_argument('--rebuild', action='store_true', help="Index every finished game again.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            # Games in progress go on being indexed move by move. index_games replaces the rows of the
+            # finished games it can replay, and keeps those of games whose move log is incomplete.
+            Game.objects.filter(status='finished', positions_indexed=True).update(positions_indexed=False)
+
+        started = time.perf_counter()
+        games = positions = 0
+        pending = Game.objects.filter(status='finished', positions_indexed=False).order_by('id').values_list('id', flat=True)
+        while True:
+            # Indexed games leave the filter, so each batch starts from the front
+            batch = list(pending[:options['batch_size']])
+            if not batch:
+                break
+            positions += index_games(batch)
+            games += len(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {positions} positions of {games} games in {elapsed:.2f}s "
+            f"({positions / elapsed if elapsed else 0:.0f} positions/s)."
+        ))
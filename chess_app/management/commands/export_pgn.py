@@ -0,0 +1,42 @@
+import sys
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chess_app.export import export_pgn, finished_games, gzip_stream
+
+
+class Command(BaseCommand):
+    help = "Writes finished games (of one user, or everyone's) as PGN, streamed in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username whose games to export; all games by default.")
+        parser.add_argument('--since', type=date.fromisoformat, help="First day (YYYY-MM-DD) a game may have finished.")
+        parser.add_argument('--until', type=date.fromisoformat, help="Last day (YYYY-MM-DD) a game may have finished.")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Games per query.")
+        parser.add_argument('-o', '--output', help="File to write; standard output by default.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['user']}.")
+
+        stream = export_pgn(finished_games(user, options['since'], options['until']), options['batch_size'])
+        if options['gzip']:
+            chunks = gzip_stream(stream)
+        else:
+            chunks = (text.encode() for text in stream)
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
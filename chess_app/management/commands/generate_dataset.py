@@ -0,0 +1,299 @@
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from chess_app.clocks import TIME_CONTROLS
+from chess_app.models import (
+    SNAPSHOT_INTERVAL, Challenge, ChessGame, Game, JournalEntry, Move, PlayerRating, PositionIndex, PositionSnapshot,
+)
+from chess_app.synthetic import journal_text, random_games
+from journal.models import JournalEntry as DiaryEntry
+
+# Keeps each IN (...) query under SQLite's variable limit
+NAME_CHUNK = 500
+# Games per dating UPDATE; each game takes five variables
+TIME_CHUNK = 150
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with synthetic users, rated players, pending challenges, finished and "
+        "ongoing games of random legal moves, journal entries and games hidden from players' "
+        "histories. Worker processes play the games, and each chunk is written with bulk inserts "
+        "in one transaction. Everything follows from --seed, so the same options always give the "
+        "same data. Finished games are left for build_position_index and build_explorer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--games', type=int, default=10000, help="Finished games.")
+        parser.add_argument('--ongoing', type=int, default=100, help="Games in progress, at most one per player.")
+        parser.add_argument('--challenges', type=int, default=200, help="Pending challenges.")
+        parser.add_argument('--game-notes', type=float, default=0.2, help="Share of finished games with a player's journal note.")
+        parser.add_argument('--journal-entries', type=int, default=3, help="General journal entries per user.")
+        parser.add_argument('--hidden', type=float, default=0.05, help="Share of finished games each player deleted from their history.")
+        parser.add_argument('--min-plies', type=int, default=10)
+        parser.add_argument('--max-plies', type=int, default=160)
+        parser.add_argument('--days', type=int, default=365, help="Finished games are spread over this many days up to now.")
+        parser.add_argument('--prefix', default='synthetic', help="Usernames are the prefix and a number.")
+        parser.add_argument('--password', help="Password for every generated user; unusable by default.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes playing the games.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Games per chunk and transaction.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("At least two users are needed to play games.")
+        if not 0 <= options['min_plies'] <= options['max_plies']:
+            raise CommandError("--min-plies must be between 0 and --max-plies.")
+        self.options = options
+        self.seed = options['seed']
+        self.rows = 0
+        self.started = self.reported = time.perf_counter()
+
+        self.user_ids = self.create_users()
+        self.create_journal_entries()
+
+        workers = max(options['workers'] or 1, 1)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            self.create_finished_games(pool, workers)
+            playing = self.create_ongoing_games(pool)
+        finally:
+            pool.shutdown(cancel_futures=True)
+        self.create_challenges(playing)
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {self.rows} rows in {elapsed:.1f}s: {self.rows / elapsed if elapsed else 0:.0f} rows/s. "
+            f"Run build_position_index and build_explorer to index the finished games."
+        ))
+
+    def rng(self, *path):
+        # One independent, reproducible stream per part of the dataset, whatever the number of workers
+        return random.Random(':'.join(str(part) for part in (self.seed, *path)))
+
+    def progress(self, rows):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self.reported >= 5:
+            self.reported = now
+            self.stdout.write(f"{self.rows} rows, {self.rows / (now - self.started):.0f} rows/s")
+
+    def create_users(self):
+        """Creates the users that don't exist yet, with ratings; returns the ids of all of them, in order."""
+        count, prefix = self.options['users'], self.options['prefix']
+        # Hashed once: hashing a password for every user would take longer than everything else
+        password = make_password(self.options['password']) if self.options['password'] else None
+        rng = self.rng('ratings')
+        usernames = [f"{prefix}{n}" for n in range(count)]
+        ids = {}
+        for start in range(0, count, NAME_CHUNK):
+            chunk = usernames[start:start + NAME_CHUNK]
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    [User(username=username, password=password or make_password(None)) for username in chunk],
+                    ignore_conflicts=True,
+                )
+                chunk_ids = dict(User.objects.filter(username__in=chunk).values_list('username', 'id'))
+                PlayerRating.objects.bulk_create(
+                    [
+                        PlayerRating(user_id=chunk_ids[username], rating=rng.gauss(1500, 250), rd=rng.uniform(50, 350), games=rng.randint(0, 500))
+                        for username in chunk
+                    ],
+                    ignore_conflicts=True,
+                )
+            ids.update(chunk_ids)
+            self.progress(2 * len(chunk))
+        return [ids[username] for username in usernames]
+
+    def create_journal_entries(self):
+        per_user = self.options['journal_entries']
+        if not per_user:
+            return
+        rng = self.rng('journal')
+        for start in range(0, len(self.user_ids), NAME_CHUNK):
+            entries = []
+            for user_id in self.user_ids[start:start + NAME_CHUNK]:
+                for _ in range(per_user):
+                    description, entry = journal_text(rng)
+                    entries.append(DiaryEntry(user_id=user_id, description=description, entry=entry))
+            DiaryEntry.objects.bulk_create(entries, batch_size=1000)
+            self.progress(len(entries))
+
+    def create_finished_games(self, pool, workers):
+        total, batch_size = self.options['games'], self.options['batch_size']
+        # One game finishes every `step` over the last --days, in id order
+        step = timedelta(days=self.options['days']) / max(total, 1)
+        first_at = timezone.now() - timedelta(days=self.options['days'])
+        # Chunks being played, oldest first; bounded so the workers never run far ahead of the writes
+        pending = deque()
+        for chunk, start in enumerate(range(0, total, batch_size)):
+            count = min(batch_size, total - start)
+            future = pool.submit(
+                random_games, f"{self.seed}:games:{chunk}", count, self.options['min_plies'], self.options['max_plies'],
+                SNAPSHOT_INTERVAL, notes=self.options['game_notes'],
+            )
+            pending.append((future, chunk, first_at + step * start, step))
+            if len(pending) >= 2 * workers:
+                self.save_finished_games(*pending.popleft())
+        while pending:
+            self.save_finished_games(*pending.popleft())
+
+    def save_finished_games(self, future, chunk, first_at, step):
+        games = future.result()
+        rng = self.rng('players', chunk)
+        hidden = self.options['hidden']
+        with transaction.atomic():
+            players = [rng.sample(self.user_ids, 2) for _ in games]
+            boards = ChessGame.objects.bulk_create([ChessGame(user_id=black, fen=game['fen']) for game, (_, black) in zip(games, players)])
+            rows, times = [], []
+            for n, (game, (white, black), board) in enumerate(zip(games, players, boards)):
+                base_time, increment = rng.choice(TIME_CONTROLS)
+                finished_at = first_at + step * n
+                times.append((finished_at - timedelta(seconds=10 * len(game['moves'])), finished_at))
+                rows.append(Game(
+                    player1_id=white,
+                    player2_id=black,
+                    current_turn_id=white if len(game['moves']) % 2 == 0 else black,
+                    board=board,
+                    winner_id={'1-0': white, '0-1': black}.get(game['result']),
+                    status='finished',
+                    termination=game['termination'],
+                    move_count=len(game['moves']),
+                    base_time=base_time,
+                    increment=increment,
+                    hidden_by_player1=rng.random() < hidden,
+                    hidden_by_player2=rng.random() < hidden,
+                    positions_indexed=False,  # Left to build_position_index, to keep generation fast
+                ))
+            rows = Game.objects.bulk_create(rows)
+            self.set_times(rows, times)
+            self.save_moves(rows, games)
+            notes = [
+                JournalEntry(user_id=rng.choice((row.player1_id, row.player2_id)), game_id=row.id, description=game['note'][0], entry=game['note'][1])
+                for row, game in zip(rows, games)
+                if game['note']
+            ]
+            JournalEntry.objects.bulk_create(notes, batch_size=1000)
+        self.progress(2 * len(rows) + len(notes))
+
+    def set_times(self, rows, times):
+        """
+        Dates the games with their (created_at, updated_at) pairs. bulk_create
+        stamps auto_now fields with the current time, on the instances too,
+        so they are written afterwards by QuerySet.update(), which leaves
+        them as given.
+        """
+        for start in range(0, len(rows), TIME_CHUNK):
+            chunk = [
+                (row.id, created_at, updated_at)
+                for row, (created_at, updated_at) in zip(rows[start:start + TIME_CHUNK], times[start:start + TIME_CHUNK])
+            ]
+            Game.objects.filter(id__in=[game_id for game_id, _, _ in chunk]).update(
+                created_at=Case(*(When(id=game_id, then=Value(created_at)) for game_id, created_at, _ in chunk), output_field=DateTimeField()),
+                updated_at=Case(*(When(id=game_id, then=Value(updated_at)) for game_id, _, updated_at in chunk), output_field=DateTimeField()),
+            )
+
+    def save_moves(self, rows, games):
+        now = timezone.now()
+        moves = Move.objects.bulk_create(
+            [
+                Move(game_id=row.id, ply=ply, move=encoded, created_at=now)
+                for row, game in zip(rows, games)
+                for ply, encoded in enumerate(game['moves'], start=1)
+            ],
+            batch_size=1000,
+        )
+        snapshots = PositionSnapshot.objects.bulk_create(
+            [
+                PositionSnapshot(game_id=row.id, ply=ply, fen=fen)
+                for row, game in zip(rows, games)
+                for ply, fen in game['snapshots']
+            ],
+            batch_size=1000,
+        )
+        self.progress(len(moves) + len(snapshots))
+
+    def create_ongoing_games(self, pool):
+        """Starts games between players who have none in progress yet; returns the ids of everyone playing."""
+        rng = self.rng('ongoing')
+        already = set(
+            Game.objects.filter(status='ongoing').values_list('player1_id', flat=True)
+        ) | set(Game.objects.filter(status='ongoing').values_list('player2_id', flat=True))
+        free = [user_id for user_id in self.user_ids if user_id not in already]
+        rng.shuffle(free)
+        count = min(self.options['ongoing'], len(free) // 2)
+        if count < self.options['ongoing']:
+            self.stdout.write(self.style.WARNING(f"Only {count} players are free for ongoing games."))
+        if not count:
+            return already
+        games = pool.submit(
+            random_games, f"{self.seed}:ongoing", count, self.options['min_plies'], self.options['max_plies'],
+            SNAPSHOT_INTERVAL, ongoing=True,
+        ).result()
+        with transaction.atomic():
+            players = [(free[2 * n], free[2 * n + 1]) for n in range(count)]
+            boards = ChessGame.objects.bulk_create([ChessGame(user_id=black, fen=game['fen']) for game, (_, black) in zip(games, players)])
+            rows = Game.objects.bulk_create([
+                Game(
+                    player1_id=white,
+                    player2_id=black,
+                    current_turn_id=white if len(game['moves']) % 2 == 0 else black,
+                    board=board,
+                    move_count=len(game['moves']),
+                )
+                for game, (white, black), board in zip(games, players, boards)
+            ])
+            self.save_moves(rows, games)
+            # Indexed like a game played here, so moves made from now on continue the index
+            positions = PositionIndex.objects.bulk_create(
+                [
+                    PositionIndex(game_id=row.id, ply=ply, position_key=key, material=material)
+                    for row, game in zip(rows, games)
+                    for ply, (key, material) in enumerate(game['positions'], start=1)
+                ],
+                batch_size=1000,
+            )
+        self.progress(2 * len(rows) + len(positions))
+        return already | {user_id for pair in players for user_id in pair}
+
+    def create_challenges(self, playing):
+        """
+        Pending challenges between players not in a game, as the lobby only
+        offers them; at most one per pair of players, either way round, as
+        send_challenge allows.
+        """
+        rng = self.rng('challenges')
+        free = [user_id for user_id in self.user_ids if user_id not in playing]
+        pairs = {
+            frozenset(pair)
+            for pair in Challenge.objects.filter(status='pending').values_list('challenger_id', 'challenged_id')
+        }
+        count = min(self.options['challenges'], len(free) * (len(free) - 1) // 2)
+        challenges = []
+        # Random pairs, skipping repeats; a few attempts per challenge are plenty unless nearly every pair is taken
+        for _ in range(10 * count):
+            if len(challenges) == count:
+                break
+            challenger, challenged = rng.sample(free, 2)
+            if frozenset((challenger, challenged)) in pairs:
+                continue
+            pairs.add(frozenset((challenger, challenged)))
+            base_time, increment = rng.choice(TIME_CONTROLS)
+            challenges.append(Challenge(challenger_id=challenger, challenged_id=challenged, base_time=base_time, increment=increment))
+        if len(challenges) < self.options['challenges']:
+            self.stdout.write(self.style.WARNING(f"Only {len(challenges)} pairs of free players were left for challenges."))
+        Challenge.objects.bulk_create(challenges, batch_size=1000)
+        self.progress(len(challenges))
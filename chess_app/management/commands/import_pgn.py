@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chess_app.computer import is_reserved_username
+from chess_app.models import SNAPSHOT_INTERVAL, ChessGame, Game, Move, PgnImport, PositionSnapshot
+from chess_app.pgn import parse_games, read_chunks
+
+USERNAME_LENGTH = User._meta.get_field('username').max_length
+# Keeps each IN (...) query under SQLite's variable limit
+NAME_CHUNK = 500
+# Players whose ids are remembered between chunks, so a huge file does not fill the memory
+USER_CACHE_SIZE = 100_000
+
+
+def username_for(name):
+    """The username a PGN player is imported as: the name, cut to length, unless it is the computer player's."""
+    username = name[:USERNAME_LENGTH]
+    if is_reserved_username(username):
+        # Otherwise the imported player's account would be taken for the computer's
+        username = f"pgn_{username}"[:USERNAME_LENGTH]
+    return username
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the finished games of a PGN file, streaming it in chunks of games that worker "
+        "processes parse. Each chunk is written in one transaction together with the file "
+        "position reached, so an interrupted import resumes where it stopped. Players are "
+        "matched to users by name; missing users are created without a usable password."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Parsing processes.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Games per chunk and transaction.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the saved position and import from the start.")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        checkpoint = PgnImport.objects.get_or_create(path=path, defaults={'size': size})[0]
+        if options['restart']:
+            checkpoint.size, checkpoint.offset, checkpoint.games, checkpoint.skipped = size, 0, 0, 0
+            checkpoint.save()
+        elif checkpoint.size != size:
+            raise CommandError(f"{path} changed since its import started; use --restart to import it again.")
+        elif checkpoint.offset:
+            self.stdout.write(f"Resuming at byte {checkpoint.offset} after {checkpoint.games} games.")
+
+        self.user_ids = {}
+        self.imported = self.skipped = 0
+        self.started = self.reported = time.perf_counter()
+        workers = max(options['workers'] or 1, 1)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        # Chunks being parsed, oldest first; bounded so the file is never read far ahead of the writes
+        pending = deque()
+        try:
+            with open(path, 'rb') as handle:
+                for text, end in read_chunks(handle, options['batch_size'], checkpoint.offset):
+                    pending.append((pool.submit(parse_games, text, SNAPSHOT_INTERVAL), end))
+                    if len(pending) >= 2 * workers:
+                        self.save_chunk(checkpoint, pending.popleft())
+                while pending:
+                    self.save_chunk(checkpoint, pending.popleft())
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(f"Interrupted at byte {checkpoint.offset}; run the command again to resume."))
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} games ({self.skipped} skipped) in {elapsed:.1f}s: "
+            f"{self.imported / elapsed if elapsed else 0:.0f} games/s."
+        ))
+
+    def save_chunk(self, checkpoint, job):
+        future, end = job
+        games, skipped = future.result()
+        with transaction.atomic():
+            users = self.get_user_ids({name for game in games for name in (game['white'], game['black'])})
+            now = timezone.now()
+            boards = ChessGame.objects.bulk_create([
+                ChessGame(user_id=users[game['black']], fen=game['fen']) for game in games
+            ])
+            rows = []
+            for game, board in zip(games, boards):
+                white, black = users[game['white']], users[game['black']]
+                rows.append(Game(
+                    player1_id=white,
+                    player2_id=black,
+                    current_turn_id=white if len(game['moves']) % 2 == 0 else black,
+                    board=board,
+                    winner_id={'1-0': white, '0-1': black}.get(game['result']),
+                    status='finished',
+                    termination=game['termination'],
+                    move_count=len(game['moves']),
+                    positions_indexed=False,  # Left to build_position_index, to keep the import fast
+                ))
+            rows = Game.objects.bulk_create(rows)
+            Move.objects.bulk_create(
+                [
+                    Move(game_id=row.id, ply=ply, move=encoded, created_at=now)
+                    for row, game in zip(rows, games)
+                    for ply, encoded in enumerate(game['moves'], start=1)
+                ],
+                batch_size=1000,
+            )
+            PositionSnapshot.objects.bulk_create(
+                [
+                    PositionSnapshot(game_id=row.id, ply=ply, fen=fen)
+                    for row, game in zip(rows, games)
+                    for ply, fen in game['snapshots']
+                ],
+                batch_size=1000,
+            )
+            checkpoint.offset = end
+            checkpoint.games += len(games)
+            checkpoint.skipped += skipped
+            checkpoint.save()
+
+        self.imported += len(games)
+        self.skipped += skipped
+        now = time.perf_counter()
+        if now - self.reported >= 5:
+            self.reported = now
+            self.stdout.write(
+                f"{self.imported} games, {self.imported / (now - self.started):.0f} games/s, "
+                f"{100 * end / checkpoint.size:.1f}% of the file"
+            )
+
+    def get_user_ids(self, names):
+        """Maps player names to user ids, creating the missing users; names are cut to the username length."""
+        if len(self.user_ids) > USER_CACHE_SIZE:
+            self.user_ids = {}
+        missing = [name for name in names if name not in self.user_ids]
+        usernames = {username_for(name) for name in missing}
+        User.objects.bulk_create(
+            [User(username=username, password=make_password(None)) for username in usernames],
+            ignore_conflicts=True,
+        )
+        usernames = list(usernames)
+        ids = {}
+        for start in range(0, len(usernames), NAME_CHUNK):
+            ids.update(User.objects.filter(username__in=usernames[start:start + NAME_CHUNK]).values_list('username', 'id'))
+        for name in missing:
+            self.user_ids[name] = ids[username_for(name)]
+        return self.user_ids
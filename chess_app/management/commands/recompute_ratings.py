@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chess_app.models import Game, PlayerRating
+from chess_app.ratings import MAX_RD, SCALE, glicko2_period, rate_game
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every player's Glicko-2 rating from the full game history, "
+        "one vectorized update per rating period."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period-days', type=float, default=1.0, help="Length of a rating period.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--pending', action='store_true',
+            help="Only rate finished games that were never rated (e.g. after a crash), one by one.",
+        )
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            rated = sum(
+                rate_game(game_id)
+                for game_id in Game.objects.filter(status='finished', rated=False)
+                .order_by('updated_at').values_list('id', flat=True).iterator()
+            )
+            self.stdout.write(self.style.SUCCESS(f"Rated {rated} pending games."))
+            return
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            games = list(
+                Game.objects.filter(status='finished').order_by('updated_at', 'id')
+                .values_list('player1_id', 'player2_id', 'winner_id', 'updated_at')
+            )
+            if not games:
+                self.stdout.write("No finished games.")
+                return
+            white_ids, black_ids, winner_ids, finished_at = zip(*games)
+
+            # Players become array indices
+            user_ids = np.unique(np.array(white_ids + black_ids))
+            white = np.searchsorted(user_ids, white_ids)
+            black = np.searchsorted(user_ids, black_ids)
+            score = np.array([
+                0.5 if winner is None else float(winner == white_id)
+                for white_id, winner in zip(white_ids, winner_ids)
+            ])
+            first = finished_at[0]
+            period_length = options['period_days'] * 86400
+            period = np.array([int((end - first).total_seconds() // period_length) for end in finished_at])
+
+            size = len(user_ids)
+            rating = np.full(size, PlayerRating.DEFAULT_RATING)
+            rd = np.full(size, PlayerRating.DEFAULT_RD)
+            volatility = np.full(size, PlayerRating.DEFAULT_VOLATILITY)
+
+            computing = time.perf_counter()
+            # Games are sorted by time, so each period is a contiguous slice
+            boundaries = np.flatnonzero(np.diff(period)) + 1
+            starts = np.concatenate([[0], boundaries])
+            ends = np.concatenate([boundaries, [len(period)]])
+            previous = period[0] - 1
+            for start, end in zip(starts, ends):
+                idle = period[start] - previous - 1
+                if idle:
+                    # Periods without any game still add uncertainty
+                    rd = np.minimum(SCALE * np.sqrt((rd / SCALE) ** 2 + idle * volatility ** 2), MAX_RD)
+                rating, rd, volatility = glicko2_period(
+                    rating, rd, volatility, white[start:end], black[start:end], score[start:end]
+                )
+                previous = period[start]
+            computed = time.perf_counter() - computing
+
+            played = np.bincount(white, minlength=size) + np.bincount(black, minlength=size)
+            now = timezone.now()
+            PlayerRating.objects.bulk_create(
+                [
+                    PlayerRating(
+                        user_id=int(user_id), rating=float(rating[i]), rd=float(rd[i]),
+                        volatility=float(volatility[i]), games=int(played[i]), updated_at=now,
+                    )
+                    for i, user_id in enumerate(user_ids)
+                ],
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['rating', 'rd', 'volatility', 'games', 'updated_at'],
+            )
+            # Players without a finished game start over
+            PlayerRating.objects.filter(updated_at__lt=now).update(
+                rating=PlayerRating.DEFAULT_RATING, rd=PlayerRating.DEFAULT_RD,
+                volatility=PlayerRating.DEFAULT_VOLATILITY, games=0,
+            )
+            Game.objects.filter(status='finished', rated=False, updated_at__lte=finished_at[-1]).update(rated=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rated {len(games)} games for {size} players over {len(starts)} periods "
+            f"in {time.perf_counter() - started:.2f}s ({computed:.2f}s computing)."
+        ))
@@ -0,0 +1,244 @@
+# matchmaking.py
+import asyncio
+import logging
+import random
+import time
+from itertools import islice
+
+import chess
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .clocks import start_clocks
+from .db_executor import LANE_GAMES, run_db_task
+from .lobby import invalidate_lobby
+from .models import ChessGame, Game, PlayerRating
+
+logger = logging.getLogger(__name__)
+
+
+class Seeker:
+    """A player waiting for a game with the given time control."""
+
+    __slots__ = ('user_id', 'username', 'channel_name', 'rating', 'time_control', 'joined_at')
+
+    def __init__(self, user_id, username, channel_name, rating, time_control, joined_at=None):
+        self.user_id = user_id
+        self.username = username
+        self.channel_name = channel_name
+        self.rating = rating
+        self.time_control = time_control
+        self.joined_at = time.monotonic() if joined_at is None else joined_at
+
+
+class MatchmakingQueue:
+    """
+    Waiting players, pooled by time control and bucketed by rating.
+
+    A player is acceptable to another when their ratings differ by no more
+    than both players' windows; a window starts at `initial_window` and grows
+    by `window_growth` points per second of waiting, up to `max_window`.
+    Finding an opponent looks at the buckets within the window, nearest
+    first, and only at the longest-waiting few players of each, so its cost
+    depends on the window and not on how many players are waiting.
+    """
+
+    # Longest-waiting players considered per bucket
+    BUCKET_SCAN = 8
+
+    def __init__(self, bucket_width=50, initial_window=100, window_growth=10, max_window=400):
+        self.bucket_width = bucket_width
+        self.initial_window = initial_window
+        self.window_growth = window_growth
+        self.max_window = max_window
+        self._pools = {}    # time_control -> {bucket: {user_id: seeker}}, each bucket in waiting order
+        self._seekers = {}  # user_id -> seeker, in waiting order
+
+    def __len__(self):
+        return len(self._seekers)
+
+    def __contains__(self, user_id):
+        return user_id in self._seekers
+
+    def window(self, seeker, now):
+        return min(self.initial_window + self.window_growth * (now - seeker.joined_at), self.max_window)
+
+    def add(self, seeker, now=None):
+        """
+        Queues the seeker, replacing an earlier seek by the same player, unless
+        an acceptable opponent is already waiting. Returns the opponent (both
+        then leave the queue) or None.
+        """
+        now = time.monotonic() if now is None else now
+        self.remove(seeker.user_id)
+        opponent = self._find_opponent(seeker, now)
+        if opponent is not None:
+            self._discard(opponent)
+            return opponent
+        self._seekers[seeker.user_id] = seeker
+        pool = self._pools.setdefault(seeker.time_control, {})
+        pool.setdefault(self._bucket(seeker.rating), {})[seeker.user_id] = seeker
+        return None
+
+    def remove(self, user_id, channel_name=None):
+        """Drops the player's seek, if it came from `channel_name` when given. Returns the seeker or None."""
+        seeker = self._seekers.get(user_id)
+        if seeker is None or (channel_name is not None and seeker.channel_name != channel_name):
+            return None
+        self._discard(seeker)
+        return seeker
+
+    def match(self, now=None):
+        """
+        Pairs the waiting players whose windows have grown to accept each
+        other, longest-waiting first. Returns a list of (seeker, seeker).
+        """
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for seeker in list(self._seekers.values()):
+            if seeker.user_id not in self._seekers:
+                continue  # Already paired in this pass
+            opponent = self._find_opponent(seeker, now)
+            if opponent is not None:
+                self._discard(seeker)
+                self._discard(opponent)
+                pairs.append((seeker, opponent))
+        return pairs
+
+    def _bucket(self, rating):
+        return int(rating // self.bucket_width)
+
+    def _find_opponent(self, seeker, now):
+        pool = self._pools.get(seeker.time_control)
+        if not pool:
+            return None
+        window = self.window(seeker, now)
+        home = self._bucket(seeker.rating)
+        best, best_diff = None, None
+        for offset in range(int(window // self.bucket_width) + 2):
+            for bucket in {home - offset, home + offset}:
+                for candidate in islice(pool.get(bucket, {}).values(), self.BUCKET_SCAN):
+                    diff = abs(candidate.rating - seeker.rating)
+                    if candidate is seeker or diff > window or diff > self.window(candidate, now):
+                        continue
+                    if best is None or diff < best_diff:
+                        best, best_diff = candidate, diff
+            # Every bucket further out is at least this far away
+            if best is not None and best_diff <= offset * self.bucket_width:
+                break
+        return best
+
+    def _discard(self, seeker):
+        self._seekers.pop(seeker.user_id, None)
+        pool = self._pools.get(seeker.time_control, {})
+        bucket = self._bucket(seeker.rating)
+        players = pool.get(bucket)
+        if players is not None:
+            players.pop(seeker.user_id, None)
+            if not players:
+                del pool[bucket]
+
+
+def seek_rating(user_id):
+    """The player's rating, or None if they already have a game in progress."""
+    if Game.objects.filter(Q(player1_id=user_id) | Q(player2_id=user_id), status='ongoing').exists():
+        return None
+    rating = PlayerRating.objects.filter(user_id=user_id).values_list('rating', flat=True).first()
+    return PlayerRating.DEFAULT_RATING if rating is None else rating
+
+
+def create_matched_games(pairs):
+    """
+    Creates a game for every (seeker, seeker) pair with two bulk inserts and
+    returns [(game_id, white, black)]. Colours are drawn at random.
+    """
+    pairs = [pair if random.random() < 0.5 else pair[::-1] for pair in pairs]
+    with transaction.atomic():
+        boards = ChessGame.objects.bulk_create([
+            ChessGame(user_id=black.user_id, fen=chess.STARTING_FEN) for white, black in pairs
+        ])
+        games = Game.objects.bulk_create([
+            Game(
+                player1_id=white.user_id,
+                player2_id=black.user_id,
+                current_turn_id=white.user_id,
+                board=board,
+                **start_clocks(*white.time_control),
+            )
+            for (white, black), board in zip(pairs, boards)
+        ])
+    invalidate_lobby(*(seeker.user_id for pair in pairs for seeker in pair))
+    return [(game.id, white, black) for game, (white, black) in zip(games, pairs)]
+
+
+class Matchmaker:
+    """
+    Runs the matchmaking queue of this process: pairs a seeker at once when
+    an opponent is waiting, and re-checks the others every `interval`
+    seconds as their windows widen. Games for all the pairs found in one
+    pass are created together, and both players are sent to the game through
+    their user_<id> groups.
+    """
+
+    def __init__(self, queue, interval=1.0):
+        self.queue = queue
+        self.interval = interval
+        self._task = None
+
+    async def seek(self, seeker):
+        opponent = self.queue.add(seeker)
+        if opponent is not None:
+            await self.start_games([(opponent, seeker)])
+        else:
+            self._ensure_running()
+
+    def cancel(self, user_id, channel_name=None):
+        return self.queue.remove(user_id, channel_name) is not None
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while len(self.queue):
+            await asyncio.sleep(self.interval)
+            pairs = self.queue.match()
+            if pairs:
+                await self.start_games(pairs)
+
+    async def start_games(self, pairs):
+        try:
+            games = await run_db_task(LANE_GAMES, create_matched_games, pairs)
+        except Exception as e:
+            logger.error(f"Error creating {len(pairs)} matched games: {e}")
+            return
+        channel_layer = get_channel_layer()
+        for game_id, white, black in games:
+            logger.info(f"Matched {white.username} ({white.rating:.0f}) with {black.username} ({black.rating:.0f}) in game {game_id}")
+            for seeker in (white, black):
+                await channel_layer.group_send(
+                    f"user_{seeker.user_id}",
+                    {
+                        "type": "send_challenge_notification",
+                        "data": {
+                            "redirect": True,
+                            "game_id": game_id,
+                        },
+                    }
+                )
+
+
+_config = getattr(settings, 'MATCHMAKING', {})
+
+matchmaker = Matchmaker(
+    MatchmakingQueue(
+        bucket_width=_config.get('BUCKET_WIDTH', 50),
+        initial_window=_config.get('INITIAL_WINDOW', 100),
+        window_growth=_config.get('WINDOW_GROWTH', 10),
+        max_window=_config.get('MAX_WINDOW', 400),
+    ),
+    interval=_config.get('INTERVAL', 1.0),
+)
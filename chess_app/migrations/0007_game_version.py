@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0006_onlineuser_connection_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0007_game_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PositionSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ply", models.PositiveIntegerField()),
+                ("fen", models.CharField(max_length=100)),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="snapshots",
+                        to="chess_app.game",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("game", "ply")},
+            },
+        ),
+        migrations.CreateModel(
+            name="Move",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ply", models.PositiveIntegerField()),
+                ("move", models.PositiveSmallIntegerField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="moves",
+                        to="chess_app.game",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("game", "ply")},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0008_move_log"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="termination",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("checkmate", "Checkmate"),
+                    ("resign", "Resignation"),
+                    ("stalemate", "Stalemate"),
+                    ("insufficient_material", "Insufficient material"),
+                    ("fifty_moves", "Fifty-move rule"),
+                    ("threefold_repetition", "Threefold repetition"),
+                ],
+                default="",
+                max_length=32,
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.16 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0009_game_termination"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="challenge",
+            name="base_time",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="challenge",
+            name="increment",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="base_time",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="black_time_ms",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="increment",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="turn_started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="white_time_ms",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="game",
+            name="termination",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("checkmate", "Checkmate"),
+                    ("resign", "Resignation"),
+                    ("stalemate", "Stalemate"),
+                    ("insufficient_material", "Insufficient material"),
+                    ("fifty_moves", "Fifty-move rule"),
+                    ("threefold_repetition", "Threefold repetition"),
+                    ("timeout", "Time forfeit"),
+                ],
+                default="",
+                max_length=32,
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0011_player_rating"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="rated",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="playerrating",
+            name="games",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="playerrating",
+            name="rd",
+            field=models.FloatField(default=350.0),
+        ),
+        migrations.AddField(
+            model_name="playerrating",
+            name="volatility",
+            field=models.FloatField(default=0.06),
+        ),
+    ]
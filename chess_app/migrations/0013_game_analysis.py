@@ -0,0 +1,63 @@
+# Generated by Django 4.2.16 on 2026-10-17 20:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0012_glicko2_ratings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GameAnalysis",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("evaluations", models.BinaryField(default=b"")),
+                ("annotations", models.TextField(blank=True, default="")),
+                ("white_accuracy", models.FloatField(blank=True, null=True)),
+                ("black_accuracy", models.FloatField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "game",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="analysis",
+                        to="chess_app.game",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "created_at"],
+                        name="chess_app_g_status_fed585_idx",
+                    )
+                ],
+            },
+        ),
+    ]
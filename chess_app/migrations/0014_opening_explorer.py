@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-17 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0013_game_analysis"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="in_explorer",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name="OpeningStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("position_key", models.BigIntegerField()),
+                ("move", models.PositiveSmallIntegerField()),
+                ("white_wins", models.PositiveIntegerField(default=0)),
+                ("draws", models.PositiveIntegerField(default=0)),
+                ("black_wins", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("position_key", "move")},
+            },
+        ),
+    ]
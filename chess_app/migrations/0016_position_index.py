@@ -0,0 +1,66 @@
+# Generated by Django 4.2.16 on 2026-10-17 20:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0015_pgn_import"),
+    ]
+
+    operations = [
+        # Existing games still need indexing (manage.py build_position_index); new ones are indexed as they are played
+        migrations.AddField(
+            model_name="game",
+            name="positions_indexed",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="game",
+            name="positions_indexed",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.CreateModel(
+            name="PositionIndex",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("position_key", models.BigIntegerField()),
+                ("material", models.BigIntegerField()),
+                ("ply", models.PositiveIntegerField()),
+                (
+                    "game",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="positions",
+                        to="chess_app.game",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["position_key", "game", "ply"],
+                        name="chess_app_p_positio_9886d9_idx",
+                    ),
+                    models.Index(
+                        fields=["material", "game", "ply"],
+                        name="chess_app_p_materia_5de324_idx",
+                    ),
+                    models.Index(
+                        fields=["game", "ply"], name="chess_app_p_game_id_84a143_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
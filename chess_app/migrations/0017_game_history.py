@@ -0,0 +1,64 @@
+# Generated by Django 4.2.16 on 2026-10-17 20:52
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def hide_deleted_games(apps, schema_editor):
+    Game = apps.get_model('chess_app', 'Game')
+    DeletedGame = apps.get_model('chess_app', 'DeletedGame')
+    for side in ('player1', 'player2'):
+        deleted = DeletedGame.objects.filter(game=OuterRef('pk'), user=OuterRef(side))
+        Game.objects.filter(Exists(deleted)).update(**{f'hidden_by_{side}': True})
+
+
+def restore_deleted_games(apps, schema_editor):
+    Game = apps.get_model('chess_app', 'Game')
+    DeletedGame = apps.get_model('chess_app', 'DeletedGame')
+    for side in ('player1', 'player2'):
+        DeletedGame.objects.bulk_create(
+            [
+                DeletedGame(game_id=game_id, user_id=user_id)
+                for game_id, user_id in Game.objects.filter(**{f'hidden_by_{side}': True}).values_list('id', f'{side}_id')
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0016_position_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="hidden_by_player1",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="hidden_by_player2",
+            field=models.BooleanField(default=False),
+        ),
+        # DeletedGame rows become the per-side flags on Game
+        migrations.RunPython(hide_deleted_games, restore_deleted_games),
+        migrations.DeleteModel(
+            name="DeletedGame",
+        ),
+        migrations.AddIndex(
+            model_name="game",
+            index=models.Index(
+                fields=["player1", "status", "hidden_by_player1", "updated_at", "id"],
+                name="chess_app_g_player1_bd9377_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="game",
+            index=models.Index(
+                fields=["player2", "status", "hidden_by_player2", "updated_at", "id"],
+                name="chess_app_g_player2_e1009e_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.16 on 2026-10-17 21:08
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def drop_duplicate_positions(apps, schema_editor):
+    """
+    Games indexed both live and by a replay of a partial move log have some
+    plies twice, some of them wrong: their rows are dropped, for
+    build_position_index to index them again.
+    """
+    Game = apps.get_model('chess_app', 'Game')
+    PositionIndex = apps.get_model('chess_app', 'PositionIndex')
+    games = list(
+        PositionIndex.objects.values('game_id', 'ply').annotate(rows=Count('id')).filter(rows__gt=1)
+        .values_list('game_id', flat=True).distinct()
+    )
+    for start in range(0, len(games), 500):
+        chunk = games[start:start + 500]
+        PositionIndex.objects.filter(game_id__in=chunk).delete()
+        Game.objects.filter(id__in=chunk).update(positions_indexed=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chess_app", "0017_game_history"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_positions, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="positionindex",
+            name="chess_app_p_game_id_84a143_idx",
+        ),
+        migrations.AlterUniqueTogether(
+            name="positionindex",
+            unique_together={("game", "ply")},
+        ),
+    ]
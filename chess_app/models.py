@@ -1,9 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 import chess
+from chess.polyglot import zobrist_hash
+from .utils import decode_move, encode_move, material_signature, signed_key
 # from .models import Game  # Assuming Game is in the same models file
 
+# A PositionSnapshot is stored every SNAPSHOT_INTERVAL plies, so rebuilding any
+# position replays at most SNAPSHOT_INTERVAL - 1 moves.
+SNAPSHOT_INTERVAL = 20
+
 class OnlineUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='online_status')
     last_seen = models.DateTimeField(auto_now=True)
@@ -59,6 +67,8 @@ class Challenge(models.Model):
     challenged = models.ForeignKey(User, related_name='received_challenges', on_delete=models.CASCADE)
     status = models.CharField(max_length=10, choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined'), ('finished', 'Finished')], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    base_time = models.PositiveIntegerField(default=0)  # Seconds on each clock, 0 for a game without clocks
+    increment = models.PositiveIntegerField(default=0)  # Seconds added after each move
 
     # class Meta:
     #     unique_together = ('challenger', 'challenged', 'status')
@@ -92,10 +102,248 @@ class Game(models.Model):
     )
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='ongoing')  # Track game status
     move_count = models.PositiveIntegerField(default=0)
+    TERMINATION_CHOICES = (
+        ('checkmate', 'Checkmate'),
+        ('resign', 'Resignation'),
+        ('stalemate', 'Stalemate'),
+        ('insufficient_material', 'Insufficient material'),
+        ('fifty_moves', 'Fifty-move rule'),
+        ('threefold_repetition', 'Threefold repetition'),
+        ('timeout', 'Time forfeit'),
+    )
+    termination = models.CharField(max_length=32, choices=TERMINATION_CHOICES, blank=True, default='')  # Why a finished game ended
+    version = models.PositiveIntegerField(default=0)  # Bumped on every committed change, used for optimistic concurrency
+    rated = models.BooleanField(default=False)  # Set once the result has been applied to both players' ratings
+    in_explorer = models.BooleanField(default=False)  # Set once the opening moves have been counted in OpeningStat
+    # Whether the game is in PositionIndex: new games are indexed move by move, older and imported ones in bulk once finished
+    positions_indexed = models.BooleanField(default=True)
+    # Set when that player deletes the finished game from their history; the game stays for the opponent
+    hidden_by_player1 = models.BooleanField(default=False)
+    hidden_by_player2 = models.BooleanField(default=False)
+
+    # Time control; clocks hold the time left when turn_started_at was recorded, the side to move is charged from then
+    base_time = models.PositiveIntegerField(default=0)  # Seconds on each clock, 0 for a game without clocks
+    increment = models.PositiveIntegerField(default=0)  # Seconds added after each move
+    white_time_ms = models.PositiveIntegerField(default=0)
+    black_time_ms = models.PositiveIntegerField(default=0)
+    turn_started_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # One per side of the board, so a page of a player's history is a range scan of either (see lobby.completed_games_page)
+        indexes = [
+            models.Index(fields=['player1', 'status', 'hidden_by_player1', 'updated_at', 'id']),
+            models.Index(fields=['player2', 'status', 'hidden_by_player2', 'updated_at', 'id']),
+        ]
 
     def __str__(self):
         return f"Game between {self.player1.username} and {self.player2.username}"
 
+    def commit(self, fen=None, move=None, **changes):
+        """
+        Writes `changes` (and the new board FEN, if given) only if nobody else has
+        committed since this instance was read, i.e. the stored version still
+        equals self.version. Returns False for a stale instance, leaving the
+        database untouched; on success the instance is updated in place.
+        A chess.Move passed as `move` is appended to the move log as the ply
+        given by the new move_count.
+        """
+        changes['updated_at'] = timezone.now()
+        with transaction.atomic():
+            updated = Game.objects.filter(pk=self.pk, version=self.version).update(
+                version=F('version') + 1, **changes
+            )
+            if not updated:
+                return False
+            if fen is not None:
+                ChessGame.objects.filter(pk=self.board_id).update(fen=fen, updated_at=changes['updated_at'])
+            if move is not None:
+                ply = changes.get('move_count', self.move_count)
+                Move.objects.create(game_id=self.pk, ply=ply, move=encode_move(move), created_at=changes['updated_at'])
+                # Games not indexed yet are left whole to positions.index_games once they are over
+                if fen is not None and self.positions_indexed:
+                    PositionIndex.objects.create(game_id=self.pk, ply=ply, **PositionIndex.fields_for(chess.Board(fen)))
+                    if ply % SNAPSHOT_INTERVAL == 0:
+                        PositionSnapshot.objects.create(game_id=self.pk, ply=ply, fen=fen)
+
+        self.version += 1
+        for field, value in changes.items():
+            setattr(self, field, value)
+        if fen is not None and Game.board.is_cached(self):
+            self.board.fen = fen
+        return True
+
+    def position_at(self, ply=None):
+        """
+        Rebuilds the board after `ply` half-moves (the current position by
+        default) from the nearest snapshot plus the logged moves after it.
+        """
+        if ply is None:
+            ply = self.move_count
+        if ply == self.move_count:
+            return chess.Board(self.board.fen)
+
+        snapshot = self.snapshots.filter(ply__lte=ply).order_by('-ply').first()
+        if snapshot:
+            board, base_ply = chess.Board(snapshot.fen), snapshot.ply
+        else:
+            board, base_ply = chess.Board(), 0
+        for encoded in self.moves.filter(ply__gt=base_ply, ply__lte=ply).order_by('ply').values_list('move', flat=True):
+            board.push(decode_move(encoded))
+        return board
+
+
+class MoveManager(models.Manager):
+    def bulk_append(self, game, moves, start_ply=0, start_fen=chess.STARTING_FEN, batch_size=1000):
+        """
+        Appends a sequence of chess.Move objects to the game's move log,
+        starting after `start_ply` from the position `start_fen`, together
+        with the periodic snapshots and the position index. Returns the
+        final board.
+        """
+        board = chess.Board(start_fen)
+        now = timezone.now()
+        move_rows, snapshot_rows, index_rows = [], [], []
+        for ply, move in enumerate(moves, start=start_ply + 1):
+            board.push(move)
+            move_rows.append(Move(game=game, ply=ply, move=encode_move(move), created_at=now))
+            index_rows.append(PositionIndex(game=game, ply=ply, **PositionIndex.fields_for(board)))
+            if ply % SNAPSHOT_INTERVAL == 0:
+                snapshot_rows.append(PositionSnapshot(game=game, ply=ply, fen=board.fen()))
+        with transaction.atomic():
+            self.bulk_create(move_rows, batch_size=batch_size)
+            PositionSnapshot.objects.bulk_create(snapshot_rows, batch_size=batch_size)
+            PositionIndex.objects.bulk_create(index_rows, batch_size=batch_size)
+        return board
+
+
+class Move(models.Model):
+    """One half-move of a game, appended as it is played."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='moves')
+    ply = models.PositiveIntegerField()  # 1 for white's first move
+    move = models.PositiveSmallIntegerField()  # from | to << 6 | promotion << 12, see utils.encode_move
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = MoveManager()
+
+    class Meta:
+        unique_together = ('game', 'ply')
+
+    def __str__(self):
+        return f"Game {self.game_id} ply {self.ply}: {decode_move(self.move).uci()}"
+
+
+class PositionSnapshot(models.Model):
+    """Full position every SNAPSHOT_INTERVAL plies, the starting point for replaying the move log."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='snapshots')
+    ply = models.PositiveIntegerField()
+    fen = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = ('game', 'ply')
+
+    def __str__(self):
+        return f"Game {self.game_id} after ply {self.ply}"
+
+
+class GameAnalysis(models.Model):
+    """Engine evaluation of every position of a finished game, filled in by chess_app.analysis."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='analysis')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    evaluations = models.BinaryField(default=b'')  # Centipawns for white after each ply from 0, as int16, see analysis.pack_evaluations
+    annotations = models.TextField(blank=True, default='')  # One character per move: '.', 'i'naccuracy, 'm'istake or 'b'lunder
+    white_accuracy = models.FloatField(null=True, blank=True)
+    black_accuracy = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Analysis of game {self.game_id} ({self.status})"
+
+
+class PositionIndex(models.Model):
+    """
+    One row per ply of every game, for finding the games that reached a
+    position or a material balance. The starting position is not indexed.
+    """
+    position_key = models.BigIntegerField()  # Polyglot Zobrist hash, signed, see utils.signed_key
+    material = models.BigIntegerField()  # See utils.material_signature
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='positions', db_index=False)
+    ply = models.PositiveIntegerField()
+
+    class Meta:
+        # Both indexes cover the searches, which page through game ids
+        indexes = [
+            models.Index(fields=['position_key', 'game', 'ply']),
+            models.Index(fields=['material', 'game', 'ply']),
+        ]
+        unique_together = ('game', 'ply')
+
+    def __str__(self):
+        return f"Game {self.game_id} ply {self.ply}"
+
+    @staticmethod
+    def fields_for(board):
+        return {'position_key': signed_key(zobrist_hash(board)), 'material': material_signature(board)}
+
+
+class OpeningStat(models.Model):
+    """
+    How often a move was played from a position in our finished games, and
+    how those games ended. Filled in by chess_app.explorer.
+    """
+    position_key = models.BigIntegerField()  # Polyglot Zobrist hash of the position, as a signed 64-bit integer
+    move = models.PositiveSmallIntegerField()  # See utils.encode_move
+    white_wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    black_wins = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Also the index that answers a position's lookup
+        unique_together = ('position_key', 'move')
+
+    def __str__(self):
+        return f"{decode_move(self.move).uci()} from {self.position_key & (2 ** 64 - 1):016x}"
+
+
+class PgnImport(models.Model):
+    """Progress of `manage.py import_pgn` through a file, saved with each batch so an import can resume."""
+    path = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField()  # File size when the import started, to notice a different file
+    offset = models.BigIntegerField(default=0)  # Bytes imported; always the start of a game
+    games = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)  # Unfinished, non-standard or unreadable games
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path}: {self.offset}/{self.size} bytes, {self.games} games"
+
+
+class PlayerRating(models.Model):
+    """A player's Glicko-2 rating; players without a row have the defaults."""
+    DEFAULT_RATING = 1500.0
+    DEFAULT_RD = 350.0
+    DEFAULT_VOLATILITY = 0.06
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='rating')
+    rating = models.FloatField(default=DEFAULT_RATING)
+    rd = models.FloatField(default=DEFAULT_RD)  # Rating deviation
+    volatility = models.FloatField(default=DEFAULT_VOLATILITY)
+    games = models.PositiveIntegerField(default=0)  # Rated games played
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.rating:.0f}"
+
 
 class JournalEntry(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chess_journal_entries')
@@ -109,16 +357,3 @@ class JournalEntry(models.Model):
 
     def __str__(self):
         return f"Journal entry for {self.game} by {self.user.username}"
-    
-class DeletedGame(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    game = models.ForeignKey(Game, on_delete=models.CASCADE)
-    deleted_at = models.DateTimeField(auto_now_add=True)
-
-    class Meta:
-        unique_together = ('user', 'game')
-
-    def __str__(self):
-        return f"Deleted game for {self.user.username} - Game ID {self.game.id}"
-
-
@@ -0,0 +1,166 @@
+# pgn.py
+# Kept free of Django imports: the parsing functions run in worker processes.
+import io
+import re
+
+import chess
+import chess.pgn
+
+from .utils import decode_move, encode_move
+
+RESULTS = ('1-0', '0-1', '1/2-1/2')
+LINE_LENGTH = 79
+
+
+def read_chunks(handle, games_per_chunk, offset=0):
+    """
+    Splits a PGN file opened in binary mode into chunks of whole games,
+    reading one line at a time from byte `offset` (which must be the start
+    of a game). Yields (text, end offset) pairs, where the end offset is
+    where the next chunk starts, so it can be saved to resume from.
+    """
+    handle.seek(offset)
+    lines, games, in_movetext = [], 0, False
+    for line in handle:
+        if line.startswith(b'['):
+            if in_movetext:
+                # The first tag of the next game
+                games += 1
+                in_movetext = False
+                if games == games_per_chunk:
+                    yield b''.join(lines).decode('utf-8', 'replace'), offset
+                    lines, games = [], 0
+        elif line.strip():
+            in_movetext = True
+        lines.append(line)
+        offset += len(line)
+    if lines:
+        yield b''.join(lines).decode('utf-8', 'replace'), offset
+
+
+class MainlineVisitor(chess.pgn.BaseVisitor):
+    """
+    Collects what the game tables need from one game: players, result, the
+    encoded mainline moves and a FEN every `snapshot_interval` plies.
+    Variations are skipped, and games that do not start from the standard
+    position are not parsed at all.
+    """
+
+    def __init__(self, snapshot_interval):
+        self.snapshot_interval = snapshot_interval
+        self.headers = {}
+        self.moves = []
+        self.snapshots = []
+        self.board = None
+        self.error = None
+
+    def visit_header(self, tagname, tagvalue):
+        # python-chess hands tag values over still escaped
+        self.headers[tagname] = unescape_tag(tagvalue)
+
+    def end_headers(self):
+        if 'FEN' in self.headers or self.headers.get('Variant', 'Standard').lower() not in ('standard', 'chess'):
+            self.error = "Not a standard game"
+            return chess.pgn.SKIP
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        self.moves.append(encode_move(move))
+
+    def visit_board(self, board):
+        self.board = board
+        ply = len(self.moves)
+        if ply and ply % self.snapshot_interval == 0 and (not self.snapshots or self.snapshots[-1][0] != ply):
+            self.snapshots.append((ply, board.fen()))
+
+    def handle_error(self, error):
+        self.error = self.error or str(error)
+
+    def result(self):
+        return self
+
+
+def termination(board, result, headers):
+    """How the game ended, as a Game.TERMINATION_CHOICES key ('' for a draw by agreement)."""
+    if board.is_checkmate():
+        return 'checkmate'
+    if board.is_stalemate():
+        return 'stalemate'
+    if board.is_insufficient_material():
+        return 'insufficient_material'
+    if 'time' in headers.get('Termination', '').lower():
+        return 'timeout'
+    if result != '1/2-1/2':
+        return 'resign'
+    if board.is_fifty_moves():
+        return 'fifty_moves'
+    if board.is_repetition():
+        return 'threefold_repetition'
+    return ''
+
+
+def parse_games(text, snapshot_interval):
+    """
+    Worker entry point: parses every game of a chunk. Returns (games,
+    skipped), each game a dict with the players' names, the result, the
+    termination, the final FEN, the encoded moves and the snapshots.
+    Unfinished, non-standard and unreadable games are skipped.
+    """
+    handle = io.StringIO(text)
+    games, skipped = [], 0
+    while True:
+        visitor = chess.pgn.read_game(handle, Visitor=lambda: MainlineVisitor(snapshot_interval))
+        if visitor is None:
+            break
+        result = visitor.headers.get('Result')
+        white, black = visitor.headers.get('White', '?'), visitor.headers.get('Black', '?')
+        if visitor.error or visitor.board is None or result not in RESULTS or white == black:
+            skipped += 1
+            continue
+        games.append({
+            'white': white,
+            'black': black,
+            'result': result,
+            'termination': termination(visitor.board, result, visitor.headers),
+            'fen': visitor.board.fen(),
+            'moves': visitor.moves,
+            'snapshots': visitor.snapshots,
+        })
+    return games, skipped
+
+
+def escape_tag(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def unescape_tag(value):
+    return re.sub(r'\\([\\"])', r'\1', value)
+
+
+def format_game(headers, moves, result):
+    """
+    Writes one game as PGN text: `headers` is a list of (tag, value) pairs,
+    `moves` the encoded mainline from the starting position.
+    """
+    lines = [f'[{tag} "{escape_tag(value)}"]' for tag, value in headers]
+    lines.append('')
+    board = chess.Board()
+    tokens = []
+    for encoded in moves:
+        move = decode_move(encoded)
+        if board.turn == chess.WHITE:
+            tokens.append(f"{board.fullmove_number}.")
+        tokens.append(board.san_and_push(move))
+    tokens.append(result)
+
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
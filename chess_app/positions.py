@@ -0,0 +1,79 @@
+# positions.py
+import chess
+from chess.polyglot import zobrist_hash
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import Game, Move, PositionIndex
+from .utils import decode_move, material_signature, signed_key
+from .zobrist import push as zobrist_push
+
+PAGE_SIZE = 50
+
+
+def index_games(game_ids, batch_size=2000):
+    """
+    Adds every ply of the given finished games to PositionIndex by replaying
+    their move logs, with one query for the moves of all of them. Games
+    already indexed are skipped, and so are games still being played, which
+    are indexed once they are over. A game whose log doesn't hold every ply
+    from the first (one started before the log existed) can't be replayed:
+    it is marked indexed with only the positions written as it was played.
+    Returns the number of positions added.
+    """
+    with transaction.atomic():
+        games = dict(
+            Game.objects.select_for_update()
+            .filter(id__in=game_ids, status='finished', positions_indexed=False).values_list('id', 'move_count')
+        )
+        if not games:
+            return 0
+        Game.objects.filter(id__in=games).update(positions_indexed=True)
+
+        complete = [
+            game_id
+            for game_id, first, count in Move.objects.filter(game_id__in=games)
+            .values('game_id').annotate(first=Min('ply'), count=Count('id')).values_list('game_id', 'first', 'count')
+            if first == 1 and count == games[game_id]
+        ]
+        # Rows written live before a rebuild are written again below
+        PositionIndex.objects.filter(game_id__in=complete).delete()
+
+        rows = []
+        boards = {}
+        moves = Move.objects.filter(game_id__in=complete).order_by('game_id', 'ply').values_list('game_id', 'ply', 'move')
+        for game_id, ply, encoded in moves.iterator(chunk_size=batch_size):
+            if game_id not in boards:
+                board = chess.Board()
+                boards[game_id] = (board, zobrist_hash(board), material_signature(board))
+            board, key, material = boards[game_id]
+            move = decode_move(encoded)
+            changes_material = move.promotion or board.is_capture(move)
+            key = zobrist_push(board, move, key)
+            if changes_material:
+                material = material_signature(board)
+            boards[game_id] = (board, key, material)
+            rows.append(PositionIndex(game_id=game_id, ply=ply, position_key=signed_key(key), material=material))
+            if len(rows) >= batch_size:
+                PositionIndex.objects.bulk_create(rows)
+                rows = []
+        PositionIndex.objects.bulk_create(rows)
+    return sum(len(board.move_stack) for board, _, _ in boards.values())
+
+
+def find_games(board=None, material=None, after=None, limit=PAGE_SIZE):
+    """
+    Games that reached the position on `board`, or the material signature
+    `material` (see utils.parse_material), in id order: up to `limit`
+    (game id, first ply reached) pairs after game id `after`. Each page is
+    one range scan of a covering index, however many positions are indexed.
+    """
+    if board is not None:
+        rows = PositionIndex.objects.filter(position_key=signed_key(zobrist_hash(board)))
+    else:
+        rows = PositionIndex.objects.filter(material=material)
+    if after is not None:
+        rows = rows.filter(game_id__gt=after)
+    return list(
+        rows.values('game_id').annotate(ply=Min('ply')).order_by('game_id').values_list('game_id', 'ply')[:limit]
+    )
@@ -0,0 +1,44 @@
+# post_game.py
+import logging
+
+from .analysis import queue_analysis
+from .db_executor import LANE_POST_GAME, get_db_executor
+from .explorer import count_games
+from .lobby import invalidate_lobby
+from .ratings import rate_game
+
+logger = logging.getLogger(__name__)
+
+
+def process_finished_game(game_id):
+    """
+    Bookkeeping once a game is over: the players' ratings, the opening
+    explorer, then the engine analysis. The steps don't depend on each
+    other, so one that fails is logged and the others still run.
+    """
+    steps = (('rating', rate_game, game_id), ('opening explorer', count_games, [game_id]), ('analysis', queue_analysis, game_id))
+    for name, step, argument in steps:
+        try:
+            step(argument)
+        except Exception:
+            logger.exception(f"Error updating the {name} for finished game {game_id}")
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("Error processing a finished game", exc_info=future.exception())
+
+
+def game_finished(game):
+    """
+    Queues process_finished_game on the executor's lowest-priority lane, so a
+    finished game's last update is sent without waiting for it. Runs it right
+    away when the executor is disabled. The players' lobbies are refreshed
+    at once, since they are sent back there next.
+    """
+    invalidate_lobby(game.player1_id, game.player2_id)
+    executor = get_db_executor()
+    if executor is None:
+        process_finished_game(game.id)
+    else:
+        executor.submit(LANE_POST_GAME, process_finished_game, game.id).add_done_callback(_log_failure)
@@ -0,0 +1,300 @@
+# presence.py
+import asyncio
+import heapq
+import logging
+import time
+from datetime import timedelta
+
+import redis
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .db_executor import LANE_PRESENCE, run_db_task
+from .models import OnlineUser
+
+logger = logging.getLogger(__name__)
+
+
+class RedisPresence:
+    """
+    Online users kept in Redis, so heartbeats never touch the database.
+
+    presence:online           sorted set of user ids scored by last-seen time
+    presence:names            hash of user id -> username
+    presence:channels:<id>    set of the user's open channel names, expiring
+                              after TTL seconds without a heartbeat
+    """
+
+    # Removing the last channel and dropping the user from the online set must be atomic,
+    # otherwise a tab opening at the same moment could be marked offline.
+    DISCONNECT_SCRIPT = """
+        redis.call('SREM', KEYS[1], ARGV[1])
+        local remaining = redis.call('SCARD', KEYS[1])
+        if remaining == 0 then
+            redis.call('ZREM', KEYS[2], ARGV[2])
+        end
+        return remaining
+    """
+
+    def __init__(self, url, ttl, prefix='presence'):
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.online_key = f"{prefix}:online"
+        self.names_key = f"{prefix}:names"
+        self.channels_prefix = f"{prefix}:channels"
+        self._disconnect = self.redis.register_script(self.DISCONNECT_SCRIPT)
+
+    def _channels_key(self, user_id):
+        return f"{self.channels_prefix}:{user_id}"
+
+    def connect(self, user, channel_name):
+        """Registers an open connection and returns the user's connection count."""
+        key = self._channels_key(user.id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.sadd(key, channel_name)
+        pipe.expire(key, self.ttl)
+        pipe.zadd(self.online_key, {user.id: time.time()})
+        pipe.hset(self.names_key, user.id, user.username)
+        pipe.scard(key)
+        return pipe.execute()[-1]
+
+    def disconnect(self, user, channel_name):
+        """Removes a closed connection and returns how many the user still has open."""
+        return self._disconnect(keys=[self._channels_key(user.id), self.online_key], args=[channel_name, user.id])
+
+    def heartbeat(self, user, channel_name):
+        key = self._channels_key(user.id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zadd(self.online_key, {user.id: time.time()})
+        pipe.sadd(key, channel_name)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def connection_count(self, user_id):
+        return self.redis.scard(self._channels_key(user_id))
+
+    def connection_counts(self, user_ids):
+        """Returns {user_id: open connections} in one round trip."""
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.scard(self._channels_key(user_id))
+        return dict(zip(user_ids, pipe.execute()))
+
+    def online_user_ids(self):
+        cutoff = time.time() - self.ttl
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zremrangebyscore(self.online_key, '-inf', f"({cutoff}")
+        pipe.zrange(self.online_key, 0, -1)
+        return [int(user_id) for user_id in pipe.execute()[-1]]
+
+    def online_users(self):
+        """Returns [{'id': ..., 'username': ...}] for every online user."""
+        user_ids = self.online_user_ids()
+        if not user_ids:
+            return []
+        usernames = self.redis.hmget(self.names_key, user_ids)
+        return [
+            {'id': user_id, 'username': username}
+            for user_id, username in zip(user_ids, usernames)
+            if username is not None
+        ]
+
+    def clear(self, user):
+        """Marks the user offline immediately, e.g. on logout."""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._channels_key(user.id))
+        pipe.zrem(self.online_key, user.id)
+        pipe.hdel(self.names_key, user.id)
+        pipe.execute()
+
+
+class DatabasePresence:
+    """Fallback that keeps presence in the OnlineUser table."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def connect(self, user, channel_name):
+        online_user, created = OnlineUser.objects.get_or_create(
+            user=user,
+            defaults={'connection_count': 1}
+        )
+        if not created:
+            OnlineUser.objects.filter(pk=online_user.pk).update(
+                connection_count=F('connection_count') + 1, last_seen=timezone.now()
+            )
+        return self.connection_count(user.id)
+
+    def disconnect(self, user, channel_name):
+        OnlineUser.objects.filter(user=user).update(connection_count=F('connection_count') - 1)
+        remaining = self.connection_count(user.id)
+        if remaining == 0:
+            OnlineUser.objects.filter(user=user, connection_count__lte=0).delete()
+        return remaining
+
+    def heartbeat(self, user, channel_name):
+        OnlineUser.objects.filter(user=user).update(last_seen=timezone.now())
+
+    def connection_count(self, user_id):
+        count = OnlineUser.objects.filter(user_id=user_id).values_list('connection_count', flat=True).first()
+        return max(count or 0, 0)
+
+    def connection_counts(self, user_ids):
+        counts = dict.fromkeys(user_ids, 0)
+        for user_id, count in OnlineUser.objects.filter(user_id__in=user_ids).values_list('user_id', 'connection_count'):
+            counts[user_id] = max(count, 0)
+        return counts
+
+    def _online(self):
+        timeout = timezone.now() - timedelta(seconds=self.ttl)
+        return OnlineUser.objects.filter(last_seen__gte=timeout)
+
+    def online_user_ids(self):
+        return list(self._online().values_list('user_id', flat=True))
+
+    def online_users(self):
+        return [
+            {'id': user_id, 'username': username}
+            for user_id, username in self._online().values_list('user_id', 'user__username')
+        ]
+
+    def clear(self, user):
+        OnlineUser.objects.filter(user=user).delete()
+
+
+class PresenceBroadcaster:
+    """
+    Merges the presence changes seen by this process over a short window and
+    publishes them to the all_users group as a single presence_diff event.
+    A user who goes offline and comes back (or the reverse) within the same
+    window is not announced at all.
+    """
+
+    def __init__(self, group_name='all_users', interval=0.5):
+        self.group_name = group_name
+        self.interval = interval
+        self._first = {}    # user_id -> first status seen in the current window
+        self._latest = {}   # user_id -> (username, latest status)
+        self._task = None
+
+    def mark(self, user_id, username, status):
+        """Records 'online' or 'offline' for the user; must be called from the event loop."""
+        self._first.setdefault(user_id, status)
+        self._latest[user_id] = (username, status)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        first, latest = self._first, self._latest
+        self._first, self._latest = {}, {}
+
+        online, offline = [], []
+        for user_id, (username, status) in latest.items():
+            if status != first[user_id]:
+                # Ended the window where it started, e.g. offline -> online -> offline
+                continue
+            if status == 'online':
+                online.append({'id': user_id, 'username': username})
+            else:
+                offline.append(user_id)
+
+        if online or offline:
+            await get_channel_layer().group_send(self.group_name, presence_diff_event(online, offline))
+
+
+def presence_diff_event(online=(), offline=()):
+    """Channel layer event understood by ChallengeConsumer.presence_diff."""
+    return {
+        "type": "presence_diff",
+        "online": list(online),
+        "offline": list(offline),
+    }
+
+
+class GraceScheduler:
+    """
+    Announces users as offline once they have had no open connection for
+    `grace` seconds, so a page reload does not flash them offline.
+
+    One task per process serves every pending timer from a heap; a user who
+    reconnects simply has their timer cancelled. Due users are checked
+    against the presence backend in a single batched call.
+    """
+
+    def __init__(self, grace=1.0):
+        self.grace = grace
+        self._heap = []      # (deadline, user_id), may hold cancelled entries
+        self._pending = {}   # user_id -> (deadline, username)
+        self._task = None
+
+    def schedule(self, user_id, username):
+        """Starts the grace timer for a user whose last connection just closed."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.grace
+        self._pending[user_id] = (deadline, username)
+        heapq.heappush(self._heap, (deadline, user_id))
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    def cancel(self, user_id):
+        # The heap entry is skipped when it comes due
+        self._pending.pop(user_id, None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._heap:
+            delay = self._heap[0][0] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            due = {}
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, user_id = heapq.heappop(self._heap)
+                pending = self._pending.get(user_id)
+                if pending is not None and pending[0] == deadline:
+                    due[user_id] = self._pending.pop(user_id)[1]
+            if not due:
+                continue
+
+            try:
+                counts = await run_db_task(LANE_PRESENCE, get_presence().connection_counts, list(due))
+            except Exception as e:
+                logger.error(f"Error checking connections for users {list(due)}: {e}")
+                continue
+            for user_id, username in due.items():
+                if counts.get(user_id, 0) == 0 and user_id not in self._pending:
+                    broadcaster.mark(user_id, username, 'offline')
+
+
+broadcaster = PresenceBroadcaster(
+    interval=getattr(settings, 'PRESENCE', {}).get('BROADCAST_INTERVAL', 0.5),
+)
+
+grace_timers = GraceScheduler(
+    grace=getattr(settings, 'PRESENCE', {}).get('DISCONNECT_GRACE', 1.0),
+)
+
+_presence = None
+
+
+def get_presence():
+    """Returns the presence backend selected by settings.PRESENCE."""
+    global _presence
+    if _presence is None:
+        config = getattr(settings, 'PRESENCE', {})
+        ttl = config.get('TTL', 180)
+        if config.get('BACKEND', 'redis') == 'redis':
+            _presence = RedisPresence(config.get('REDIS_URL', 'redis://localhost:6379/0'), ttl)
+        else:
+            _presence = DatabasePresence(ttl)
+        logger.info(f"Using {type(_presence).__name__} for user presence.")
+    return _presence
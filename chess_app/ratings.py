@@ -0,0 +1,150 @@
+# ratings.py
+import logging
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import Game, PlayerRating
+
+logger = logging.getLogger(__name__)
+
+# Glicko-2 system constant: how quickly volatility may change; smaller is more conservative
+TAU = getattr(settings, 'GLICKO2_TAU', 0.5)
+# Converts between the Glicko scale (1500 +- 350) and the internal Glicko-2 scale
+SCALE = 173.7178
+CONVERGENCE = 1e-6
+MAX_RD = PlayerRating.DEFAULT_RD
+
+
+def _new_volatility(sigma, phi, v, delta):
+    """Step 5 of Glickman's Glicko-2 paper: solves for the new volatility with the Illinois method."""
+    a = math.log(sigma * sigma)
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta * delta - phi * phi - v - ex) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / (TAU * TAU)
+
+    A = a
+    if delta * delta > phi * phi + v:
+        B = math.log(delta * delta - phi * phi - v)
+    else:
+        k = 1
+        while f(a - k * TAU) < 0:
+            k += 1
+        B = a - k * TAU
+    fA, fB = f(A), f(B)
+    while abs(B - A) > CONVERGENCE:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB <= 0:
+            A, fA = B, fB
+        else:
+            fA /= 2
+        B, fB = C, fC
+    return math.exp(A / 2)
+
+
+def glicko2(rating, rd, volatility, opponent_rating, opponent_rd, score):
+    """
+    A player's new (rating, rd, volatility) after one game scored 1, 0.5 or 0,
+    the game being its own rating period.
+    """
+    mu, phi = (rating - 1500) / SCALE, rd / SCALE
+    mu_j, phi_j = (opponent_rating - 1500) / SCALE, opponent_rd / SCALE
+    g = 1 / math.sqrt(1 + 3 * phi_j * phi_j / (math.pi * math.pi))
+    expected = 1 / (1 + math.exp(-g * (mu - mu_j)))
+    v = 1 / (g * g * expected * (1 - expected))
+    sigma = _new_volatility(volatility, phi, v, v * g * (score - expected))
+    phi_star = math.sqrt(phi * phi + sigma * sigma)
+    phi = 1 / math.sqrt(1 / (phi_star * phi_star) + 1 / v)
+    mu += phi * phi * g * (score - expected)
+    return 1500 + SCALE * mu, min(SCALE * phi, MAX_RD), sigma
+
+
+def rate_game(game_id):
+    """
+    Applies a finished game's result to both players' ratings. Each game is
+    rated once: the first caller claims it through Game.rated. Returns
+    whether this call rated it.
+    """
+    with transaction.atomic():
+        if not Game.objects.filter(id=game_id, status='finished', rated=False).update(rated=True):
+            return False
+        white_id, black_id, winner_id = Game.objects.values_list('player1_id', 'player2_id', 'winner_id').get(id=game_id)
+        existing = {
+            rating.user_id: rating
+            for rating in PlayerRating.objects.select_for_update().filter(user_id__in=[white_id, black_id])
+        }
+        white = existing.get(white_id) or PlayerRating(user_id=white_id)
+        black = existing.get(black_id) or PlayerRating(user_id=black_id)
+
+        score = 0.5 if winner_id is None else float(winner_id == white_id)
+        before = (white.rating, white.rd, black.rating, black.rd)
+        white.rating, white.rd, white.volatility = glicko2(white.rating, white.rd, white.volatility, before[2], before[3], score)
+        black.rating, black.rd, black.volatility = glicko2(black.rating, black.rd, black.volatility, before[0], before[1], 1 - score)
+        for rating in (white, black):
+            rating.games += 1
+            rating.save()
+    return True
+
+
+def _new_volatilities(sigma, phi, v, delta):
+    """_new_volatility for arrays of players, iterating until every one has converged."""
+    a = np.log(sigma * sigma)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta * delta - phi * phi - v - ex) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / (TAU * TAU)
+
+    A = a.copy()
+    large = delta * delta > phi * phi + v
+    B = np.where(large, np.log(np.where(large, delta * delta - phi * phi - v, 1.0)), a - TAU)
+    # Where the change is small, step down until f changes sign
+    pending = ~large & (f(B) < 0)
+    while pending.any():
+        B = np.where(pending, B - TAU, B)
+        pending &= f(B) < 0
+
+    fA, fB = f(A), f(B)
+    active = np.abs(B - A) > CONVERGENCE
+    while active.any():
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        swap = active & (fC * fB <= 0)
+        A, fA = np.where(swap, B, A), np.where(swap, fB, np.where(active, fA / 2, fA))
+        B, fB = np.where(active, C, B), np.where(active, fC, fB)
+        active &= np.abs(B - A) > CONVERGENCE
+    return np.exp(A / 2)
+
+
+def glicko2_period(rating, rd, volatility, white, black, score):
+    """
+    One Glicko-2 rating period for every player at once. `rating`, `rd` and
+    `volatility` are arrays indexed by player; `white`, `black` and `score`
+    describe the period's games (player indices and white's score).
+    Returns the new (rating, rd, volatility) arrays. Players without a game
+    in the period only see their deviation grow.
+    """
+    mu, phi = (rating - 1500) / SCALE, rd / SCALE
+    player = np.concatenate([white, black])
+    opponent = np.concatenate([black, white])
+    scores = np.concatenate([score, 1 - score])
+
+    g = 1 / np.sqrt(1 + 3 * phi[opponent] ** 2 / np.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu[player] - mu[opponent])))
+    size = len(rating)
+    information = np.bincount(player, weights=g * g * expected * (1 - expected), minlength=size)
+    improvement = np.bincount(player, weights=g * (scores - expected), minlength=size)
+
+    played = information > 0
+    v = 1 / information[played]
+    sigma = volatility.copy()
+    sigma[played] = _new_volatilities(volatility[played], phi[played], v, v * improvement[played])
+
+    phi_new = np.sqrt(phi * phi + sigma * sigma)
+    phi_new[played] = 1 / np.sqrt(1 / phi_new[played] ** 2 + 1 / v)
+    mu_new = mu.copy()
+    mu_new[played] += phi_new[played] ** 2 * improvement[played]
+    return 1500 + SCALE * mu_new, np.minimum(SCALE * phi_new, MAX_RD), sigma
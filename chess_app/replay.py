@@ -0,0 +1,58 @@
+# replay.py
+from collections import deque
+
+from django.conf import settings
+
+
+class GameUpdateBuffer:
+    """
+    Per-process ring buffers of the most recent game updates, keyed by game id.
+
+    Every game update carries the game's version as its sequence number. A
+    buffer exists only while this process has at least one consumer in the
+    game's group, because only then does it see every update; a reconnecting
+    client is replayed what it missed if the buffer covers the gap.
+    Only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._buffers = {}      # game_id -> deque of (seq, message)
+        self._subscribers = {}  # game_id -> consumers in this process
+
+    def subscribe(self, game_id):
+        self._subscribers[game_id] = self._subscribers.get(game_id, 0) + 1
+        self._buffers.setdefault(game_id, deque(maxlen=self.size))
+
+    def unsubscribe(self, game_id):
+        remaining = self._subscribers.get(game_id, 0) - 1
+        if remaining > 0:
+            self._subscribers[game_id] = remaining
+        else:
+            # Nobody here listens any more, so the buffer would silently fall behind
+            self._subscribers.pop(game_id, None)
+            self._buffers.pop(game_id, None)
+
+    def record(self, game_id, seq, message):
+        buffer = self._buffers.get(game_id)
+        # Each local consumer of the game sees the same update; keep it once
+        if buffer is not None and (not buffer or buffer[-1][0] < seq):
+            buffer.append((seq, message))
+
+    def latest(self, game_id):
+        """The newest update seen since subscribing, or None."""
+        buffer = self._buffers.get(game_id)
+        return buffer[-1][1] if buffer else None
+
+    def since(self, game_id, last_seq):
+        """
+        Returns the updates after `last_seq`, oldest first, or None when the
+        buffer cannot prove it holds all of them and a snapshot is needed.
+        """
+        buffer = self._buffers.get(game_id)
+        if not buffer or buffer[0][0] > last_seq + 1:
+            return None
+        return [message for seq, message in buffer if seq > last_seq]
+
+
+update_buffer = GameUpdateBuffer(getattr(settings, 'GAME_UPDATE_BUFFER_SIZE', 64))
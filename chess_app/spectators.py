@@ -0,0 +1,78 @@
+# spectators.py
+import asyncio
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .computer import BOT_USERNAME
+from .models import Game
+
+
+class GamePlayers:
+    """
+    LRU of (player1_id, player2_id, computer_id) per game, computer_id being
+    the id of the player named as the computer, if either is. Players never
+    change, so after the first connection to a game, telling players from
+    spectators needs no query.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, game_id):
+        with self._lock:
+            players = self._entries.get(game_id)
+            if players is not None:
+                self._entries.move_to_end(game_id)
+            return players
+
+    def load(self, game_id):
+        """Reads the players from the database; raises Game.DoesNotExist."""
+        player1_id, player2_id, player1_name, player2_name = Game.objects.values_list(
+            'player1_id', 'player2_id', 'player1__username', 'player2__username'
+        ).get(id=game_id)
+        computer_id = {player1_name: player1_id, player2_name: player2_id}.get(BOT_USERNAME)
+        players = (player1_id, player2_id, computer_id)
+        with self._lock:
+            self._entries[game_id] = players
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return players
+
+
+game_players = GamePlayers()
+
+# Minimum seconds between two messages to one spectator; updates arriving in
+# between are merged, since every update carries the full position.
+SPECTATOR_UPDATE_INTERVAL = getattr(settings, 'SPECTATOR_UPDATE_INTERVAL', 0.25)
+
+# Strong references to fire-and-forget fan-out tasks, so they are not garbage collected mid-send
+_background_tasks = set()
+
+
+def spawn(coroutine):
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def broadcast_game_update(channel_layer, game_id, message):
+    """Sends a game update to the players, then to the spectators in the background."""
+    await channel_layer.group_send(
+        f'game_{game_id}',
+        {
+            'type': 'game_update',
+            'message': message,
+        }
+    )
+    spawn(channel_layer.group_send(
+        f'game_{game_id}_spectators',
+        {
+            'type': 'spectator_update',
+            'message': message,
+        }
+    ))
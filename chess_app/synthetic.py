@@ -0,0 +1,121 @@
+# synthetic.py
+# Kept free of Django imports: the generators run in worker processes.
+import random
+
+import chess
+from chess.polyglot import zobrist_hash
+
+from .pgn import termination
+from .utils import encode_move, material_signature, signed_key
+
+# Results of games that are still going when their random walk stops: resignations and agreed draws
+UNFINISHED_RESULTS = ('1-0', '0-1', '1/2-1/2')
+UNFINISHED_WEIGHTS = (45, 40, 15)
+
+WORDS = (
+    'opening', 'gambit', 'pawn', 'knight', 'bishop', 'rook', 'queen', 'king', 'castled', 'centre',
+    'endgame', 'middlegame', 'pin', 'fork', 'skewer', 'sacrifice', 'exchange', 'tempo', 'file',
+    'diagonal', 'outpost', 'weakness', 'initiative', 'attack', 'defence', 'blunder', 'clock',
+    'time', 'pressure', 'plan', 'structure', 'passed', 'isolated', 'doubled', 'kingside',
+    'queenside', 'development', 'trade', 'missed', 'found', 'should', 'have', 'played', 'after',
+    'before', 'the', 'a', 'my', 'his', 'her', 'their', 'and', 'but', 'then', 'again', 'too',
+    'early', 'late', 'quickly', 'slowly', 'under', 'with', 'against', 'into', 'lost', 'won',
+    'drew', 'better', 'worse', 'equal', 'position', 'move', 'line', 'variation', 'calculation',
+)
+
+
+def game_over(board):
+    """Whether the game has ended on the board; repetitions aside, which would need the whole move stack."""
+    return board.is_insufficient_material() or board.halfmove_clock >= 100 or not any(board.generate_legal_moves())
+
+
+def random_move(rng, board):
+    """
+    A legal move picked uniformly at random, or None if there is none. Tries
+    the pseudo-legal moves in random order, which is cheaper than listing
+    the legal ones first.
+    """
+    moves = list(board.generate_pseudo_legal_moves())
+    while moves:
+        n = rng.randrange(len(moves))
+        if not board.is_into_check(moves[n]):
+            return moves[n]
+        moves[n] = moves[-1]
+        moves.pop()
+    return None
+
+
+def random_game(rng, plies, snapshot_interval, finish=True, positions=False):
+    """
+    Plays up to `plies` random legal moves from the starting position,
+    stopping early if the game ends. Unless `finish` is set, moves are taken
+    back until the game can go on. Returns the board, the (ply, FEN)
+    snapshots and, if `positions` is set, the (zobrist key, material) after
+    every ply. Repetitions are left to termination() at the end.
+    """
+    board = chess.Board()
+    snapshots, keys = [], []
+    while len(board.move_stack) < plies:
+        move = random_move(rng, board)
+        if move is None or board.is_insufficient_material() or board.halfmove_clock >= 100:
+            break
+        board.push(move)
+        ply = len(board.move_stack)
+        if ply % snapshot_interval == 0:
+            snapshots.append((ply, board.fen()))
+        if positions:
+            keys.append((signed_key(zobrist_hash(board)), material_signature(board)))
+    if not finish:
+        while board.move_stack and game_over(board):
+            board.pop()
+        ply = len(board.move_stack)
+        snapshots = [snapshot for snapshot in snapshots if snapshot[0] <= ply]
+        del keys[ply:]
+    return board, snapshots, keys
+
+
+def sentence(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def journal_text(rng):
+    """A (description, entry) pair of journal-like text: a short title and a few paragraphs."""
+    description = sentence(rng, rng.randint(3, 8))[:-1]
+    paragraphs = [
+        ' '.join(sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(2, 6)))
+        for _ in range(rng.randint(1, 4))
+    ]
+    return description, '\n\n'.join(paragraphs)
+
+
+def random_games(seed, count, min_plies, max_plies, snapshot_interval, notes=0.0, ongoing=False):
+    """
+    Worker entry point: `count` games of random legal moves, each `min_plies`
+    to `max_plies` long, drawn from random.Random(seed) so a seed always gives
+    the same games. Each game is a dict with the result and termination
+    (None for ongoing games), the final FEN, the encoded moves, the snapshots
+    and, for a `notes` share of them, a journal note. Ongoing games also get
+    the (zobrist key, material) of every position, for the position index.
+    """
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        board, snapshots, positions = random_game(
+            rng, rng.randint(min_plies, max_plies), snapshot_interval, finish=not ongoing, positions=ongoing
+        )
+        game = {
+            'fen': board.fen(),
+            'moves': [encode_move(move) for move in board.move_stack],
+            'snapshots': snapshots,
+            'note': journal_text(rng) if rng.random() < notes else None,
+        }
+        if ongoing:
+            game['result'] = game['termination'] = None
+            game['positions'] = positions
+        else:
+            outcome = board.outcome()
+            game['result'] = outcome.result() if outcome else rng.choices(UNFINISHED_RESULTS, UNFINISHED_WEIGHTS)[0]
+            game['termination'] = termination(board, game['result'], {})
+        games.append(game)
+    return games
@@ -1,3 +1,1150 @@
-from django.test import TestCase
+import asyncio
+import gc
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import chess
+import numpy as np
+from chess.polyglot import zobrist_hash
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import presence
+from .analysis import AnalysisWorker, annotate, pack_evaluations
+from .clocks import ClockScheduler, charge_move, check_timeout
+from .computer import BOT_USERNAME, find_bot_user_id, get_bot_user
+from .db_executor import LANE_GAMES, LANE_MOVES, LANE_POST_GAME, LANE_PRESENCE, DatabaseExecutor, run_db_task
+from .explorer import count_games, explore
+from .export import export_pgn, finished_games
+from .forms import JoinForm
+from .lobby import LOBBY_GAMES, build_snapshot, completed_games_page, decode_cursor, encode_cursor
+from .management.commands.import_pgn import username_for
+from .matchmaking import Matchmaker, MatchmakingQueue, Seeker
+from .models import Challenge, ChessGame, Game, GameAnalysis, JournalEntry, Move, OnlineUser, PgnImport, PlayerRating, PositionIndex
+from .pgn import parse_games, termination
+from .positions import PAGE_SIZE, index_games
+from .post_game import process_finished_game
+from .ratings import SCALE, _new_volatility, glicko2, glicko2_period
+from .replay import GameUpdateBuffer
+from .routing import websocket_urlpatterns
+from .zobrist import ZobristTracker
+
+# Wall-time budgets are set for a developer machine; scale them on slower CI runners
+TIME_FACTOR = float(os.environ.get('PERF_TIME_FACTOR', 1))
+SEED = 20241017
+
+# No Redis, no worker threads: every database task runs on the test's own connection, where it is counted
+PERF_SETTINGS = {
+    'PRESENCE': {'BACKEND': 'database'},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'CHANNELS_DB_EXECUTOR': {'WORKERS': 0},
+}
+
+
+class QueryBudgetMixin:
+    """assertBudget fails a test that runs more queries, or takes longer, than its endpoint is allowed."""
+
+    @contextmanager
+    def assertBudget(self, queries, seconds=None, captured=None):
+        """
+        Budget for the block. Consumer tests pass `captured`, a
+        CaptureQueriesContext opened on the test thread around the whole
+        async_to_sync call, since a connection can't be opened from async code.
+        """
+        with ExitStack() as stack:
+            if captured is None:
+                captured = stack.enter_context(CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]))
+            first = len(captured)
+            # Garbage left by earlier tests is collected now, not in the middle of the timed block
+            gc.collect()
+            start = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - start
+            executed = captured.captured_queries[first:]
+        if len(executed) > queries:
+            sql = '\n'.join(f"{n}. {query['sql']}" for n, query in enumerate(executed, start=1))
+            self.fail(f"{len(executed)} queries, over the budget of {queries}:\n{sql}")
+        if seconds is not None and elapsed > seconds * TIME_FACTOR:
+            self.fail(f"Took {elapsed * 1000:.0f} ms, over the budget of {seconds * TIME_FACTOR * 1000:.0f} ms")
+
+
+def random_game(rng, max_plies):
+    """Random legal moves from the starting position until the game ends or `max_plies` are played."""
+    board = chess.Board()
+    while len(board.move_stack) < max_plies and not board.is_game_over():
+        board.push(rng.choice(list(board.legal_moves)))
+    return board
+
+
+def seed_games(rng, player, opponents, count, max_plies=120):
+    """
+    `count` finished games of `player` against random `opponents`, as white
+    and black in turn, with full move logs, one finishing every hour back
+    from now. Games that did not end on the board are decided at random.
+    """
+    boards = [random_game(rng, rng.randint(20, max_plies)) for _ in range(count)]
+    pairs = [
+        (player, opponent) if n % 2 == 0 else (opponent, player)
+        for n, opponent in enumerate(rng.choice(opponents) for _ in range(count))
+    ]
+    chess_games = ChessGame.objects.bulk_create(
+        [ChessGame(user=white, name=f"{white.username} vs {black.username}", fen=board.fen()) for board, (white, black) in zip(boards, pairs)]
+    )
+    games = []
+    for board, (white, black), chess_game in zip(boards, pairs, chess_games):
+        outcome = board.outcome()
+        result = outcome.result() if outcome else rng.choice(['1-0', '0-1', '1/2-1/2'])
+        games.append(Game(
+            player1=white, player2=black, board=chess_game, current_turn=white, status='finished',
+            winner={'1-0': white, '0-1': black}.get(result), termination=termination(board, result, {}),
+            move_count=len(board.move_stack), rated=True, in_explorer=False,
+        ))
+    games = Game.objects.bulk_create(games)
+    for board, game in zip(boards, games):
+        Move.objects.bulk_append(game, board.move_stack)
+
+    now = timezone.now()
+    for n, game in enumerate(games):
+        game.updated_at = now - timedelta(hours=n)
+    Game.objects.bulk_update(games, ['updated_at'], batch_size=500)
+    count_games([game.id for game in games])
+    return games
+
+
+def seed_analysis(rng, game):
+    """A finished engine analysis of `game` with plausible evaluations."""
+    scores = [0]
+    for _ in range(game.move_count):
+        scores.append(max(-3000, min(3000, scores[-1] + rng.randint(-120, 120))))
+    annotations, white_accuracy, black_accuracy = annotate(scores)
+    return GameAnalysis.objects.create(
+        game=game, status='done', evaluations=pack_evaluations(scores), annotations=annotations,
+        white_accuracy=white_accuracy, black_accuracy=black_accuracy, completed_at=timezone.now(),
+    )
+
+
+@override_settings(**PERF_SETTINGS)
+class ViewBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Query and time budgets of the views, for a player with a few hundred
+    finished games, journal notes and analyses. Every budget counts the
+    two queries that load the session and the user.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(SEED)
+        cls.users = User.objects.bulk_create([User(username=f"player{n}") for n in range(20)])
+        cls.player, cls.opponents = cls.users[0], cls.users[1:]
+        PlayerRating.objects.bulk_create([PlayerRating(user=user, rating=rng.gauss(1500, 200)) for user in cls.users])
+        # The player and five opponents have the site open
+        OnlineUser.objects.bulk_create([OnlineUser(user=user, connection_count=1) for user in cls.users[:6]])
+        games = seed_games(rng, cls.player, cls.opponents, 300)
+        seed_games(rng, cls.opponents[0], cls.opponents[1:], 100)
+        JournalEntry.objects.bulk_create([
+            JournalEntry(user=cls.player, game=game, description=f"Notes on game {game.id}", entry="Castled late again.")
+            for game in games[::3]
+        ])
+        # Test data is deep-copied for every test, so keep ids rather than hundreds of instances
+        cls.game_ids = [game.id for game in games]
+        longest = max(games, key=lambda game: game.move_count)
+        seed_analysis(rng, longest)
+        cls.game_id = longest.id
+
+    def setUp(self):
+        presence._presence = None
+        cache.clear()
+        self.client.force_login(self.player)
+        # The test client loads the middleware on its first request; keep that out of the timings
+        self.client.get('/rules/')
+
+    def test_home(self):
+        # Ongoing game, challenges, two history scans, journal notes, online players with their names
+        with self.assertBudget(8, seconds=0.1):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual([user['username'] for user in response.context['active_users']], [f"player{n}" for n in range(1, 6)])
+
+    def test_build_snapshot(self):
+        with self.assertNumQueries(5):
+            snapshot = build_snapshot(self.player)
+        self.assertEqual(len(snapshot['completed_games']), LOBBY_GAMES)
+
+    def test_home_cached(self):
+        self.client.get('/')
+        # Session, user, online players with their names
+        with self.assertBudget(3, seconds=0.05):
+            self.client.get('/')
+
+    def test_completed_games_last_page(self):
+        cursor, pages = None, 0
+        while True:
+            with self.assertBudget(5, seconds=0.05):
+                page = self.client.get('/games/completed/', {'cursor': cursor} if cursor else {}).json()
+            pages += 1
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.assertEqual(pages, 15)
+
+    def test_play_game(self):
+        game = Game.objects.create(
+            player1=self.player, player2=self.opponents[0], current_turn=self.player,
+            board=ChessGame.objects.create(user=self.player),
+        )
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.get(f'/play/{game.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_play_game_spectator(self):
+        white, black = self.opponents[:2]
+        game = Game.objects.create(player1=white, player2=black, current_turn=white, board=ChessGame.objects.create(user=white))
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.get(f'/play/{game.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_game_result(self):
+        # Game with both players, analysis, move log; the board is replayed in memory however long the game
+        with self.assertBudget(5, seconds=0.1):
+            response = self.client.get(f'/game/result/{self.game_id}/')
+        self.assertContains(response, "Accuracy")
+
+    def test_edit_journal(self):
+        # Includes creating the empty entry
+        with self.assertBudget(7, seconds=0.05):
+            response = self.client.get(f'/edit-journal/{self.game_id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_journal_save(self):
+        with self.assertBudget(8, seconds=0.05):
+            response = self.client.post(f'/edit-journal/{self.game_id}/', {'description': "Endgame", 'entry': "Rook behind the pawn."})
+        self.assertEqual(response.status_code, 302)
+
+    def test_check_for_game(self):
+        with self.assertBudget(3, seconds=0.05):
+            self.client.get('/check_for_game/')
+
+    def test_opening_explorer(self):
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.get('/explorer/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_positions(self):
+        board = chess.Board()
+        board.push_uci('e2e4')
+        with self.assertBudget(4, seconds=0.05):
+            response = self.client.get('/positions/', {'fen': board.fen()})
+        self.assertTrue(response.json()['games'])
+
+    def test_export_games(self):
+        # One query for each batch of games and one for their moves, however many games
+        with self.assertBudget(5, seconds=2.0):
+            response = self.client.get('/export/')
+            pgn = b''.join(response.streaming_content)
+        self.assertEqual(pgn.count(b'[Event '), 300)
+
+    def test_send_challenge(self):
+        with self.assertBudget(6, seconds=0.05):
+            response = self.client.post(f'/send_challenge/{self.opponents[0].id}/', '{}', content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+
+    def test_accept_challenge(self):
+        Challenge.objects.create(challenger=self.opponents[0], challenged=self.player, status='pending')
+        with self.assertBudget(8, seconds=0.05):
+            response = self.client.post(f'/handle_challenge/{self.opponents[0].id}/accept/', '{}', content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+
+    def test_delete_game(self):
+        with self.assertBudget(4, seconds=0.05):
+            response = self.client.post(f'/delete_game/{self.game_ids[0]}/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_play_computer(self):
+        get_bot_user()
+        with self.assertBudget(7, seconds=0.05):
+            response = self.client.post('/play_computer/', {'color': 'white'})
+        self.assertEqual(response.status_code, 302)
+
+
+async def connect(path, user):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+@override_settings(**PERF_SETTINGS)
+class ConsumerBudgetTests(QueryBudgetMixin, TransactionTestCase):
+    """
+    Query and time budgets per WebSocket message. The database tasks run on
+    the test thread through async_to_sync, so their queries are counted.
+    Post-game bookkeeping, which the executor normally defers to its own
+    lane, runs inline here and counts against the final move.
+    """
+
+    def setUp(self):
+        presence._presence = None
+        cache.clear()
+        # Finishing a game queues its analysis; don't start the engine pool for it
+        patcher = mock.patch.dict('chess_app.analysis._config', {'IN_PROCESS': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.white = User.objects.create(username='white')
+        self.black = User.objects.create(username='black')
+
+    def run_consumers(self, play):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as captured:
+            async_to_sync(play)(captured)
+
+    def new_game(self, moves=()):
+        board = chess.Board()
+        for uci in moves:
+            board.push_uci(uci)
+        game = Game.objects.create(
+            player1=self.white, player2=self.black, current_turn=self.white if board.turn else self.black,
+            board=ChessGame.objects.create(user=self.white, fen=board.fen()), move_count=len(board.move_stack),
+        )
+        Move.objects.bulk_append(game, board.move_stack)
+        return game
+
+    def long_game_moves(self):
+        # Well past the opening and several position snapshots in, with white to move
+        board = random_game(random.Random(SEED), 160)
+        while board.is_game_over() or board.turn == chess.BLACK:
+            board.pop()
+        return [move.uci() for move in board.move_stack]
+
+    def test_move(self):
+        game = self.new_game()
+
+        async def play(captured):
+            white = await connect(f'/ws/game/{game.id}/', self.white)
+            black = await connect(f'/ws/game/{game.id}/', self.black)
+            # Read the game, then one transaction: game, board, move log and position index
+            for sender, move in ((white, 'e2e4'), (black, 'e7e5'), (white, 'g1f3')):
+                with self.assertBudget(7, seconds=0.1, captured=captured):
+                    await sender.send_json_to({'action': 'move', 'move': move})
+                    update = await white.receive_json_from()
+                    await black.receive_json_from()
+                self.assertEqual(update['move'], move)
+            await white.disconnect()
+            await black.disconnect()
+
+        self.run_consumers(play)
+
+    def test_move_in_long_game(self):
+        moves = self.long_game_moves()
+        game = self.new_game(moves)
+
+        async def play(captured):
+            white = await connect(f'/ws/game/{game.id}/', self.white)
+            black = await connect(f'/ws/game/{game.id}/', self.black)
+            board = chess.Board(game.board.fen)
+            # The first move rebuilds the live board from the last snapshot and the moves after it,
+            # whatever the game's length; the next ones reuse it
+            for sender, budget in ((white, 10), (black, 7)):
+                move = next(iter(board.legal_moves))
+                board.push(move)
+                with self.assertBudget(budget, seconds=0.1, captured=captured):
+                    await sender.send_json_to({'action': 'move', 'move': move.uci()})
+                    update = await white.receive_json_from()
+                    await black.receive_json_from()
+                self.assertEqual(update['fen'], board.fen())
+            await white.disconnect()
+            await black.disconnect()
+
+        self.run_consumers(play)
+
+    def test_checkmate(self):
+        game = self.new_game(['f2f3', 'e7e5', 'g2g4'])
+
+        async def play(captured):
+            black = await connect(f'/ws/game/{game.id}/', self.black)
+            # Ratings, opening explorer and analysis queue included
+            with self.assertBudget(26, seconds=0.2, captured=captured):
+                await black.send_json_to({'action': 'move', 'move': 'd8h4'})
+                update = await black.receive_json_from()
+            self.assertEqual(update['termination'], 'checkmate')
+            await black.disconnect()
+
+        self.run_consumers(play)
+
+    def test_resign(self):
+        game = self.new_game(['e2e4', 'e7e5'])
+
+        async def play(captured):
+            white = await connect(f'/ws/game/{game.id}/', self.white)
+            with self.assertBudget(23, seconds=0.2, captured=captured):
+                await white.send_json_to({'action': 'resign'})
+                update = await white.receive_json_from()
+            self.assertEqual(update['winner'], 'black')
+            await white.disconnect()
+
+        self.run_consumers(play)
+
+    def test_resume_from_snapshot(self):
+        game = self.new_game(self.long_game_moves())
+
+        async def play(captured):
+            white = await connect(f'/ws/game/{game.id}/', self.white)
+            with self.assertBudget(1, seconds=0.05, captured=captured):
+                await white.send_json_to({'action': 'resume', 'last_seq': -1})
+                snapshot = await white.receive_json_from()
+            self.assertEqual(snapshot['type'], 'snapshot')
+            await white.disconnect()
+
+        self.run_consumers(play)
+
+    def test_resume_with_invalid_last_seq(self):
+        game = self.new_game()
+
+        async def play(captured):
+            white = await connect(f'/ws/game/{game.id}/', self.white)
+            await white.send_json_to({'action': 'resume', 'last_seq': 'latest'})
+            self.assertEqual(await white.receive_json_from(), {'error': 'Invalid last_seq.'})
+            # The connection is still usable
+            await white.send_json_to({'action': 'resume', 'last_seq': -1})
+            self.assertEqual((await white.receive_json_from())['type'], 'snapshot')
+            await white.disconnect()
+
+        self.run_consumers(play)
+
+    def test_game_connect(self):
+        game = self.new_game()
+
+        async def play(captured):
+            # Players and clock; a game without the computer never looks it up
+            with self.assertBudget(2, seconds=0.05, captured=captured):
+                white = await connect(f'/ws/game/{game.id}/', self.white)
+            # The players are cached after the first connection
+            with self.assertBudget(1, seconds=0.05, captured=captured):
+                black = await connect(f'/ws/game/{game.id}/', self.black)
+            await white.disconnect()
+            await black.disconnect()
+
+        self.run_consumers(play)
+
+    def test_game_connect_with_person_named_as_computer(self):
+        # A misconfigured computer player is logged; the game's sockets still work
+        self.black.username = BOT_USERNAME
+        self.black.set_password("kasparov1997")
+        self.black.save()
+        game = self.new_game()
+
+        async def play(captured):
+            white = await connect(f'/ws/game/{game.id}/', self.white)
+            await white.send_json_to({'action': 'move', 'move': 'e2e4'})
+            self.assertEqual((await white.receive_json_from())['move'], 'e2e4')
+            await white.disconnect()
+
+        with mock.patch('chess_app.computer._bot_user_id', None), self.assertLogs('chess_app.computer', 'ERROR'):
+            self.run_consumers(play)
+
+    def test_lobby_messages(self):
+        async def play(captured):
+            # Register the connection, then one query for everyone online
+            with self.assertBudget(6, seconds=0.05, captured=captured):
+                lobby = await connect('/ws/challenges/', self.white)
+                await lobby.receive_json_from()
+            # A heartbeat has no reply; the reply to the message after it says it has been handled
+            with self.assertBudget(1, seconds=0.05, captured=captured):
+                await lobby.send_json_to({'type': 'heartbeat'})
+                await lobby.send_json_to({'type': 'cancel_seek'})
+                await lobby.receive_json_from()
+            with self.assertBudget(2, seconds=0.05, captured=captured):
+                await lobby.send_json_to({'type': 'seek', 'base_time': 300, 'increment': 3})
+                self.assertEqual((await lobby.receive_json_from())['type'], 'seek_started')
+            await lobby.send_json_to({'type': 'cancel_seek'})
+            await lobby.receive_json_from()
+            await lobby.disconnect()
+
+        self.run_consumers(play)
+
+
+class PositionIndexTests(TestCase):
+    def setUp(self):
+        self.white = User.objects.create(username='white')
+        self.black = User.objects.create(username='black')
+        self.board = chess.Board()
+        for uci in ('e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5'):
+            self.board.push_uci(uci)
+
+    def unindexed_game(self, status='finished'):
+        return Game.objects.create(
+            player1=self.white, player2=self.black, current_turn=self.black, status=status,
+            board=ChessGame.objects.create(user=self.black, fen=self.board.fen()),
+            move_count=len(self.board.move_stack), positions_indexed=False,
+        )
+
+    def position_after(self, plies):
+        board = chess.Board()
+        for move in self.board.move_stack[:plies]:
+            board.push(move)
+        return board
+
+    def test_replays_complete_log(self):
+        game = self.unindexed_game()
+        Move.objects.bulk_append(game, self.board.move_stack)
+        # Rows written live before a rebuild are replaced, not duplicated
+        PositionIndex.objects.filter(game=game, ply__lte=2).delete()
+        self.assertEqual(index_games([game.id]), 5)
+        replay = chess.Board()
+        for ply, move in enumerate(self.board.move_stack, start=1):
+            replay.push(move)
+            row = PositionIndex.objects.get(game=game, ply=ply)
+            self.assertEqual(row.position_key, PositionIndex.fields_for(replay)['position_key'])
+
+    def test_skips_partial_log(self):
+        # Started before the move log existed: only plies 3 to 5 are logged, and indexed live
+        game = self.unindexed_game()
+        Move.objects.bulk_append(game, self.board.move_stack[2:], start_ply=2, start_fen=self.position_after(2).fen())
+        self.assertEqual(index_games([game.id]), 0)
+        self.assertEqual(list(PositionIndex.objects.filter(game=game).order_by('ply').values_list('ply', flat=True)), [3, 4, 5])
+        self.assertTrue(Game.objects.get(id=game.id).positions_indexed)
+
+    def test_search_last_page(self):
+        games = Game.objects.bulk_create([
+            Game(player1=self.white, player2=self.black, current_turn=self.white, board=ChessGame.objects.create(user=self.black))
+            for _ in range(PAGE_SIZE + 1)
+        ])
+        PositionIndex.objects.bulk_create([PositionIndex(game=game, ply=5, **PositionIndex.fields_for(self.board)) for game in games])
+        self.client.force_login(self.white)
+        page = self.client.get('/positions/', {'fen': self.board.fen()}).json()
+        self.assertEqual(len(page['games']), PAGE_SIZE)
+        # Exactly a page left: no empty page after it
+        page = self.client.get('/positions/', {'fen': self.board.fen(), 'after': games[0].id}).json()
+        self.assertEqual(len(page['games']), PAGE_SIZE)
+        self.assertIsNone(page['next'])
+
+    def test_rebuild_keeps_indexing_games_in_progress(self):
+        ongoing = self.unindexed_game(status='ongoing')
+        Game.objects.filter(id=ongoing.id).update(positions_indexed=True)
+        Move.objects.bulk_append(ongoing, self.board.move_stack)
+        finished = self.unindexed_game()
+        Move.objects.bulk_append(finished, self.board.move_stack)
+        call_command('build_position_index', rebuild=True, stdout=io.StringIO())
+        self.assertTrue(Game.objects.get(id=ongoing.id).positions_indexed)
+        self.assertEqual(PositionIndex.objects.filter(game=ongoing).count(), 5)
+        self.assertEqual(PositionIndex.objects.filter(game=finished).count(), 5)
+
+    def test_leaves_ongoing_games(self):
+        game = self.unindexed_game(status='ongoing')
+        self.assertEqual(index_games([game.id]), 0)
+        self.assertFalse(Game.objects.get(id=game.id).positions_indexed)
+        # Nor is it indexed move by move until the replay has it whole
+        board = self.board.copy()
+        board.push_uci('a7a6')
+        game.commit(fen=board.fen(), move=board.peek(), move_count=6)
+        self.assertFalse(PositionIndex.objects.filter(game=game).exists())
+
+
+class ExplorerTests(TestCase):
+    def setUp(self):
+        self.white = User.objects.create(username='white')
+        self.black = User.objects.create(username='black')
+
+    def finished_game(self, moves, start_ply=0):
+        board = chess.Board()
+        for uci in moves:
+            board.push_uci(uci)
+        game = Game.objects.create(
+            player1=self.white, player2=self.black, current_turn=self.white, status='finished', winner=self.white,
+            board=ChessGame.objects.create(user=self.black, fen=board.fen()), move_count=len(board.move_stack),
+        )
+        start = chess.Board()
+        for move in board.move_stack[:start_ply]:
+            start.push(move)
+        Move.objects.bulk_append(game, board.move_stack[start_ply:], start_ply=start_ply, start_fen=start.fen())
+        return game
+
+    def test_counts_moves_from_their_positions(self):
+        game = self.finished_game(['e2e4', 'e7e5', 'g1f3'])
+        self.assertEqual(count_games([game.id]), 1)
+        self.assertEqual([(move['uci'], move['white']) for move in explore(chess.Board())], [('e2e4', 1)])
+        board = chess.Board()
+        board.push_uci('e2e4')
+        board.push_uci('e7e5')
+        self.assertEqual([move['uci'] for move in explore(board)], ['g1f3'])
+
+    def test_skips_partial_log(self):
+        # Started before the move log existed: replaying plies 3 on from the start would credit g1f3 to it
+        game = self.finished_game(['e2e4', 'e7e5', 'g1f3'], start_ply=2)
+        self.assertEqual(count_games([game.id]), 0)
+        self.assertEqual(explore(chess.Board()), [])
+        self.assertTrue(Game.objects.get(id=game.id).in_explorer)
+
+
+class PostGameTests(TestCase):
+    def test_failing_step_does_not_stop_the_others(self):
+        with mock.patch('chess_app.post_game.rate_game', side_effect=RuntimeError), \
+                mock.patch('chess_app.post_game.count_games') as count_games, \
+                mock.patch('chess_app.post_game.queue_analysis') as queue_analysis, \
+                self.assertLogs('chess_app.post_game', 'ERROR') as logs:
+            process_finished_game(7)
+        count_games.assert_called_once_with([7])
+        queue_analysis.assert_called_once_with(7)
+        self.assertIn('Traceback', logs.output[0])
+
+
+class ComputerPlayerTests(TestCase):
+    def setUp(self):
+        # The id is remembered per process; each test starts without it
+        patcher = mock.patch('chess_app.computer._bot_user_id', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_username_reserved_at_signup(self):
+        form = JoinForm({
+            'first_name': "Deep", 'last_name': "Blue", 'username': BOT_USERNAME.upper(),
+            'email': "deep@example.com", 'password': "kasparov1997",
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('username', form.errors)
+
+    def test_created_without_password(self):
+        bot = get_bot_user()
+        self.assertFalse(bot.has_usable_password())
+        self.assertEqual(get_bot_user().id, bot.id)
+
+    def test_person_with_the_name_is_not_taken_over(self):
+        User.objects.create_user(BOT_USERNAME, password="kasparov1997")
+        with self.assertRaises(ImproperlyConfigured):
+            get_bot_user()
+        with self.assertLogs('chess_app.computer', 'ERROR'):
+            self.assertIsNone(find_bot_user_id())
+
+    def test_lookup_does_not_create(self):
+        self.assertIsNone(find_bot_user_id())
+        self.assertFalse(User.objects.filter(username=BOT_USERNAME).exists())
+
+    def test_username_reserved_on_import(self):
+        self.assertEqual(username_for(BOT_USERNAME.title()), f"pgn_{BOT_USERNAME.title()}")
+        self.assertEqual(username_for("Carlsen, Magnus"), "Carlsen, Magnus")
+
+
+class GameResultTests(TestCase):
+    def setUp(self):
+        self.white = User.objects.create(username='white')
+        self.black = User.objects.create(username='black')
+        self.spectator = User.objects.create(username='spectator')
+
+    def result_message(self, user, **fields):
+        game = Game.objects.create(
+            player1=self.white, player2=self.black, current_turn=self.white, status='finished',
+            board=ChessGame.objects.create(user=self.black), **fields,
+        )
+        self.client.force_login(user)
+        return self.client.get(f'/game/result/{game.id}/').context['message']
+
+    def test_draw(self):
+        self.assertEqual(self.result_message(self.white, termination='threefold_repetition'), "Draw: threefold repetition.")
+        self.assertEqual(self.result_message(self.black, termination='fifty_moves'), "Draw: fifty-move rule.")
+
+    def test_players(self):
+        self.assertEqual(self.result_message(self.white, winner=self.white, termination='checkmate'), "You won!")
+        self.assertEqual(self.result_message(self.black, winner=self.white, termination='checkmate'), "You lost!")
+
+    def test_spectator(self):
+        self.assertEqual(self.result_message(self.spectator, winner=self.black, termination='resign'), "black won!")
+
+
+class Glicko2Tests(TestCase):
+    """Against the worked example in Glickman's "Example of the Glicko-2 system", with tau = 0.5."""
+
+    @mock.patch('chess_app.ratings.TAU', 0.5)
+    def test_worked_example(self):
+        # A 1500 player (RD 200) beats a 1400 (RD 30), then loses to a 1550 (RD 100) and a 1700 (RD 300)
+        rating, rd, volatility = glicko2_period(
+            np.array([1500.0, 1400.0, 1550.0, 1700.0]), np.array([200.0, 30.0, 100.0, 300.0]), np.full(4, 0.06),
+            np.array([0, 0, 0]), np.array([1, 2, 3]), np.array([1.0, 0.0, 0.0]),
+        )
+        self.assertAlmostEqual(rating[0], 1464.06, delta=0.01)
+        self.assertAlmostEqual(rd[0], 151.52, delta=0.01)
+        self.assertAlmostEqual(volatility[0], 0.05999, delta=1e-5)
+
+    @mock.patch('chess_app.ratings.TAU', 0.5)
+    def test_worked_example_volatility(self):
+        # Step 5 of the example, with its v and delta
+        self.assertAlmostEqual(_new_volatility(0.06, 200 / SCALE, 1.7785, -0.4834), 0.05999, delta=1e-5)
+
+    def test_scalar_and_vectorized_agree(self):
+        rng = random.Random(SEED)
+        for _ in range(200):
+            rating = np.array([rng.gauss(1500, 300), rng.gauss(1500, 300)])
+            rd = np.array([rng.uniform(30, 350), rng.uniform(30, 350)])
+            volatility = np.array([rng.uniform(0.03, 0.1), rng.uniform(0.03, 0.1)])
+            score = rng.choice([0.0, 0.5, 1.0])
+            period = glicko2_period(rating, rd, volatility, np.array([0]), np.array([1]), np.array([score]))
+            white = glicko2(rating[0], rd[0], volatility[0], rating[1], rd[1], score)
+            black = glicko2(rating[1], rd[1], volatility[1], rating[0], rd[0], 1 - score)
+            # (rating, rd, volatility) of each side against the arrays for both players
+            for scalar_white, scalar_black, vectorized in zip(white, black, period):
+                self.assertAlmostEqual(scalar_white, vectorized[0], places=6)
+                self.assertAlmostEqual(scalar_black, vectorized[1], places=6)
+
+    def test_draw_between_equals_keeps_rating(self):
+        rating, rd, _ = glicko2(1500, 200, 0.06, 1500, 200, 0.5)
+        self.assertAlmostEqual(rating, 1500)
+        self.assertLess(rd, 200)
+
+
+class ClockTests(TestCase):
+    def setUp(self):
+        self.white = User.objects.create(username='white')
+        self.black = User.objects.create(username='black')
+        self.started = timezone.now()
+        patcher = mock.patch('chess_app.clocks.game_finished')
+        self.game_finished = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def new_game(self, fen=chess.STARTING_FEN, white_ms=180000, black_ms=180000):
+        """A 3+2 game with white to move, whose clock started at self.started."""
+        return Game.objects.create(
+            player1=self.white, player2=self.black, current_turn=self.white,
+            board=ChessGame.objects.create(user=self.black, fen=fen), base_time=180, increment=2,
+            white_time_ms=white_ms, black_time_ms=black_ms, turn_started_at=self.started,
+        )
+
+    def test_increment_added_to_the_mover(self):
+        game = self.new_game()
+        now = self.started + timedelta(seconds=5)
+        self.assertEqual(charge_move(game, now), {'white_time_ms': 177000, 'turn_started_at': now})
+        game.current_turn = self.black
+        self.assertEqual(charge_move(game, now), {'black_time_ms': 177000, 'turn_started_at': now})
+
+    def test_no_move_after_the_flag(self):
+        game = self.new_game(white_ms=5000)
+        self.assertIsNone(charge_move(game, self.started + timedelta(seconds=5)))
+
+    def test_flag_loses_on_time(self):
+        game = self.new_game(white_ms=5000)
+        self.started -= timedelta(seconds=6)
+        Game.objects.filter(id=game.id).update(turn_started_at=self.started)
+        message, seconds_left = check_timeout(game.id, game.version)
+        self.assertIsNone(seconds_left)
+        self.assertEqual((message['winner'], message['termination']), ('black', 'timeout'))
+        game.refresh_from_db()
+        self.assertEqual((game.status, game.winner, game.white_time_ms), ('finished', self.black, 0))
+        self.game_finished.assert_called_once()
+
+    def test_flag_draws_against_a_lone_king(self):
+        game = self.new_game(fen='4k3/8/8/8/8/8/8/R3K3 w - - 0 60', white_ms=0)
+        message, _ = check_timeout(game.id, game.version)
+        self.assertIsNone(message['winner'])
+        game.refresh_from_db()
+        self.assertEqual((game.status, game.winner, game.termination), ('finished', None, 'timeout'))
+
+    def test_time_left_is_not_flagged(self):
+        game = self.new_game()
+        message, seconds_left = check_timeout(game.id, game.version)
+        self.assertIsNone(message)
+        self.assertAlmostEqual(seconds_left, 180, delta=1)
+        # A move since the timer was set: that timer is stale
+        self.assertEqual(check_timeout(game.id, game.version - 1), (None, None))
+
+    def test_move_replaces_the_pending_timer(self):
+        scheduler = ClockScheduler()
+        checked = []
+
+        async def check(due):
+            checked.append(due)
+
+        async def play():
+            scheduler._check = check
+            scheduler.schedule(1, 1, 0.01)
+            # Black's reply before white's flag falls times white again, with the new version
+            scheduler.track(1, {'status': 'ongoing', 'seq': 2, 'clock': {'white': 60000, 'black': 170000, 'running': 'white'}})
+            scheduler.schedule(2, 1, 0.01)
+            scheduler.track(2, {'status': 'finished', 'seq': 2, 'clock': {'white': 0, 'black': 170000, 'running': None}})
+            await asyncio.sleep(0.05)
+            scheduler._task.cancel()
+
+        async_to_sync(play)()
+        self.assertEqual(checked, [])
+        self.assertTrue(scheduler.is_scheduled(1))
+        self.assertFalse(scheduler.is_scheduled(2))
+        self.assertEqual(len(scheduler), 1)
+
+
+class GameUpdateBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = GameUpdateBuffer(size=4)
+        self.buffer.subscribe(1)
+
+    def record(self, *seqs):
+        for seq in seqs:
+            self.buffer.record(1, seq, {'seq': seq})
+
+    def replayed(self, last_seq):
+        missed = self.buffer.since(1, last_seq)
+        return None if missed is None else [message['seq'] for message in missed]
+
+    def test_replays_what_was_missed(self):
+        # Every consumer of the game in this process records the same update
+        self.record(1, 1, 2, 3, 3)
+        self.assertEqual(self.replayed(0), [1, 2, 3])
+        self.assertEqual(self.replayed(1), [2, 3])
+        self.assertEqual(self.replayed(3), [])
+
+    def test_snapshot_once_last_seq_is_out_of_the_buffer(self):
+        self.record(*range(1, 8))
+        self.assertEqual(self.replayed(3), [4, 5, 6, 7])
+        self.assertIsNone(self.replayed(2))
+        self.assertIsNone(self.replayed(-1))
+
+    def test_snapshot_when_nobody_here_follows_the_game(self):
+        self.record(1, 2)
+        self.buffer.unsubscribe(1)
+        self.record(3)
+        self.assertIsNone(self.replayed(1))
+        self.assertIsNone(self.buffer.since(2, 0))
+
+
+class DatabaseExecutorTests(TestCase):
+    def test_moves_jump_the_queue(self):
+        executor = DatabaseExecutor(workers=1)
+        started, release = threading.Event(), threading.Event()
+        order = []
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        executor.submit(LANE_PRESENCE, block)
+        self.assertTrue(started.wait(5))
+        # Queued behind the busy worker, lowest priority first
+        futures = [
+            executor.submit(lane, order.append, name)
+            for lane, name in ((LANE_POST_GAME, 'post game'), (LANE_PRESENCE, 'heartbeat'), (LANE_GAMES, 'seek'), (LANE_MOVES, 'move'))
+        ]
+        self.assertEqual(executor.stats()[LANE_MOVES]['depth'], 1)
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ['move', 'seek', 'heartbeat', 'post game'])
+        self.assertEqual(executor.stats()[LANE_PRESENCE]['completed'], 2)
+
+
+@override_settings(**PERF_SETTINGS)
+class PresenceTests(TransactionTestCase):
+    def setUp(self):
+        presence._presence = None
+
+    def test_flap_within_window_is_not_broadcast(self):
+        broadcaster = presence.PresenceBroadcaster(interval=0.01)
+
+        async def play():
+            channel_layer = get_channel_layer()
+            channel = await channel_layer.new_channel()
+            await channel_layer.group_add('all_users', channel)
+            # A reload: offline and straight back online
+            broadcaster.mark(1, 'alice', 'offline')
+            broadcaster.mark(1, 'alice', 'online')
+            broadcaster.mark(2, 'bob', 'online')
+            event = await asyncio.wait_for(channel_layer.receive(channel), 1)
+            self.assertEqual(event, presence.presence_diff_event([{'id': 2, 'username': 'bob'}], []))
+
+            broadcaster.mark(2, 'bob', 'offline')
+            broadcaster.mark(2, 'bob', 'online')
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(channel_layer.receive(channel), 0.1)
+
+        async_to_sync(play)()
+
+    def grace_expiry(self, reconnect):
+        """Closes the user's only tab, calls `reconnect` and returns the broadcaster mock once the grace period is over."""
+        user = User.objects.create(username='alice')
+        backend = presence.get_presence()
+        backend.connect(user, 'tab')
+        timers = presence.GraceScheduler(grace=0.01)
+
+        async def play():
+            remaining = await run_db_task(LANE_PRESENCE, backend.disconnect, user, 'tab')
+            self.assertEqual(remaining, 0)
+            timers.schedule(user.id, user.username)
+            await reconnect(user, backend, timers)
+            await asyncio.sleep(0.1)
+
+        with mock.patch('chess_app.presence.broadcaster') as broadcaster:
+            async_to_sync(play)()
+        return user, broadcaster
+
+    def test_offline_once_grace_expires(self):
+        async def stay_away(user, backend, timers):
+            pass
+
+        user, broadcaster = self.grace_expiry(stay_away)
+        broadcaster.mark.assert_called_once_with(user.id, 'alice', 'offline')
+
+    def test_reload_within_grace_is_not_announced(self):
+        async def reload(user, backend, timers):
+            await run_db_task(LANE_PRESENCE, backend.connect, user, 'new tab')
+            timers.cancel(user.id)
+
+        _, broadcaster = self.grace_expiry(reload)
+        broadcaster.mark.assert_not_called()
+
+    def test_reconnect_to_another_worker_is_not_announced(self):
+        # The timer is not cancelled here, but the connection is seen when it comes due
+        async def reconnect(user, backend, timers):
+            await run_db_task(LANE_PRESENCE, backend.connect, user, 'tab on another worker')
+
+        _, broadcaster = self.grace_expiry(reconnect)
+        broadcaster.mark.assert_not_called()
+
+
+class MatchmakingQueueTests(TestCase):
+    def setUp(self):
+        # Windows of 100 points growing by 10 a second, up to 400
+        self.queue = MatchmakingQueue(bucket_width=50, initial_window=100, window_growth=10, max_window=400)
+
+    def seeker(self, user_id, rating, channel_name='channel', time_control=(300, 0)):
+        return Seeker(user_id, f"player{user_id}", channel_name, rating, time_control, joined_at=0)
+
+    def test_nearest_opponent_within_window(self):
+        self.assertIsNone(self.queue.add(self.seeker(1, 1500), now=0))
+        self.assertIsNone(self.queue.add(self.seeker(2, 1650), now=0))
+        self.assertIsNone(self.queue.add(self.seeker(3, 1580, time_control=(600, 0)), now=0))
+        # 1650 is in the window too, and 1580 plays a different time control
+        opponent = self.queue.add(self.seeker(4, 1560), now=0)
+        self.assertEqual(opponent.user_id, 1)
+        self.assertEqual(len(self.queue), 2)
+        self.assertNotIn(1, self.queue)
+
+    def test_window_grows_while_waiting(self):
+        self.queue.add(self.seeker(1, 1500), now=0)
+        self.queue.add(self.seeker(2, 1700), now=0)
+        self.assertEqual(self.queue.match(now=5), [])
+        pairs = self.queue.match(now=10)
+        self.assertEqual([(white.user_id, black.user_id) for white, black in pairs], [(1, 2)])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_window_stops_growing(self):
+        self.queue.add(self.seeker(1, 1500), now=0)
+        self.queue.add(self.seeker(2, 1950), now=0)
+        self.assertEqual(self.queue.match(now=3600), [])
+
+    def test_never_matched_with_themselves(self):
+        # A second tab seeking replaces the first seek
+        self.assertIsNone(self.queue.add(self.seeker(1, 1500, 'first tab'), now=0))
+        self.assertIsNone(self.queue.add(self.seeker(1, 1500, 'second tab'), now=0))
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.match(now=3600), [])
+
+    def test_disconnect_cancels_only_its_own_seek(self):
+        matchmaker = Matchmaker(self.queue)
+        self.queue.add(self.seeker(1, 1500, 'second tab'), now=0)
+        self.assertFalse(matchmaker.cancel(1, 'first tab'))
+        self.assertIn(1, self.queue)
+        self.assertTrue(matchmaker.cancel(1, 'second tab'))
+        self.assertNotIn(1, self.queue)
+        self.assertIsNone(self.queue.add(self.seeker(2, 1500), now=0))
+
+
+class ZobristTests(TestCase):
+    def test_incremental_key_matches_full_hash(self):
+        # Random games reach castling, en passant and promotions
+        rng = random.Random(SEED)
+        for _ in range(50):
+            board = chess.Board()
+            tracker = ZobristTracker(board)
+            while not board.is_game_over() and len(board.move_stack) < 300:
+                tracker.push(board, rng.choice(list(board.legal_moves)))
+                self.assertEqual(tracker.key, zobrist_hash(board), board.fen())
+
+    def test_en_passant_key_only_when_capture_possible(self):
+        # d7d5 can be taken en passant by the pawn on e5, a7a5 can't be taken at all
+        for moves in (('e2e4', 'a7a6', 'e4e5', 'd7d5'), ('e2e4', 'a7a5')):
+            board = chess.Board()
+            tracker = ZobristTracker(board)
+            for uci in moves:
+                tracker.push(board, chess.Move.from_uci(uci))
+            self.assertEqual(tracker.key, zobrist_hash(board))
+
+    def test_threefold_repetition(self):
+        board = chess.Board()
+        tracker = ZobristTracker(board)
+        for uci in ('g1f3', 'g8f6', 'f3g1', 'f6g8') * 2:
+            self.assertFalse(tracker.is_threefold_repetition())
+            tracker.push(board, chess.Move.from_uci(uci))
+        self.assertTrue(tracker.is_threefold_repetition())
+        self.assertTrue(board.is_repetition(3))
+
+
+class PgnTests(TestCase):
+    def setUp(self):
+        self.white = User.objects.create(username='white "the rook"')
+        self.black = User.objects.create(username='black')
+
+    def test_export_reads_back(self):
+        rng = random.Random(SEED)
+        games = seed_games(rng, self.white, [self.black], 20)
+        parsed, skipped = parse_games(''.join(export_pgn(finished_games(self.white))), 20)
+        self.assertEqual(skipped, 0)
+        self.assertEqual(len(parsed), 20)
+        for game, read in zip(games, parsed):
+            moves = list(Move.objects.filter(game=game).order_by('ply').values_list('move', flat=True))
+            self.assertEqual(read['moves'], moves)
+            self.assertEqual(read['fen'], ChessGame.objects.get(game=game).fen)
+            self.assertEqual(read['result'], '1/2-1/2' if game.winner_id is None else ('1-0' if game.winner_id == game.player1_id else '0-1'))
+            self.assertEqual((read['white'], read['black']), (game.player1.username, game.player2.username))
+            self.assertEqual([ply for ply, _ in read['snapshots']], list(range(20, game.move_count + 1, 20)))
+
+    def test_game_without_move_log(self):
+        Game.objects.create(
+            player1=self.white, player2=self.black, current_turn=self.white, status='finished', winner=self.black,
+            board=ChessGame.objects.create(user=self.black), move_count=30, termination='resign',
+        )
+        pgn = ''.join(export_pgn(finished_games(self.white)))
+        self.assertIn('[Annotator "Moves not recorded"]', pgn)
+        self.assertTrue(pgn.rstrip().endswith('0-1'))
+
+    def test_interrupted_import_resumes(self):
+        games = seed_games(random.Random(SEED), self.white, [self.black], 20)
+        expected = [list(Move.objects.filter(game=game).order_by('ply').values_list('move', flat=True)) for game in games]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.pgn')
+            with open(path, 'w') as handle:
+                handle.writelines(export_pgn(finished_games(self.white)))
+            Game.objects.all().delete()
+
+            save = PgnImport.save
+
+            def interrupt_third_chunk(checkpoint, *args, **kwargs):
+                # Inside the chunk's transaction, after its games are written
+                if checkpoint.games > 10:
+                    raise KeyboardInterrupt
+                save(checkpoint, *args, **kwargs)
+
+            with mock.patch.object(PgnImport, 'save', interrupt_third_chunk):
+                call_command('import_pgn', path, workers=1, batch_size=5, stdout=io.StringIO())
+            self.assertEqual(Game.objects.count(), 10)
+            self.assertEqual(PgnImport.objects.get(path=path).games, 10)
+
+            out = io.StringIO()
+            call_command('import_pgn', path, workers=1, batch_size=5, stdout=out)
+            self.assertIn("after 10 games", out.getvalue())
+        imported = [
+            list(Move.objects.filter(game=game).order_by('ply').values_list('move', flat=True))
+            for game in Game.objects.order_by('id')
+        ]
+        self.assertEqual(imported, expected)
+        self.assertEqual(PgnImport.objects.get(path=path).games, 20)
+
+    def test_termination(self):
+        mate = chess.Board()
+        for uci in ('f2f3', 'e7e5', 'g2g4', 'd8h4'):
+            mate.push_uci(uci)
+        self.assertEqual(termination(mate, '0-1', {}), 'checkmate')
+        self.assertEqual(termination(chess.Board(), '1-0', {'Termination': 'Time forfeit'}), 'timeout')
+        self.assertEqual(termination(chess.Board(), '1-0', {}), 'resign')
+        self.assertEqual(termination(chess.Board(), '1/2-1/2', {}), '')
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        self.player = User.objects.create(username='player')
+        self.opponent = User.objects.create(username='opponent')
+        now = timezone.now()
+        games = Game.objects.bulk_create([
+            Game(
+                player1=self.player if n % 2 else self.opponent, player2=self.opponent if n % 2 else self.player,
+                current_turn=self.player, status='finished', board=ChessGame.objects.create(user=self.player),
+                hidden_by_player1=n % 7 == 0, hidden_by_player2=n % 5 == 0,
+            )
+            for n in range(45)
+        ])
+        # Games finish in threes at the same moment, so pages break ties on the id
+        for n, game in enumerate(games):
+            game.updated_at = now - timedelta(minutes=n // 3)
+        Game.objects.bulk_update(games, ['updated_at'])
+        self.kept = sorted(
+            (
+                (game.updated_at, game.id) for game in games
+                if not (game.hidden_by_player1 if game.player1_id == self.player.id else game.hidden_by_player2)
+            ),
+            reverse=True,
+        )
+
+    def test_pages_list_every_kept_game_once(self):
+        ids, cursor = [], None
+        while True:
+            page, cursor = completed_games_page(self.player, cursor, limit=7)
+            self.assertTrue(page)
+            ids.extend(game['id'] for game in page)
+            if cursor is None:
+                break
+        self.assertEqual(ids, [game_id for _, game_id in self.kept])
+
+    def test_page_ending_with_the_history(self):
+        page, cursor = completed_games_page(self.player, limit=len(self.kept))
+        self.assertEqual(len(page), len(self.kept))
+        self.assertIsNone(cursor)
+
+    def test_hidden_only_for_that_player(self):
+        hidden = Game.objects.filter(player1=self.opponent, hidden_by_player1=False, hidden_by_player2=True).values_list('id', flat=True).first()
+        page, _ = completed_games_page(self.opponent, limit=100)
+        self.assertIn(hidden, [game['id'] for game in page])
+
+    def test_cursor(self):
+        updated_at, game_id = self.kept[0]
+        self.assertEqual(decode_cursor(encode_cursor(updated_at, game_id)), (updated_at, game_id))
+        for cursor in ('', 'abc', '12_x', '1' * 30 + '_1'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class AnalysisWorkerTests(TestCase):
+    def setUp(self):
+        white = User.objects.create(username='white')
+        black = User.objects.create(username='black')
+        self.analyses = [
+            GameAnalysis.objects.create(game=Game.objects.create(
+                player1=white, player2=black, current_turn=white, status='finished',
+                board=ChessGame.objects.create(user=black),
+            ))
+            for _ in range(3)
+        ]
+
+    def test_failed_batch_goes_back_to_pending(self):
+        pool = mock.Mock()
+        with mock.patch('chess_app.analysis.analyze_games', side_effect=RuntimeError), \
+                self.assertLogs('chess_app.analysis', 'ERROR'):
+            self.assertIs(AnalysisWorker(batch_size=2).drain(pool), pool)
+        self.assertEqual(list(GameAnalysis.objects.values_list('status', flat=True)), ['pending'] * 3)
+
+    def test_broken_pool_is_replaced(self):
+        pool, new_pool = mock.Mock(), mock.Mock()
+        with mock.patch('chess_app.analysis.analyze_games', side_effect=BrokenProcessPool), \
+                mock.patch('chess_app.analysis.get_analysis_pool', return_value=new_pool), \
+                self.assertLogs('chess_app.analysis', 'ERROR'):
+            self.assertIs(AnalysisWorker().drain(pool), new_pool)
+        pool.shutdown.assert_called_once_with(wait=False)
+
+    def test_drains_the_queue(self):
+        def finish(batch, pool):
+            GameAnalysis.objects.filter(id__in=[analysis.id for analysis in batch]).update(status='done')
+
+        with mock.patch('chess_app.analysis.analyze_games', side_effect=finish) as analyze:
+            AnalysisWorker(batch_size=2).drain(mock.Mock())
+        self.assertEqual(analyze.call_count, 2)
+        self.assertFalse(GameAnalysis.objects.exclude(status='done').exists())
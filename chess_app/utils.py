@@ -1,4 +1,5 @@
 # utils.py
+import functools
 import chess
 import logging
 
@@ -21,25 +22,88 @@ piece_to_html = {
     'p': '&#9823;',  # Black Pawn
 }
 
+def encode_move(move):
+    """
+    Packs a chess.Move into a small integer: from square in bits 0-5, to square
+    in bits 6-11 and the promotion piece type (0 for none) in bits 12-14.
+    """
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def decode_move(encoded):
+    """Inverse of encode_move."""
+    promotion = encoded >> 12
+    return chess.Move(encoded & 63, (encoded >> 6) & 63, promotion=promotion or None)
+
+def signed_key(key):
+    """Zobrist hashes are unsigned 64-bit; the database stores them signed."""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+# Pieces counted by a material signature, 4 bits each: white's in bits 0-19, black's in bits 20-39
+MATERIAL_PIECES = (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN)
+
+def material_signature(board):
+    """The pieces on the board (kings aside) packed into one integer, see MATERIAL_PIECES."""
+    signature = 0
+    shift = 0
+    for color in (chess.WHITE, chess.BLACK):
+        pieces = board.occupied_co[color]
+        for mask in (board.pawns, board.knights, board.bishops, board.rooks, board.queens):
+            signature |= min(chess.popcount(mask & pieces), 15) << shift
+            shift += 4
+    return signature
+
+def parse_material(text):
+    """
+    Material signature of a description such as "KQvKR" (white's pieces, then
+    black's) or "KRPPvKR". Raises ValueError for anything else.
+    """
+    sides = text.upper().split('V')
+    if len(sides) != 2 or not all(side.startswith('K') for side in sides):
+        raise ValueError(f"Invalid material: {text}")
+    signature = 0
+    for side, pieces in enumerate(sides):
+        for symbol in pieces[1:]:
+            if symbol not in 'PNBRQ':
+                raise ValueError(f"Invalid material: {text}")
+            piece_type = chess.PIECE_SYMBOLS.index(symbol.lower())
+            shift = 4 * (MATERIAL_PIECES.index(piece_type) + 5 * side)
+            if (signature >> shift) & 15 == 15:
+                raise ValueError(f"Invalid material: {text}")
+            signature += 1 << shift
+    return signature
+
+# Square names in the order the FEN placement field lists them: a8..h8, a7..h7, ..., a1..h1
+FEN_RANK_SQUARES = [tuple(f"{file}{rank}" for file in "abcdefgh") for rank in "87654321"]
+
+# Expands the digits of a FEN rank into that many blanks, so every rank becomes 8 characters
+FEN_EXPAND_EMPTY = {ord(str(n)): " " * n for n in range(1, 9)}
+
+# HTML for every character of an expanded rank
+FEN_CELL_HTML = dict(piece_to_html, **{" ": "&nbsp;"})
+
+@functools.lru_cache(maxsize=4096)
+def _render_placement(placement):
+    ranks = placement.split("/")
+    if len(ranks) != 8:
+        raise ValueError(f"Invalid FEN placement: {placement!r}")
+    rows = []
+    for squares, rank in zip(FEN_RANK_SQUARES, ranks):
+        cells = rank.translate(FEN_EXPAND_EMPTY)
+        if len(cells) != 8:
+            raise ValueError(f"Invalid FEN placement: {placement!r}")
+        try:
+            rows.append(dict(zip(squares, [FEN_CELL_HTML[cell] for cell in cells])))
+        except KeyError:
+            raise ValueError(f"Invalid FEN placement: {placement!r}")
+    return rows
+
 def board_to_dict(fen):
     """
     Converts a FEN string into a list of dictionaries representing each row of the chessboard.
     Each cell contains the HTML Unicode symbol for the piece or a non-breaking space if empty.
+    Reads the placement field directly and caches the result per placement.
     """
-    board = chess.Board(fen)
-    board_dict = []
-    for rank in reversed(range(1, 9)):
-        row = {}
-        for file in range(8):
-            square_index = chess.square(file, rank - 1)
-            square_name = chess.square_name(square_index)
-            piece = board.piece_at(square_index)
-            if piece:
-                row[square_name] = piece_to_html.get(piece.symbol(), piece.symbol())
-            else:
-                row[square_name] = "&nbsp;"
-        board_dict.append(row)
-    return board_dict
+    return [dict(row) for row in _render_placement(fen.split(" ", 1)[0])]
 
 def apply_move_to_board(fen, move):
     """
@@ -1,23 +1,33 @@
-from django.utils import timezone
-from datetime import timedelta
+from datetime import date
 import chess
+import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.db import IntegrityError, transaction
-from django.db.models import Prefetch, Q
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-from .models import DeletedGame, Game, JournalEntry, OnlineUser
+from .models import Game, JournalEntry
 from .forms import JournalForm 
 from django.views.decorators.http import require_POST
 
 from chess_app.forms import ChessForm, JoinForm, LoginForm, MoveForm
 from .models import ChessGame, Challenge, Game
-from .utils import board_to_dict, apply_move_to_board
+from .utils import board_to_dict, apply_move_to_board, parse_material
+from .presence import get_presence, presence_diff_event
+from .board_cache import legal_moves_for
+from .analysis import analysis_report
+from .computer import get_bot_user
+from .explorer import explore
+from .lobby import completed_games_page, invalidate_lobby, lobby_snapshot
+from .export import export_pgn, finished_games, gzip_stream
+from .positions import PAGE_SIZE, find_games
+from .clocks import TIME_CONTROLS, clock_state, parse_time_control, start_clocks
 from django.http import JsonResponse
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
@@ -37,6 +47,12 @@ def send_challenge(request, user_id):
             logger.info(f"User {request.user.id} is sending a challenge to User {user_id}")
             challenged_user = User.objects.get(id=user_id)
 
+            try:
+                options = json.loads(request.body or b'{}')
+                base_time, increment = parse_time_control(options.get('base_time', 0), options.get('increment', 0))
+            except (ValueError, TypeError, AttributeError):
+                return JsonResponse({'status': 'error', 'error': "Unsupported time control."})
+
             # Check for existing games or challenges
             if Game.objects.filter(
                 Q(player1=request.user, player2=challenged_user) |
@@ -55,8 +71,12 @@ def send_challenge(request, user_id):
                 return JsonResponse({'status': 'error', 'error': "A pending challenge already exists."})
 
             # Create the challenge and send a WebSocket notification
-            Challenge.objects.create(challenger=request.user, challenged=challenged_user, status='pending')
+            Challenge.objects.create(
+                challenger=request.user, challenged=challenged_user, status='pending',
+                base_time=base_time, increment=increment,
+            )
             logger.info(f"Challenge created between User {request.user.id} and User {user_id}")
+            invalidate_lobby(request.user.id, challenged_user.id)
 
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
@@ -66,6 +86,8 @@ def send_challenge(request, user_id):
                     "data": {
                         "challenger_id": request.user.id,
                         "challenger_username": request.user.username,
+                        "base_time": base_time,
+                        "increment": increment,
                     },
                 }
             )
@@ -94,15 +116,17 @@ def handle_challenge(request, user_id, action):
                 # Create the game
                 player_board = ChessGame.objects.create(
                     user=request.user,
-                    fen="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+                    fen=chess.STARTING_FEN  # Full FEN, so castling rights match the replayed move log
                 )
                 game = Game.objects.create(
                     player1=challenge.challenger,
                     player2=challenge.challenged,
                     board=player_board,
-                    current_turn=challenge.challenger
+                    current_turn=challenge.challenger,
+                    **start_clocks(challenge.base_time, challenge.increment)
                 )
                 logger.info(f"Game {game.id} created between User {challenge.challenger.id} and User {challenge.challenged.id}")
+                invalidate_lobby(challenge.challenger_id, challenge.challenged_id)
 
                 # Notify both users via WebSocket
                 channel_layer = get_channel_layer()
@@ -122,6 +146,7 @@ def handle_challenge(request, user_id, action):
             elif action == 'reject':
                 challenge.status = 'declined'
                 challenge.save()
+                invalidate_lobby(challenge.challenger_id, challenge.challenged_id)
 
                 channel_layer = get_channel_layer()
                 async_to_sync(channel_layer.group_send)(
@@ -147,76 +172,36 @@ def handle_challenge(request, user_id, action):
 @csrf_exempt
 @login_required(login_url='/login/')
 def home(request):
-    try:
-        # Check for ongoing games
-        ongoing_game = Game.objects.filter(
-            (Q(player1=request.user) | Q(player2=request.user)) & Q(status='ongoing')
-        ).first()
-        if ongoing_game:
-            return redirect('play_game', game_id=ongoing_game.id)
+    snapshot = lobby_snapshot(request.user)
+    if snapshot['ongoing_game_id']:
+        return redirect('play_game', game_id=snapshot['ongoing_game_id'])
 
-    except Game.DoesNotExist:
-        pass
-
-    now = timezone.now()
-    timeout = now - timedelta(minutes=3)
-    
-    online_users = OnlineUser.objects.filter(last_seen__gte=timeout)
-    print(f"Online users: {online_users}")
-    active_users = User.objects.filter(id__in=online_users.values_list('user_id', flat=True)).exclude(id=request.user.id)
-    # active_users = User.objects.filter(is_active=True).exclude(id=request.user.id)
-    
-    print(f"Current user ID: {request.user.id}")
-    print(f"Active user IDs: {list(active_users.values_list('id', flat=True))}")
-    
-    # Fetch pending challenges where the current user is being challenged
-    received_challenges = Challenge.objects.filter(challenged=request.user, status='pending')
-
-    # Fetch pending challenges sent by the current user
-    sent_challenges = Challenge.objects.filter(challenger=request.user, status='pending')
-
-    # Lists for template logic
-    challengers_list = list(received_challenges.values_list('challenger_id', flat=True))
-    challenged_user_ids = list(sent_challenges.values_list('challenged_id', flat=True))
-
-    # Fetch completed games
-    completed_games = Game.objects.filter(
-        (Q(player1=request.user) | Q(player2=request.user)) & Q(status='finished')
-    ).exclude(
-        id__in=DeletedGame.objects.filter(user=request.user).values_list('game_id', flat=True)
-    ).order_by('-updated_at')
-
-    # Prefetch journal entries for the current user
-    completed_games = completed_games.prefetch_related(
-        Prefetch(
-            'journalentry_set',
-            queryset=JournalEntry.objects.filter(user=request.user),
-            to_attr='user_journal_entries'
-        )
-    )
+    # Presence changes too often to cache; the backend keeps the online players' names with their ids
+    active_users = [user for user in get_presence().online_users() if user['id'] != request.user.id]
 
     return render(request, 'chess_app/home.html', {
         "active_users": active_users,
-        "challengers_list": challengers_list,
-        "challenged_user_ids": challenged_user_ids,
-        "received_challenges": received_challenges,
-        "completed_games": completed_games,
+        "challengers_list": snapshot['challengers'],
+        "challenged_user_ids": snapshot['challenged'],
+        "completed_games": snapshot['completed_games'],
+        "history_cursor": snapshot['history_cursor'],
         "current_user_id": request.user.id,
+        "time_controls": TIME_CONTROLS,
     })
     
 @csrf_exempt
 @login_required(login_url='/login/')
 def play_game(request, game_id):
     try:
-        game = Game.objects.get(id=game_id)
+        game = Game.objects.select_related('board', 'player1', 'player2', 'current_turn').get(id=game_id)
     except Game.DoesNotExist:
         return HttpResponse("Game not found", status=404)
 
     if game.status == 'finished':
         return redirect('game_result', game_id=game.id)
 
-    if request.user not in [game.player1, game.player2]:
-        return HttpResponse("You are not a player in this game", status=403)
+    # Anyone else who is logged in may watch
+    is_spectator = request.user not in [game.player1, game.player2]
 
     is_white = request.user == game.player1
     current_player = game.current_turn
@@ -229,27 +214,65 @@ def play_game(request, game_id):
         'is_current_turn': request.user == current_player,
         'player_color': player_color,
         'opponent': opponent,
+        'is_spectator': is_spectator,
+        'clock': clock_state(game),
+        'legal_moves': legal_moves_for(chess.Board(game.board.fen)),
     })
 
 
 
+@require_POST
+@login_required(login_url='/login/')
+def play_computer(request):
+    """Starts a game against the computer, with the user playing the colour they chose."""
+    ongoing_game = Game.objects.filter(
+        (Q(player1=request.user) | Q(player2=request.user)) & Q(status='ongoing')
+    ).first()
+    if ongoing_game:
+        return redirect('play_game', game_id=ongoing_game.id)
+
+    try:
+        bot = get_bot_user()
+    except ImproperlyConfigured as e:
+        logger.error(str(e))
+        messages.error(request, "Playing the computer is not available right now.")
+        return redirect('home')
+    if request.POST.get('color') == 'black':
+        white, black = bot, request.user
+    else:
+        white, black = request.user, bot
+    player_board = ChessGame.objects.create(user=request.user, fen=chess.STARTING_FEN)
+    game = Game.objects.create(player1=white, player2=black, board=player_board, current_turn=white)
+    logger.info(f"Game {game.id} created between User {request.user.id} and the computer")
+    invalidate_lobby(request.user.id)
+    return redirect('play_game', game_id=game.id)
+
+
 @csrf_exempt
 @login_required(login_url='/login/')
 def game_result(request, game_id):
     try:
-        game = Game.objects.get(id=game_id)
+        game = Game.objects.select_related('player1', 'player2', 'winner').get(id=game_id)
     except Game.DoesNotExist:
         return HttpResponse("Game not found", status=404)
 
-    # Determine the result message based on who the winner is
-    if game.winner == request.user:
-        message = "You won!"
+    # Determine the result message based on who the winner is, and who is looking
+    if game.winner_id is None:
+        outcome = 'draw'
+        message = f"Draw: {game.get_termination_display().lower()}." if game.termination else "Draw."
+    elif request.user.id not in (game.player1_id, game.player2_id):
+        outcome = None  # A spectator
+        message = f"{game.winner.username} won!"
+    elif game.winner_id == request.user.id:
+        outcome, message = 'won', "You won!"
     else:
-        message = "You lost!"
+        outcome, message = 'lost', "You lost!"
 
     return render(request, 'chess_app/game_res.html', {
         'message': message,
-        'game': game
+        'outcome': outcome,
+        'game': game,
+        'analysis': analysis_report(game),
     })
 
 def newGame(request):
@@ -280,12 +303,10 @@ def delete_game(request, game_id):
         # Ensure the user is either player1 or player2 for the game being deleted
         game = Game.objects.get(Q(player1=request.user) | Q(player2=request.user), id=game_id)
         
-        # Check if the game has already been marked as deleted for this user
-        deleted_game = DeletedGame.objects.filter(user=request.user, game=game).first()
-        
-        if not deleted_game:
-            # Mark the game as deleted for the current user by creating a new DeletedGame entry
-            DeletedGame.objects.create(user=request.user, game=game)
+        # Mark the game as deleted for the current user only; update() leaves updated_at, the history order, alone
+        hidden_field = 'hidden_by_player1' if game.player1_id == request.user.id else 'hidden_by_player2'
+        if Game.objects.filter(id=game.id, **{hidden_field: False}).update(**{hidden_field: True}):
+            invalidate_lobby(request.user.id)
             messages.success(request, "Game deleted from your history successfully.")
         else:
             messages.warning(request, "This game has already been deleted from your history.")
@@ -296,6 +317,19 @@ def delete_game(request, game_id):
         return HttpResponse("Game not found", status=404)
 
 
+@login_required(login_url='/login/')
+def completed_games(request):
+    """
+    The next page of the user's finished games after ?cursor=, for the
+    lobby's infinite scroll; pass the returned `next` back for the page after.
+    """
+    try:
+        games, next_cursor = completed_games_page(request.user, cursor=request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': "Invalid cursor."}, status=400)
+    return JsonResponse({'games': games, 'next': next_cursor})
+
+
 
 
 @csrf_exempt
@@ -369,20 +403,13 @@ def user_logout(request):
     logout(request)
     messages.success(request, "Logged out successfully.")
 
-    # Mark user as offline in the database
-    OnlineUser.objects.filter(user=user).delete()
+    # Mark user as offline
+    if user.is_authenticated:
+        get_presence().clear(user)
 
     # Notify other users via the channel layer
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "all_users",
-        {
-            "type": "user_status",
-            "user_id": user.id,
-            "username": user.username,
-            "status": "offline",
-        }
-    )
+    async_to_sync(channel_layer.group_send)("all_users", presence_diff_event(offline=[user.id]))
 
     return redirect('/')
 
@@ -405,7 +432,7 @@ def edit_journal(request, game_id):
     game = get_object_or_404(Game, id=game_id)
 
     # Check if the user is a player in this game
-    if request.user not in [game.player1, game.player2]:
+    if request.user.id not in (game.player1_id, game.player2_id):
         return HttpResponse("You are not authorized to edit this journal entry.", status=403)
 
     # Get or create the journal entry for the current user and game
@@ -418,6 +445,7 @@ def edit_journal(request, game_id):
             journal.user = request.user
             journal.game = game
             journal.save()
+            invalidate_lobby(request.user.id)
             messages.success(request, "Journal updated successfully.")
             return redirect('home')
     else:
@@ -539,4 +567,74 @@ def check_for_game(request):
 
 #         except Challenge.DoesNotExist:
 #             logger.error(f"Challenge not found between User {user_id} and User {request.user.id}.")
-#             return JsonResponse({'status': 'error', 'error': "Challenge not found."})
\ No newline at end of file
+#             return JsonResponse({'status': 'error', 'error': "Challenge not found."})
+
+
+@login_required(login_url='/login/')
+def opening_explorer(request):
+    """The moves played from a position (?fen=..., the starting position by default) and their results."""
+    try:
+        board = chess.Board(request.GET.get('fen') or chess.STARTING_FEN)
+    except ValueError:
+        return JsonResponse({'error': "Invalid FEN."}, status=400)
+    return JsonResponse({'fen': board.fen(), 'moves': explore(board)})
+
+
+@login_required(login_url='/login/')
+def export_games(request):
+    """
+    Downloads the user's finished games as PGN, streamed in batches.
+    ?since= and ?until= (YYYY-MM-DD) limit the range, ?gzip=1 compresses.
+    """
+    try:
+        since, until = (
+            date.fromisoformat(request.GET[key]) if request.GET.get(key) else None for key in ('since', 'until')
+        )
+    except ValueError:
+        return JsonResponse({'error': "Dates must be given as YYYY-MM-DD."}, status=400)
+
+    stream = export_pgn(finished_games(request.user, since, until))
+    filename = f"{request.user.username}_games.pgn"
+    if request.GET.get('gzip') == '1':
+        response = StreamingHttpResponse(gzip_stream(stream), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(stream, content_type='application/x-chess-pgn')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required(login_url='/login/')
+def search_positions(request):
+    """
+    Games that reached a position (?fen=...) or a material balance
+    (?material=KQvKR, white's pieces first), a page at a time: pass the
+    returned `next` as ?after= for the following page.
+    """
+    try:
+        # One more than a page tells whether there is another
+        if request.GET.get('fen'):
+            found = find_games(board=chess.Board(request.GET['fen']), after=int(request.GET.get('after', 0)), limit=PAGE_SIZE + 1)
+        elif request.GET.get('material'):
+            found = find_games(material=parse_material(request.GET['material']), after=int(request.GET.get('after', 0)), limit=PAGE_SIZE + 1)
+        else:
+            return JsonResponse({'error': "Give a fen or a material parameter."}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    more = len(found) > PAGE_SIZE
+    found = found[:PAGE_SIZE]
+
+    games = Game.objects.select_related('player1', 'player2').in_bulk([game_id for game_id, _ in found])
+    return JsonResponse({
+        'games': [
+            {
+                'id': game_id,
+                'ply': ply,
+                'white': games[game_id].player1.username,
+                'black': games[game_id].player2.username,
+                'status': games[game_id].status,
+            }
+            for game_id, ply in found
+        ],
+        'next': found[-1][0] if more else None,
+    })
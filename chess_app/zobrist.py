@@ -0,0 +1,120 @@
+# zobrist.py
+import chess
+from chess.polyglot import POLYGLOT_RANDOM_ARRAY, zobrist_hash
+
+from .utils import decode_move
+
+# Offsets into the Polyglot random array, so our hashes equal chess.polyglot.zobrist_hash()
+CASTLING_KEYS = (
+    (chess.BB_H1, POLYGLOT_RANDOM_ARRAY[768]),
+    (chess.BB_A1, POLYGLOT_RANDOM_ARRAY[769]),
+    (chess.BB_H8, POLYGLOT_RANDOM_ARRAY[770]),
+    (chess.BB_A8, POLYGLOT_RANDOM_ARRAY[771]),
+)
+EP_KEYS = POLYGLOT_RANDOM_ARRAY[772:780]
+TURN_KEY = POLYGLOT_RANDOM_ARRAY[780]
+
+# PIECE_KEYS[color][piece_type][square]
+PIECE_KEYS = [
+    [None] + [
+        [POLYGLOT_RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + color) + square] for square in chess.SQUARES]
+        for piece_type in chess.PIECE_TYPES
+    ]
+    for color in (chess.BLACK, chess.WHITE)
+]
+
+
+def state_key(board):
+    """Hash contribution of castling rights, en passant file and side to move."""
+    key = TURN_KEY if board.turn == chess.WHITE else 0
+    castling = board.clean_castling_rights()
+    for mask, value in CASTLING_KEYS:
+        if castling & mask:
+            key ^= value
+    if board.ep_square is not None:
+        # Only counts when a pawn stands ready to capture, as in Polyglot
+        if board.turn == chess.WHITE:
+            ep_mask = chess.shift_down(chess.BB_SQUARES[board.ep_square])
+        else:
+            ep_mask = chess.shift_up(chess.BB_SQUARES[board.ep_square])
+        ep_mask = chess.shift_left(ep_mask) | chess.shift_right(ep_mask)
+        if ep_mask & board.occupied_co[board.turn] & board.pawns:
+            key ^= EP_KEYS[chess.square_file(board.ep_square)]
+    return key
+
+
+def push(board, move, key):
+    """
+    Pushes a legal move onto the board and returns the position's new Zobrist
+    key, updated from `key` (the key before the move) in constant time.
+    """
+    key ^= state_key(board)
+    color = board.turn
+    piece_type = board.piece_type_at(move.from_square)
+    key ^= PIECE_KEYS[color][piece_type][move.from_square]
+
+    if board.is_castling(move):
+        # Standard notation (e1g1): the rook jumps from the corner next to the king
+        rank = chess.square_rank(move.from_square)
+        if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+            rook_from, rook_to, king_to = chess.square(7, rank), chess.square(5, rank), chess.square(6, rank)
+        else:
+            rook_from, rook_to, king_to = chess.square(0, rank), chess.square(3, rank), chess.square(2, rank)
+        key ^= PIECE_KEYS[color][chess.ROOK][rook_from] ^ PIECE_KEYS[color][chess.ROOK][rook_to]
+        key ^= PIECE_KEYS[color][chess.KING][king_to]
+    else:
+        if board.is_en_passant(move):
+            captured_square = move.to_square + (-8 if color == chess.WHITE else 8)
+            key ^= PIECE_KEYS[not color][chess.PAWN][captured_square]
+        else:
+            captured_type = board.piece_type_at(move.to_square)
+            if captured_type:
+                key ^= PIECE_KEYS[not color][captured_type][move.to_square]
+        key ^= PIECE_KEYS[color][move.promotion or piece_type][move.to_square]
+
+    board.push(move)
+    return key ^ state_key(board)
+
+
+class ZobristTracker:
+    """
+    Incrementally hashed position plus a count of how often each position has
+    occurred since the last capture or pawn move (earlier positions can never
+    recur), so threefold repetition is detected in O(1) per move.
+    """
+
+    def __init__(self, board):
+        self.key = zobrist_hash(board)
+        self.counts = {self.key: 1}
+
+    def push(self, board, move):
+        self.key = push(board, move, self.key)
+        if board.halfmove_clock == 0:
+            self.counts = {self.key: 1}
+        else:
+            self.counts[self.key] = self.counts.get(self.key, 0) + 1
+        return self.key
+
+    def is_threefold_repetition(self):
+        return self.counts.get(self.key, 0) >= 3
+
+    @classmethod
+    def rebuild(cls, game, board):
+        """
+        Rebuilds the tracker for `board`, the game's current position, by
+        replaying the logged moves since the last capture or pawn move.
+        Replays at most 100 plies however long the game is.
+        """
+        start_ply = game.move_count - board.halfmove_clock
+        if board.halfmove_clock == 0 or start_ply < 0:
+            return cls(board)
+
+        replay = game.position_at(start_ply)
+        tracker = cls(replay)
+        moves = game.moves.filter(ply__gt=start_ply).order_by('ply').values_list('move', flat=True)
+        for encoded in moves:
+            tracker.push(replay, decode_move(encoded))
+        if tracker.key != zobrist_hash(board):
+            # The move log does not cover this game (e.g. it predates the log)
+            return cls(board)
+        return tracker
@@ -92,6 +92,77 @@ CHANNEL_LAYERS = {
 },
 }
 
+# Who is online (see chess_app/presence.py). "redis" keeps presence out of the database;
+# "database" falls back to the OnlineUser table.
+PRESENCE = {
+    "BACKEND": "redis",
+    "REDIS_URL": "redis://localhost:6379/0",
+    "TTL": 180,  # seconds without a heartbeat before a user is considered offline
+    "BROADCAST_INTERVAL": 0.5,  # seconds over which online/offline changes are merged into one message
+    "DISCONNECT_GRACE": 1.0,  # seconds a user may reconnect before being announced offline
+}
+
+# Live chess.Board objects kept in memory per worker process (see chess_app/board_cache.py)
+LIVE_BOARD_CACHE_SIZE = 1024
+LIVE_BOARD_IDLE_TIMEOUT = 600  # seconds
+LEGAL_MOVE_CACHE_SIZE = 50000  # positions whose legal moves are kept, shared by all games
+GAME_UPDATE_BUFFER_SIZE = 64  # recent updates per game replayed to reconnecting clients
+SPECTATOR_UPDATE_INTERVAL = 0.25  # seconds between updates to one spectator; bursts in between are merged
+
+# Time controls offered when challenging, as (base seconds, increment seconds); (0, 0) is a game without clocks
+TIME_CONTROLS = [(0, 0), (60, 0), (180, 2), (300, 3), (600, 0), (900, 10)]
+
+# Automatic pairing (see chess_app/matchmaking.py). Players are paired when their ratings
+# differ by no more than both of their windows, which widen while they wait.
+MATCHMAKING = {
+    "BUCKET_WIDTH": 50,  # rating points per bucket
+    "INITIAL_WINDOW": 100,  # rating points
+    "WINDOW_GROWTH": 10,  # rating points per second of waiting
+    "MAX_WINDOW": 400,
+    "INTERVAL": 1.0,  # seconds between passes over the waiting players
+}
+
+# Built-in engine for games against the computer (see chess_app/engine.py). Searches run
+# in a pool of WORKERS processes, MOVE_TIME seconds per move.
+ENGINE = {
+    "WORKERS": 2,
+    "MOVE_TIME": 1.0,
+    "MAX_DEPTH": 64,
+    "USERNAME": "chess_bot",  # the computer's user account, created on first use
+}
+
+# Per-user lobby snapshot behind the home page (see chess_app/lobby.py), kept TTL seconds in
+# the CACHE cache and dropped on challenge and game events. With several server processes,
+# point CACHE at a shared cache (e.g. Redis) so every process sees the invalidations.
+LOBBY = {
+    "TTL": 10,
+    "CACHE": "default",
+    "GAMES": 20,  # most recent finished games listed
+}
+
+# Plies of each finished game counted by the opening explorer (see chess_app/explorer.py)
+OPENING_EXPLORER_PLIES = 40
+
+# Post-game analysis (see chess_app/analysis.py). Every position of a finished game is
+# searched for NODES nodes on a pool of WORKERS processes, BATCH_SIZE games at a time.
+# With IN_PROCESS off, the web server only queues games and `manage.py analyze_games`
+# drains the queue.
+ANALYSIS = {
+    "WORKERS": 2,
+    "NODES": 3000,
+    "MAX_DEPTH": 6,
+    "BATCH_SIZE": 20,
+    "IN_PROCESS": True,
+}
+
+# Thread pool for the WebSocket consumers' database work (see chess_app/db_executor.py).
+# Moves are queued ahead of game actions, which are queued ahead of presence updates.
+# WORKERS = 0 falls back to Channels' single thread-sensitive executor.
+CHANNELS_DB_EXECUTOR = {
+    "WORKERS": 4,
+    "WARN_DEPTH": 100,  # log a warning when a lane has this many queued jobs
+}
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
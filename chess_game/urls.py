@@ -34,15 +34,20 @@ urlpatterns = [
     path('journal/add/', journal_views.add),
     path('journal/edit/<int:id>/', journal_views.edit),
     path('play/<int:game_id>/', view1_app.play_game, name='play_game'),
+    path('play_computer/', view1_app.play_computer, name='play_computer'),
     # path('game_res/<int:game_id>/', view1_app.game_result, name='game_result'),
     path('game_result/<int:game_id>/', view1_app.game_result, name='game_res'),
     path('game/result/<int:game_id>/', view1_app.game_result, name='game_result'),
     path('edit-journal/<int:game_id>/', view1_app.edit_journal, name='edit_journal'),
     path('delete_game/<int:game_id>/', view1_app.delete_game, name='delete_game'),
+    path('games/completed/', view1_app.completed_games, name='completed_games'),
 
     # path('poll_available_users/', view1_app.poll_available_users, name='poll_available_users'),
     # path('poll_game_status/<int:game_id>/', view1_app.poll_game_status, name='poll_game_status'),
     path('check_for_game/', view1_app.check_for_game, name='check_for_game'),
+    path('explorer/', view1_app.opening_explorer, name='opening_explorer'),
+    path('export/', view1_app.export_games, name='export_games'),
+    path('positions/', view1_app.search_positions, name='search_positions'),
 
     path('send_challenge/<int:user_id>/', view1_app.send_challenge, name='send_challenge'),
     path('handle_challenge/<int:user_id>/<str:action>/', view1_app.handle_challenge, name='handle_challenge'),
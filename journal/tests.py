@@ -1,3 +1,48 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from chess_app.tests import QueryBudgetMixin
+from journal.models import JournalEntry
+
+
+class JournalBudgetTests(QueryBudgetMixin, TestCase):
+    """Query and time budgets of the journal pages, for a user with a few hundred entries. Each counts the session and user queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='writer')
+        entries = JournalEntry.objects.bulk_create([
+            JournalEntry(user=cls.user, description=f"Day {n}", entry="Worked through rook endgames.")
+            for n in range(300)
+        ])
+        cls.entry_id = entries[0].id
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        # The test client loads the middleware on its first request; keep that out of the timings
+        self.client.get('/rules/')
+
+    def test_journal(self):
+        with self.assertBudget(3, seconds=0.2):
+            response = self.client.get('/journal/')
+        self.assertContains(response, "Day 299")
+
+    def test_add(self):
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.post('/journal/add/', {'add': '', 'description': "Day 300", 'entry': "Studied openings."})
+        self.assertEqual(response.status_code, 302)
+
+    def test_edit(self):
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.get(f'/journal/edit/{self.entry_id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_save(self):
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.post(f'/journal/edit/{self.entry_id}/', {'edit': '', 'description': "Day 0", 'entry': "Rewritten."})
+        self.assertEqual(response.status_code, 302)
+
+    def test_delete(self):
+        with self.assertBudget(3, seconds=0.05):
+            response = self.client.get('/journal/', {'delete': self.entry_id})
+        self.assertEqual(response.status_code, 302)
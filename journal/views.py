@@ -4,7 +4,6 @@ from django.shortcuts import render
 from django.shortcuts import render, redirect
 from django.http import HttpResponse
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import User
 from django.shortcuts import render
 from journal.models import JournalEntry
 from journal.forms import JournalEntryForm
@@ -30,7 +29,7 @@ def add(request):
             if (add_form.is_valid()):
                 description = add_form.cleaned_data["description"]
                 entry = add_form.cleaned_data["entry"]
-                user = User.objects.get(id=request.user.id)
+                user = request.user
                 JournalEntry(user=user, description=description, entry=entry).save()
                 return redirect("/journal/")
             else: